@@ -1,8 +1,9 @@
 import streamlit as st
-from client import MCPOpenAIClient
+from client import ClientRuntime
 import dotenv
 import logging
 import asyncio
+import os
 import nest_asyncio
 
 nest_asyncio.apply()
@@ -19,18 +20,57 @@ st.title("Uncover")
 # set up session state variables
 if "messages" not in st.session_state:
     st.session_state.messages = []
-if "client" not in st.session_state:
-    st.session_state.client = MCPOpenAIClient()
-    st.session_state.client.connect_to_server("http://localhost:8050/mcp")
+
+
+@st.cache_resource
+def get_runtime() -> ClientRuntime:
+    # one event loop, OpenAI client and MCP connection pool for every session in this process;
+    # UNCOVER_SPECULATE=1 warms geocodes and tiles for each query while the model thinks
+    return ClientRuntime("http://localhost:8050/mcp", speculate=os.environ.get("UNCOVER_SPECULATE") == "1")
+
+
+if "chat" not in st.session_state:
+    st.session_state.chat = get_runtime().handle()
+
+
+def stream_text(events, status, usage):
+    """Yield the assistant's text deltas for st.write_stream; report tool progress in `status`
+    and copy the turn's token counts into `usage`."""
+    for event in events:
+        if event["type"] == "delta":
+            yield event["content"]
+        elif event["type"] == "tool_call":
+            status.update(label=f"Running {event['name']}...", state="running")
+            status.write(f"Calling `{event['name']}`")
+        elif event["type"] == "tool_result":
+            status.write(f"`{event['name']}` finished")
+        elif event["type"] == "done":
+            usage.update(event["usage"])
+
+
+def usage_caption(usage):
+    return (
+        f"{usage['prompt_tokens']} prompt tokens ({usage['cached_tokens']} cached), "
+        f"{usage['completion_tokens']} completion tokens, {usage['history_tokens']} tokens of history"
+    )
 
 
 for msg in st.session_state.messages:
-    st.chat_message(msg["role"]).write(msg["content"])
+    with st.chat_message(msg["role"]):
+        st.write(msg["content"])
+        if "history_tokens" in msg.get("usage", {}):
+            st.caption(usage_caption(msg["usage"]))
 
 if prompt := st.chat_input("Say something..."):
     st.session_state.messages.append({"role": "user", "content": prompt})
     st.chat_message("user").write(prompt)
 
-    response = st.session_state.client.process_query(prompt)
-    st.session_state.messages.append({"role": "assistant", "content": response})
-    st.chat_message("assistant").write(response)
+    with st.chat_message("assistant"):
+        status = st.status("Thinking...")
+        events = st.session_state.chat.process_query_stream(prompt)
+        usage = {}
+        response = st.write_stream(stream_text(events, status, usage))
+        status.update(label="Done", state="complete")
+        if "history_tokens" in usage:
+            st.caption(usage_caption(usage))
+    st.session_state.messages.append({"role": "assistant", "content": response, "usage": usage})
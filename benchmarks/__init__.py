@@ -0,0 +1,16 @@
+"""
+Benchmarks for the server's hot paths.
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --baseline results.json        # compare, exit 1 on regressions
+
+Scenario groups (each runs in its own interpreter, against local stand-ins for
+Nominatim, the tile server and OpenAI):
+    render:  generate_map at 10/1k/10k markers for each output profile, a 20-map series
+             (single versus generate_maps batch), and render cache hits
+    geocode: cold (stand-in request) versus warm (memory, disk) lookups, single and batched
+    mcp:     server.py cold start and tool-call round trips over streamable HTTP
+    load:    concurrent users running full process_query loops through one ClientRuntime
+    publish: the durable publish queue against a fake uploader: enqueue, retries, dedupe
+             and recovery of jobs left running by a crashed process
+"""
@@ -0,0 +1,106 @@
+# __main__.py
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+from benchmarks.harness import compare
+from benchmarks.scenarios import GROUPS, REPO_ROOT
+
+
+def _run_group(group: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Run one scenario group in a fresh interpreter so imports, caches and peak RSS don't leak between groups."""
+    command = [
+        sys.executable, "-m", "benchmarks", "--child", group,
+        "--nominatim-latency", str(args.nominatim_latency),
+        "--llm-latency", str(args.llm_latency),
+    ]
+    if args.quick:
+        command.append("--quick")
+    result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"benchmark group {group} failed:\n{result.stderr[-4000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _git_commit() -> str:
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark map rendering, geocoding, MCP round trips and concurrent client load.",
+    )
+    parser.add_argument("--groups", default=",".join(GROUPS), help=f"comma separated subset of: {', '.join(GROUPS)}")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations and smaller scenarios")
+    parser.add_argument("--output", help="write the results JSON here instead of stdout")
+    parser.add_argument("--baseline", help="compare against a previous results JSON; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression as a fraction (default 0.25)")
+    parser.add_argument("--nominatim-latency", type=float, default=0.05, help="stand-in Nominatim response time (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="mocked OpenAI time to first chunk (s)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with tempfile.TemporaryDirectory(prefix="uncover-bench-") as workdir:
+            results = GROUPS[args.child](
+                workdir=workdir,
+                quick=args.quick,
+                nominatim_latency=args.nominatim_latency,
+                llm_latency=args.llm_latency,
+            )
+        print(json.dumps(results))
+        return 0
+
+    groups = [g.strip() for g in args.groups.split(",") if g.strip()]
+    unknown = [g for g in groups if g not in GROUPS]
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(unknown)}")
+
+    scenarios: Dict[str, Dict[str, Any]] = {}
+    for group in groups:
+        print(f"running {group}...", file=sys.stderr)
+        start = time.perf_counter()
+        scenarios.update(_run_group(group, args))
+        print(f"  {group} done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    document = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+            "nominatim_latency": args.nominatim_latency,
+            "llm_latency": args.llm_latency,
+        },
+        "scenarios": scenarios,
+    }
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(scenarios, baseline["scenarios"], args.tolerance)
+        print("\n".join(lines), file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
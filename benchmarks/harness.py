@@ -0,0 +1,104 @@
+# harness.py
+import math
+import os
+import resource
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# metrics where a larger value is a regression; everything else listed in
+# COMPARED_METRICS is "higher is better"
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+COMPARED_METRICS = LOWER_IS_BETTER + ("throughput_per_s",)
+# latency differences smaller than this are timer noise, whatever the relative change
+MIN_LATENCY_DELTA_MS = 0.05
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[float], wall: Optional[float] = None, **extra: Any) -> Dict[str, Any]:
+    """
+    Latency summary of `samples` (seconds) in milliseconds.
+
+    Throughput is operations per second of `wall` time when given (concurrent runs),
+    otherwise of the summed sample time.
+    """
+    ordered = sorted(samples)
+    elapsed = wall if wall is not None else sum(ordered)
+    return {
+        "iterations": len(ordered),
+        "p50_ms": round(percentile(ordered, 50) * 1e3, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1e3, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1e3, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1e3, 3) if ordered else 0.0,
+        "min_ms": round(ordered[0] * 1e3, 3) if ordered else 0.0,
+        "max_ms": round(ordered[-1] * 1e3, 3) if ordered else 0.0,
+        "throughput_per_s": round(len(ordered) / elapsed, 3) if elapsed else 0.0,
+        **extra,
+    }
+
+
+def timed(func: Callable[[int], Any], iterations: int, warmup: int = 1) -> List[float]:
+    """Call `func(i)` `warmup` times untimed, then `iterations` times; returns the durations in seconds."""
+    for i in range(warmup):
+        func(i)
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process."""
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)
+
+
+def process_peak_rss_mb(pid: int) -> Optional[float]:
+    """Peak resident set size of another (live) process, where /proc is available."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def compare(
+    results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float
+) -> Tuple[List[str], List[str]]:
+    """
+    Compare scenario results against a baseline run.
+
+    Returns (report lines, regressions). A metric regresses when it is worse than the
+    baseline by more than `tolerance` (a fraction, e.g. 0.2 for 20%) and, for latencies,
+    by at least MIN_LATENCY_DELTA_MS.
+    """
+    lines, regressions = [], []
+    for name in sorted(results):
+        if name not in baseline:
+            lines.append(f"{name}: new scenario")
+            continue
+        for metric in COMPARED_METRICS:
+            new, old = results[name].get(metric), baseline[name].get(metric)
+            if new is None or old is None or old == 0:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+            if metric.endswith("_ms") and abs(new - old) < MIN_LATENCY_DELTA_MS:
+                worse = False
+            line = f"{name} {metric}: {old} -> {new} ({change:+.1%})"
+            lines.append(line + ("  REGRESSION" if worse else ""))
+            if worse:
+                regressions.append(line)
+    return lines, regressions
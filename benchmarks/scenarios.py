@@ -0,0 +1,384 @@
+# scenarios.py
+import asyncio
+import contextlib
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from benchmarks.harness import peak_rss_mb, process_peak_rss_mb, summarize, timed
+from benchmarks.standins import FakeUploader, NominatimHandler, OpenAIHandler, StandIn, TileHandler, start
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# every border/marker set is generated from this seed so runs are comparable
+SEED = 1234
+BORDER = ((44.90, -93.35), (45.00, -93.20))
+COLORS = ("red", "blue", "green", "purple")
+
+Results = Dict[str, Dict[str, Any]]
+
+
+def prepare_environment(workdir: str, standins: Dict[str, StandIn]) -> Dict[str, str]:
+    """
+    Point every cache, queue and external endpoint at `workdir` and the stand-ins.
+
+    Must run before any service module is imported (they read the environment on import).
+    Returns the variables that were set, for passing on to a server subprocess.
+    """
+    env = {
+        "GEOCODE_CACHE_PATH": os.path.join(workdir, "geocode.sqlite"),
+        "TILE_CACHE_PATH": os.path.join(workdir, "tiles.sqlite"),
+        "RENDER_CACHE_DIR": os.path.join(workdir, "renders"),
+        "PREPARED_IMAGE_DIR": os.path.join(workdir, "prepared"),
+        "PUBLISH_QUEUE_PATH": os.path.join(workdir, "publish_queue.sqlite"),
+        "INSTAGRAM_SESSION_PATH": os.path.join(workdir, "instagram_session.json"),
+        # no gazetteer index here, so every miss goes to the Nominatim stand-in
+        "GAZETTEER_INDEX": os.path.join(workdir, "gazetteer"),
+        "NOMINATIM_RATE": "1000000",
+    }
+    if "nominatim" in standins:
+        env["NOMINATIM_URL"] = standins["nominatim"].url + "/search"
+    if "tiles" in standins:
+        env["BASEMAP_URL"] = standins["tiles"].url + "/{z}/{x}/{y}.png"
+    if "openai" in standins:
+        env["OPENAI_BASE_URL"] = standins["openai"].url + "/v1"
+        env["OPENAI_API_KEY"] = "bench"
+    os.environ.update(env)
+    return env
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def serve(env: Dict[str, str]) -> Iterator[Tuple[subprocess.Popen, str, float]]:
+    """
+    Run server.py in a subprocess.
+
+    Yields (process, MCP url, launch time from time.perf_counter()).
+    """
+    port = _free_port()
+    launched = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "server.py"],
+        cwd=REPO_ROOT,
+        env={**os.environ, **env, "MCP_HOST": "127.0.0.1", "MCP_PORT": str(port)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        yield process, f"http://127.0.0.1:{port}/mcp", launched
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _markers(count: int) -> List[Tuple[float, float, str, Any]]:
+    rng = random.Random(SEED)
+    (south, west), (north, east) = BORDER
+    return [
+        (rng.uniform(south, north), rng.uniform(west, east), COLORS[i % len(COLORS)], f"Place {i}" if i % 10 == 0 else None)
+        for i in range(count)
+    ]
+
+
+def run_render(workdir: str, quick: bool, **_: Any) -> Results:
+    """
+    generate_map at several marker counts and output profiles (dpi), a 20-map series
+    rendered singly and with generate_maps, render cache hits, and peak RSS growth over
+    a long run of consecutive renders.
+    """
+    tiles = start(TileHandler)
+    prepare_environment(workdir, {"tiles": tiles})
+    from service.generate_map import RENDER_PROFILES, generate_map
+
+    results: Results = {}
+    for count in (10, 1000) if quick else (10, 1000, 10000):
+        markers = _markers(count)
+        for profile in ("preview", "instagram_square", "print"):
+            iterations = 2 if quick else (3 if profile == "print" else 5)
+            output = os.path.join(workdir, f"render_{count}_{profile}")
+            samples = timed(
+                lambda i: generate_map(output, BORDER, markers, use_cache=False, profile=profile),
+                iterations,
+            )
+            results[f"render.markers_{count}.{profile}"] = summarize(
+                samples, markers=count, dpi=RENDER_PROFILES[profile]["dpi"], peak_rss_mb=peak_rss_mb()
+            )
+
+    # a campaign: 20 maps of one city with different marker subsets, one at a time versus batched
+    from service.generate_map import generate_maps
+
+    series = [_markers(50)[i::20] for i in range(20)]
+    iterations = 1 if quick else 3
+    samples = timed(
+        lambda i: [generate_map(os.path.join(workdir, f"series_{j}"), BORDER, m, use_cache=False, profile="instagram_square")
+                   for j, m in enumerate(series)],
+        iterations,
+    )
+    results["render.series_20.single"] = summarize(samples, maps=20)
+    specs = [{"border": BORDER, "markers": m, "profile": "instagram_square"} for m in series]
+    samples = timed(lambda i: list(generate_maps(specs, use_cache=False)), iterations)
+    results["render.series_20.batch"] = summarize(samples, maps=20, peak_rss_mb=peak_rss_mb())
+
+    markers = _markers(1000)
+    output = os.path.join(workdir, "render_cached")
+    samples = timed(lambda i: generate_map(output, BORDER, markers, profile="instagram_square"), 20 if quick else 100)
+    results["render.cache_hit"] = summarize(samples, markers=1000, peak_rss_mb=peak_rss_mb())
+
+    # steady state: every render reuses pooled figures, so peak RSS should stop growing after warm-up
+    from service.generate_map import generate_map_bytes
+
+    markers = _markers(100)
+    render = lambda i: generate_map_bytes(BORDER, markers[: i % 100], use_cache=False, profile="preview")
+    timed(render, 50, warmup=0)
+    warm_rss = peak_rss_mb()
+    samples = timed(render, 200 if quick else 2000, warmup=0)
+    results["render.steady_state"] = summarize(
+        samples, peak_rss_mb=peak_rss_mb(), rss_growth_mb=round(peak_rss_mb() - warm_rss, 1)
+    )
+    tiles.close()
+    return results
+
+
+def run_geocode(workdir: str, quick: bool, nominatim_latency: float, **_: Any) -> Results:
+    """Cold (stand-in request) versus warm (memory and disk cache) geocoding, single and batched."""
+    nominatim = start(NominatimHandler, latency=nominatim_latency)
+    prepare_environment(workdir, {"nominatim": nominatim})
+    from service.geocode import geocode_many, geocode_place, geocode_cache
+    from service.geocode_cache import GeocodeCache
+
+    iterations = 20 if quick else 100
+    places = [f"Bench City {i}" for i in range(iterations)]
+    results: Results = {}
+
+    samples = timed(lambda i: geocode_place(places[i]), iterations, warmup=0)
+    results["geocode.cold"] = summarize(samples, backend_requests=nominatim.server.RequestHandlerClass.requests)
+
+    samples = timed(lambda i: geocode_place(places[i % iterations]), iterations * 10)
+    results["geocode.warm_memory"] = summarize(samples)
+
+    # a fresh cache object has an empty memory tier, so these are served from SQLite
+    disk_cache = GeocodeCache(path=geocode_cache.path)
+    samples = timed(lambda i: disk_cache.get(places[i]), iterations, warmup=0)
+    results["geocode.warm_disk"] = summarize(samples)
+
+    batches = 5 if quick else 20
+    samples = timed(lambda i: geocode_many([f"Batch {i} City {j}" for j in range(20)]), batches, warmup=0)
+    results["geocode.batch20_cold"] = summarize(samples, places_per_call=20)
+    samples = timed(lambda i: geocode_many([f"Batch {i} City {j}" for j in range(20)]), batches, warmup=0)
+    results["geocode.batch20_warm"] = summarize(samples, places_per_call=20, peak_rss_mb=peak_rss_mb())
+    nominatim.close()
+    return results
+
+
+async def _first_call(url: str, launched: float, timeout: float = 60.0) -> float:
+    """Retry `add` until the server answers; returns seconds since launch."""
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            async with streamablehttp_client(url) as (read, write, _):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    await session.call_tool("add", {"a": 1, "b": 2})
+                    return time.perf_counter() - launched
+        except Exception:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.02)
+
+
+async def _round_trips(url: str, iterations: int) -> Dict[str, List[float]]:
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+
+    calls = {
+        "add": lambda s: s.call_tool("add", {"a": 1, "b": 2}),
+        "geocode_point": lambda s: s.call_tool("geocode_point", {"place": "Bench Round Trip"}),
+        "list_tools": lambda s: s.list_tools(),
+    }
+    samples: Dict[str, List[float]] = {name: [] for name in calls}
+    async with streamablehttp_client(url) as (read, write, _):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            for name, call in calls.items():
+                await call(session)  # warm-up (also fills the geocode cache)
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    await call(session)
+                    samples[name].append(time.perf_counter() - start)
+    return samples
+
+
+def run_mcp(workdir: str, quick: bool, nominatim_latency: float, **_: Any) -> Results:
+    """server.py cold start and tool-call round trips over streamable HTTP."""
+    nominatim = start(NominatimHandler, latency=nominatim_latency)
+    env = prepare_environment(workdir, {"nominatim": nominatim})
+    results: Results = {}
+    with serve(env) as (process, url, launched):
+        cold_start = asyncio.run(_first_call(url, launched))
+        results["mcp.cold_start"] = summarize([cold_start])
+        samples = asyncio.run(_round_trips(url, 30 if quick else 200))
+        server_rss = process_peak_rss_mb(process.pid)
+    for name, values in samples.items():
+        results[f"mcp.roundtrip.{name}"] = summarize(values, server_peak_rss_mb=server_rss)
+    nominatim.close()
+    return results
+
+
+def run_load(workdir: str, quick: bool, nominatim_latency: float, llm_latency: float, **_: Any) -> Results:
+    """
+    Concurrent users running full process_query loops (OpenAI -> geocode_point -> OpenAI)
+    through one ClientRuntime against server.py, with a mocked OpenAI endpoint.
+
+    The load.cold scenarios ask for places nobody asked for before, without and with
+    client speculation; the latter reports the speculation hit rates.
+    """
+    nominatim = start(NominatimHandler, latency=nominatim_latency)
+    openai = start(OpenAIHandler, latency=llm_latency)
+    env = prepare_environment(workdir, {"nominatim": nominatim, "openai": openai})
+    from client import ClientRuntime
+
+    queries_per_user = 3 if quick else 10
+    results: Results = {}
+    with serve(env) as (process, url, launched):
+        asyncio.run(_first_call(url, launched))
+        runtime = ClientRuntime(url, pool_size=8)
+        for users in (1, 8) if quick else (1, 8, 32):
+            samples: List[float] = []
+            lock = threading.Lock()
+
+            def user(n: int) -> None:
+                handle = runtime.handle()
+                for q in range(queries_per_user):
+                    start_time = time.perf_counter()
+                    handle.process_query(f"Load City {(n * queries_per_user + q) % 50}")
+                    with lock:
+                        samples.append(time.perf_counter() - start_time)
+                handle.close()
+
+            threads = [threading.Thread(target=user, args=(n,)) for n in range(users)]
+            wall_start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[f"load.users_{users}"] = summarize(
+                samples,
+                wall=time.perf_counter() - wall_start,
+                users=users,
+                peak_rss_mb=peak_rss_mb(),
+                server_peak_rss_mb=process_peak_rss_mb(process.pid),
+                connections=runtime.stats()["connections"],
+            )
+        runtime.close()
+
+        for speculate in (False, True):
+            runtime = ClientRuntime(url, pool_size=1, speculate=speculate)
+            handle = runtime.handle()
+            name = "cold_speculate" if speculate else "cold"
+            samples = timed(lambda i: handle.process_query(f"{name.title()} City {i}"), queries_per_user * 2, warmup=0)
+            speculation = runtime.stats()["speculation"]
+            extra = {"geocode_coverage": speculation["geocode_coverage"], "place_hit_rate": speculation["place_hit_rate"]}
+            results[f"load.{name}"] = summarize(samples, **(extra if speculate else {}))
+            runtime.close()
+    openai.close()
+    nominatim.close()
+    return results
+
+
+def _check(condition: bool, message: str) -> None:
+    if not condition:
+        raise RuntimeError(f"check failed: {message}")
+
+
+def _drain(queue: Any, timeout: float = 60.0) -> float:
+    """Wait until `queue` has no queued, retrying or running jobs; returns seconds waited."""
+    start_time = time.perf_counter()
+    while any(queue.stats().get(status) for status in ("queued", "retrying", "running")):
+        _check(time.perf_counter() - start_time < timeout, f"publish queue not drained in {timeout:.0f}s")
+        time.sleep(0.005)
+    return time.perf_counter() - start_time
+
+
+def run_publish(workdir: str, quick: bool, **_: Any) -> Results:
+    """
+    The durable publish queue against a fake uploader: enqueue latency and the time to
+    drain a burst of posts that each fail twice before succeeding. Also checks that
+    failed uploads are retried, duplicates are not posted twice, permanent failures
+    are not retried and jobs left running by a crashed process are picked up again.
+    """
+    prepare_environment(workdir, {})
+    from service.publish_queue import PermanentPublishError, PublishQueue
+
+    posts = 20 if quick else 100
+    images = []
+    for i in range(posts):
+        path = os.path.join(workdir, f"post_{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(f"image {i}".encode("utf-8"))
+        images.append(path)
+
+    uploader = FakeUploader(latency=0.002, failures=2, permanent_error=PermanentPublishError)
+    path = os.path.join(workdir, "publish_bench.sqlite")
+    queue = PublishQueue(uploader, path=path, workers=4, retry_base=0.005, retry_max=0.02, min_interval=0)
+    job_ids: List[str] = []
+    samples = timed(lambda i: job_ids.append(queue.enqueue([images[i]], f"post {i}")[0]), posts, warmup=0)
+    duplicate_id, duplicate = queue.enqueue([images[0]], "post 0")
+    rejected_id, _ = queue.enqueue([images[0]], "reject 0")
+    drain = _drain(queue)
+    queue.stop(timeout=5)
+
+    _check(duplicate and duplicate_id == job_ids[0], "an identical post was queued twice")
+    _check(len(uploader.posts) == posts, f"{len(uploader.posts)} uploads for {posts} posts")
+    for job_id in job_ids:
+        job = queue.status(job_id)
+        _check(job["status"] == "done" and job["attempts"] == 3, f"job {job_id} ended as {job}")
+    rejected = queue.status(rejected_id)
+    _check(rejected["status"] == "failed" and rejected["attempts"] == 1, f"rejected job ended as {rejected}")
+
+    results: Results = {
+        "publish.enqueue": summarize(samples),
+        "publish.drain_with_retries": summarize([drain], posts=posts, upload_attempts=sum(uploader.attempts.values())),
+    }
+
+    # a process that dies mid-upload leaves its job 'running'; the next one to start re-queues it
+    stuck = threading.Event()
+    crashed = PublishQueue(lambda paths, caption: stuck.wait(), path=path, workers=1, min_interval=0)
+    crashed_id, _ = crashed.enqueue([images[1]], "post after crash")
+    while crashed.status(crashed_id)["status"] != "running":
+        time.sleep(0.005)
+    recovered_uploader = FakeUploader()
+    recovered = PublishQueue(recovered_uploader, path=path, workers=1, min_interval=0)
+    start_time = time.perf_counter()
+    recovered.start()
+    recovery = _drain(recovered)
+    recovered.stop(timeout=5)
+    stuck.set()
+    _check(recovered.status(crashed_id)["status"] == "done", "a job left running was not picked up on restart")
+    _check(len(recovered_uploader.posts) == 1, "the recovered job was not uploaded exactly once")
+    results["publish.restart_recovery"] = summarize([time.perf_counter() - start_time], drain_s=round(recovery, 3))
+    return results
+
+
+GROUPS = {
+    "render": run_render,
+    "geocode": run_geocode,
+    "mcp": run_mcp,
+    "load": run_load,
+    "publish": run_publish,
+}
@@ -0,0 +1,203 @@
+# standins.py
+import hashlib
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple, Type
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+
+class StandIn:
+    """A local HTTP server on a free port, served from a daemon thread."""
+
+    def __init__(self, handler: Type[BaseHTTPRequestHandler]):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, so clients reuse connections as they would against the real services
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    requests = 0
+    _lock = threading.Lock()
+
+    def setup(self) -> None:
+        super().setup()
+        # headers and body are written separately; without this Nagle's algorithm
+        # and delayed ACKs add ~40ms to every keep-alive response
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _count(self) -> None:
+        with self._lock:
+            type(self).requests += 1
+
+    def _send(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class NominatimHandler(_Handler):
+    """
+    Answers /search like Nominatim with a deterministic result per query.
+
+    Queries starting with "nowhere" have no result.
+    """
+
+    def do_GET(self) -> None:
+        self._count()
+        time.sleep(self.latency)
+        query = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+        if query.lower().startswith("nowhere"):
+            results: List[Dict[str, Any]] = []
+        else:
+            digest = hashlib.sha256(query.encode("utf-8")).digest()
+            lat = -60 + digest[0] / 255 * 120
+            lon = -180 + digest[1] / 255 * 360
+            results = [{
+                "lat": f"{lat:.6f}",
+                "lon": f"{lon:.6f}",
+                "boundingbox": [f"{lat - 0.05:.6f}", f"{lat + 0.05:.6f}", f"{lon - 0.05:.6f}", f"{lon + 0.05:.6f}"],
+                "display_name": query,
+            }]
+        self._send(json.dumps(results).encode("utf-8"), "application/json")
+
+
+def _tile_png() -> bytes:
+    image = Image.new("RGBA", (256, 256), (236, 236, 236, 255))
+    for i in range(0, 256, 32):
+        image.paste((210, 210, 210, 255), (i, 0, i + 1, 256))
+        image.paste((210, 210, 210, 255), (0, i, 256, i + 1))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TileHandler(_Handler):
+    """Serves the same 256x256 PNG for every /{z}/{x}/{y}.png request."""
+
+    tile = _tile_png()
+
+    def do_GET(self) -> None:
+        self._count()
+        time.sleep(self.latency)
+        self._send(self.tile, "image/png")
+
+
+def _chunk(model: str, delta: Optional[Dict[str, Any]], finish_reason: Optional[str] = None, usage: Any = None) -> bytes:
+    payload = {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": model,
+        "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage is not None:
+        payload["usage"] = usage
+    return b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n"
+
+
+class OpenAIHandler(_Handler):
+    """
+    A scripted chat completions endpoint (streaming only, as MCPOpenAIClient uses).
+
+    When the last message is from the user it calls `geocode_point` (or `add` if that
+    tool is not offered) with arguments split over two chunks; after a tool result it
+    streams a short answer. `latency` is the time to the first chunk.
+    """
+
+    answer = ["The ", "place ", "was ", "found."]
+
+    def do_POST(self) -> None:
+        self._count()
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.latency)
+        model = request.get("model", "bench")
+        messages = request.get("messages", [])
+        tools = {tool["function"]["name"] for tool in request.get("tools", [])}
+        last = messages[-1] if messages else {"role": "user", "content": ""}
+
+        body = BytesIO()
+        if last["role"] == "user":
+            if "geocode_point" in tools:
+                name, arguments = "geocode_point", json.dumps({"place": last.get("content") or "bench"})
+            else:
+                name, arguments = "add", json.dumps({"a": 1, "b": 2})
+            half = len(arguments) // 2
+            body.write(_chunk(model, {
+                "role": "assistant",
+                "tool_calls": [{"index": 0, "id": "call_bench", "type": "function", "function": {"name": name, "arguments": ""}}],
+            }))
+            for part in (arguments[:half], arguments[half:]):
+                body.write(_chunk(model, {"tool_calls": [{"index": 0, "function": {"arguments": part}}]}))
+            body.write(_chunk(model, {}, finish_reason="tool_calls"))
+        else:
+            body.write(_chunk(model, {"role": "assistant", "content": ""}))
+            for part in self.answer:
+                body.write(_chunk(model, {"content": part}))
+            body.write(_chunk(model, {}, finish_reason="stop"))
+        if request.get("stream_options", {}).get("include_usage"):
+            prompt_tokens = len(json.dumps(messages)) // 4
+            body.write(_chunk(model, None, usage={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": 8,
+                "total_tokens": prompt_tokens + 8,
+                "prompt_tokens_details": {"cached_tokens": 0},
+            }))
+        body.write(b"data: [DONE]\n\n")
+        self._send(body.getvalue(), "text/event-stream")
+
+
+class FakeUploader:
+    """
+    Stands in for post_images_to_instagram in a PublishQueue.
+
+    Each upload takes `latency` seconds; the first `failures` attempts of every post
+    fail with a transient ConnectionError. Posts whose caption starts with "reject"
+    raise `permanent_error` instead. Successful uploads are recorded in `posts`.
+    """
+
+    def __init__(self, latency: float = 0.0, failures: int = 0, permanent_error: Type[Exception] = ValueError):
+        self.latency = latency
+        self.failures = failures
+        self.permanent_error = permanent_error
+        self.attempts: Dict[str, int] = {}
+        self.posts: List[Tuple[List[str], str]] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, image_paths: List[str], caption: str) -> None:
+        time.sleep(self.latency)
+        with self._lock:
+            self.attempts[caption] = self.attempts.get(caption, 0) + 1
+            if caption.startswith("reject"):
+                raise self.permanent_error(f"stand-in rejected {caption!r}")
+            if self.attempts[caption] <= self.failures:
+                raise ConnectionError("stand-in upload failure")
+            self.posts.append((list(image_paths), caption))
+
+
+def start(handler: Type[_Handler], latency: float = 0.0) -> StandIn:
+    """Start a stand-in server using a private copy of `handler` with the given latency."""
+    return StandIn(type(handler.__name__, (handler,), {"latency": latency, "requests": 0}))
@@ -1,14 +1,27 @@
 import asyncio
 from mcp.client.streamable_http import streamablehttp_client
-import asyncio
 from contextlib import AsyncExitStack
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Iterator, Tuple
 from mcp import ClientSession
-from mcp.types import CallToolResult
-from openai import AsyncOpenAI
+from mcp.types import CallToolResult, ServerNotification, TextContent, ToolListChangedNotification
+from openai import AsyncOpenAI, OpenAIError
+from openai.types.chat import ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
+import functools
+import httpx
 import json
 import logging
+import math
+import queue
+import re
 import threading
+import time
+import uuid
+
+try:
+    import tiktoken
+except ImportError:  # optional; token counts fall back to an estimate
+    tiktoken = None
 
 
 class LoopRunner:
@@ -21,21 +34,434 @@ class LoopRunner:
         future = asyncio.run_coroutine_threadsafe(coro, self.loop)
         return future.result()
 
+    def iterate(self, agen: AsyncIterator[Any]) -> Iterator[Any]:
+        """Drive an async generator on the loop thread and yield its items here as they arrive."""
+        items: "queue.Queue[Any]" = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put(item)
+            except BaseException as e:
+                items.put(e)
+            finally:
+                items.put(done)
+
+        asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+
+@functools.lru_cache(maxsize=None)
+def _encoder(model: str) -> Any:
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # the encoding files could not be loaded (e.g. offline)
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Count the tokens of `text` with tiktoken, or estimate them (~4 characters per token) without it."""
+    encoder = _encoder(model)
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: Dict[str, Any], model: str = "gpt-4o") -> int:
+    """Approximate prompt tokens used by one chat message, including its tool calls."""
+    tokens = 4 + count_tokens(message.get("content") or "", model)
+    for tool_call in message.get("tool_calls") or []:
+        tokens += 4 + count_tokens(tool_call["function"]["name"], model)
+        tokens += count_tokens(tool_call["function"]["arguments"], model)
+    return tokens
+
+
+def compact_tool_output(text: str, max_tokens: int, model: str = "gpt-4o") -> str:
+    """Shrink a tool result to at most about `max_tokens` tokens.
+
+    JSON is re-serialized without whitespace; a JSON list that is still too large keeps
+    its leading items, other text keeps its leading lines. A note says what was dropped.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    else:
+        text = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+    total = count_tokens(text, model)
+    if total <= max_tokens:
+        return text
+
+    if isinstance(data, list):
+        kept: List[Any] = []
+        used = 2
+        for item in data:
+            item_tokens = count_tokens(json.dumps(item, separators=(",", ":"), ensure_ascii=False), model) + 1
+            if used + item_tokens > max_tokens:
+                break
+            kept.append(item)
+            used += item_tokens
+        return (
+            json.dumps(kept, separators=(",", ":"), ensure_ascii=False)
+            + f"\n[{len(data) - len(kept)} of {len(data)} items omitted]"
+        )
+
+    lines: List[str] = []
+    used = 0
+    for line in text.splitlines():
+        line_tokens = count_tokens(line, model) + 1
+        if used + line_tokens > max_tokens:
+            break
+        lines.append(line)
+        used += line_tokens
+    if not lines:
+        # one long line: cut it by characters
+        lines = [text[: max_tokens * 4]]
+    return "\n".join(lines) + f"\n[truncated: {total} tokens, kept about {max_tokens}]"
+
+
+class Conversation:
+    """Multi-turn chat history kept under a token budget.
+
+    Each turn (the user message, assistant tool calls, tool results and the final
+    answer) is stored whole and never rewritten, so consecutive requests share a
+    long identical prefix and hit the provider's prompt cache. When the history
+    exceeds `max_tokens`, the oldest turns are dropped together until it is back
+    under `trim_to` of the budget; trimming in one step rather than a turn at a time
+    keeps the prefix stable for several turns afterwards.
+    """
+
+    def __init__(
+        self,
+        model: str = "gpt-4o",
+        system_prompt: Optional[str] = None,
+        max_tokens: int = 16000,
+        tool_output_tokens: int = 1500,
+        trim_to: float = 0.6,
+    ):
+        self.model = model
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.tool_output_tokens = tool_output_tokens
+        self.trim_to = trim_to
+        self.turns: List[List[Dict[str, Any]]] = []
+        self._turn_tokens: List[int] = []
+        # usage reported for each completed turn
+        self.usage: List[Dict[str, int]] = []
+
+    def messages(self, pending: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """The request messages: system prompt, stored history, then the in-progress turn."""
+        messages: List[Dict[str, Any]] = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        for turn in self.turns:
+            messages.extend(turn)
+        messages.extend(pending or [])
+        return messages
+
+    def tokens(self) -> int:
+        """Approximate prompt tokens of the stored history."""
+        return sum(self._turn_tokens)
+
+    def compact(self, text: str) -> str:
+        """Bound one tool output to `tool_output_tokens`."""
+        return compact_tool_output(text, self.tool_output_tokens, self.model)
+
+    def add_turn(self, messages: List[Dict[str, Any]], usage: Optional[Dict[str, int]] = None) -> None:
+        """Store a finished turn and trim the oldest turns if the budget is exceeded."""
+        self.turns.append(messages)
+        self._turn_tokens.append(sum(message_tokens(m, self.model) for m in messages))
+        if usage is not None:
+            self.usage.append(usage)
+        if self.tokens() > self.max_tokens:
+            target = self.max_tokens * self.trim_to
+            dropped = 0
+            # always keep the newest turn
+            while len(self.turns) > 1 and self.tokens() > target:
+                self.turns.pop(0)
+                self._turn_tokens.pop(0)
+                dropped += 1
+            logging.info(f"Conversation: dropped {dropped} old turns, {self.tokens()} tokens of history kept")
+
+    def clear(self) -> None:
+        self.turns.clear()
+        self._turn_tokens.clear()
+        self.usage.clear()
+
+
+# the hint in errors of calls the server's admission control turned away
+_RETRY_AFTER = re.compile(r"retry after (\d+(?:\.\d+)?)s")
+# the server keys per-client quotas on this header (its ADMISSION_CLIENT_HEADER)
+CLIENT_ID_HEADER = "x-client-id"
+
+
+class _ClientIdAuth(httpx.Auth):
+    """Adds the id of the session a connection is serving to every request it sends."""
+
+    def __init__(self, client: "MCPOpenAIClient"):
+        self.client = client
+
+    def auth_flow(self, request: httpx.Request) -> Iterator[httpx.Request]:
+        # read per request: a pooled connection serves a different session on each borrow
+        request.headers[CLIENT_ID_HEADER] = self.client.client_id
+        yield request
+
+# read-only tools that speculation may call; their only effect is warming server caches
+SPECULATIVE_TOOLS = ("geocode_many", "prefetch_tiles")
+GEOCODE_TOOLS = ("geocode_point", "geocode_bbox", "geocode_many")
+MAP_TOOLS = ("create_map", "create_maps_batch", "prefetch_tiles")
+
+# capitalized word runs ("St. Paul", "Lake of the Isles", "Pier 39"), and lowercase
+# places after "map of"/"map around"...; quoted text (captions) is skipped
+_CAPITALIZED = re.compile(
+    r"\b[A-Z][\w'.-]*(?:(?:\s+(?:of|de|la|del|du|the|on|upon))*\s+(?:[A-Z][\w'.-]*|\d+)(?!\w))*"
+)
+_AFTER_MAP = re.compile(
+    r"\bmaps?\s+(?:of|in|around|near|for)\s+(?:the\s+)?([a-z][\w.' -]*?)"
+    r"(?=(?<!\bst)(?<!\bmt)(?<!\bft)[,.;:!?](?:\s|$)|\s+(?:and|with|then|showing|to|for|that)\b|$)"
+)
+_QUOTED = re.compile(r"\"[^\"]*\"|\u201c[^\u201d]*\u201d")
+_MAP_INTENT = re.compile(r"\b(?:maps?|post|instagram)\b", re.IGNORECASE)
+_NOT_PLACES = {
+    "a", "add", "an", "and", "can", "check", "could", "create", "draw", "find", "generate", "give",
+    "i", "instagram", "make", "map", "mark", "please", "plot", "post", "put", "show", "tell", "the",
+    "then", "use", "what", "where", "would", "you",
+}
+
+
+def guess_places(query: str, limit: int = 4) -> List[str]:
+    """Place names a query probably refers to, by cheap text rules (no model call)."""
+    text = _QUOTED.sub(" ", query)
+    candidates = [m.group(1) for m in _AFTER_MAP.finditer(text)]
+    for match in _CAPITALIZED.finditer(text):
+        words = match.group(0).rstrip(".").split()
+        while words and words[0].lower() in _NOT_PLACES:
+            words.pop(0)
+        if words:
+            candidates.append(" ".join(words))
+
+    places: List[str] = []
+    seen = set()
+    for place in candidates:
+        key = place.strip().lower()
+        if key and key not in seen and key not in _NOT_PLACES:
+            seen.add(key)
+            places.append(place.strip())
+    return places[:limit]
+
+
+def _overlaps(border: Any, region: List[List[float]]) -> bool:
+    try:
+        (south, west), (north, east) = border
+        (r_south, r_west), (r_north, r_east) = region
+        return south <= r_north and north >= r_south and west <= r_east and east >= r_west
+    except (TypeError, ValueError):
+        return False
+
+
+class Speculator:
+    """Warms the server's caches for one query while its first completion is in flight.
+
+    From `guess_places` it looks up the places the query names (one local-only
+    geocode_many call: geocode cache and gazetteer, never Nominatim) and, when the
+    query asks for a map or a post, prefetches the basemap tiles of their bounding
+    boxes at low priority; it also refreshes the tool list when the cached one is
+    past half its TTL. Only SPECULATIVE_TOOLS are called, so a wrong guess costs a
+    cache lookup and nothing else. `settle` lets real tool calls wait for matching
+    speculative work instead of duplicating it and counts the hits; `cancel` stops
+    waiting for whatever is still running when the turn ends. The server keeps
+    running a cancelled call (with stateless HTTP there is no session to cancel it
+    in), which is why speculation is limited to calls that are cheap to finish.
+    """
+
+    def __init__(self, client: "MCPOpenAIClient", query: str, stats: Dict[str, int]):
+        self.client = client
+        self.query = query
+        self.stats = stats
+        self.places: Dict[str, str] = {}  # lowercase -> as guessed
+        self.regions: List[List[List[float]]] = []
+        self._used_places: set = set()
+        self._used_regions: set = set()
+        self._geocode: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, tools: List[Dict[str, Any]]) -> None:
+        available = {tool["function"]["name"] for tool in tools} - self.client.serial_tools
+        self.stats["queries"] += 1
+        if time.monotonic() - self.client._tools_fetched_at > self.client.tools_ttl / 2:
+            self._spawn(self.client._get_mcp_tools(refresh=True))
+
+        if "geocode_many" not in available:
+            return
+        places = guess_places(self.query)
+        if not places:
+            return
+        self.places = {place.lower(): place for place in places}
+        self.stats["places_speculated"] += len(places)
+        prefetch = "prefetch_tiles" in available and bool(_MAP_INTENT.search(self.query))
+        self._geocode = self._spawn(self._warm(places, prefetch))
+
+    def _spawn(self, coro: Any) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.append(task)
+        return task
+
+    async def _call(self, name: str, arguments: Dict[str, Any]) -> Optional[CallToolResult]:
+        try:
+            result = await asyncio.wait_for(self.client.session.call_tool(name, arguments=arguments), self.client.tool_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.info(f"Speculative {name} call failed: {e}")
+            return None
+        return None if result.isError else result
+
+    async def _warm(self, places: List[str], prefetch: bool) -> None:
+        result = await self._call("geocode_many", {"places": places, "local_only": True})
+        if result is None or not prefetch:
+            return
+        # FastMCP returns one content block per item of a list result
+        for block in result.content:
+            try:
+                item = json.loads(block.text) if isinstance(block, TextContent) else {}
+            except ValueError:
+                continue
+            if "southwest" not in item:
+                continue
+            (south, west), (north, east) = item["southwest"], item["northeast"]
+            # the rendered view is padded around the border, so take a margin and one zoom level out
+            pad_lat, pad_lon = (north - south) / 4, (east - west) / 4
+            region = [[max(-85.0, south - pad_lat), west - pad_lon], [min(85.0, north + pad_lat), east + pad_lon]]
+            span = max(north - south, east - west, 1e-6)
+            zoom = max(0, min(19, math.ceil(math.log2(720 / span))))
+            self.regions.append(region)
+            self.stats["regions_speculated"] += 1
+            self._spawn(self._call(
+                "prefetch_tiles",
+                {"border": region, "min_zoom": max(0, zoom - 1), "max_zoom": zoom, "low_priority": True},
+            ))
+
+    async def settle(self, tool_calls: List[Any]) -> None:
+        """Count the calls speculation anticipated and wait for the speculative work they would repeat."""
+        wait = False
+        for tool_call in tool_calls:
+            name = tool_call.function.name
+            try:
+                arguments = json.loads(tool_call.function.arguments or "{}")
+            except ValueError:
+                continue
+            if name in GEOCODE_TOOLS:
+                requested = arguments.get("places") if name == "geocode_many" else [arguments.get("place")]
+                for place in requested or []:
+                    if not isinstance(place, str):
+                        continue
+                    self.stats["geocode_calls"] += 1
+                    key = place.strip().lower()
+                    if key in self.places:
+                        self.stats["geocode_hits"] += 1
+                        self._used_places.add(key)
+                        wait = True
+            elif name in MAP_TOOLS:
+                borders = [m.get("border") for m in arguments.get("maps") or [] if isinstance(m, dict)]
+                for border in borders if name == "create_maps_batch" else [arguments.get("border")]:
+                    self.stats["map_calls"] += 1
+                    hits = [i for i, region in enumerate(self.regions) if _overlaps(border, region)]
+                    if hits:
+                        self.stats["map_hits"] += 1
+                        self._used_regions.update(hits)
+                        wait = True
+        pending = [task for task in self._tasks if not task.done()]
+        if wait and pending:
+            await asyncio.wait(pending, timeout=self.client.tool_timeout)
+
+    def cancel(self) -> None:
+        """Stop unfinished speculative calls and record which guesses were used."""
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+                self.stats["cancelled"] += 1
+        self.stats["places_used"] += len(self._used_places)
+        self.stats["regions_used"] += len(self._used_regions)
+
+
+def speculation_report(stats: Dict[str, int]) -> Dict[str, Any]:
+    """Speculation counters plus hit rates: the share of guesses the model then used, and of its lookups that were guessed."""
+    def rate(part: int, whole: int) -> Optional[float]:
+        return round(part / whole, 3) if whole else None
+
+    return dict(
+        stats,
+        place_hit_rate=rate(stats["places_used"], stats["places_speculated"]),
+        region_hit_rate=rate(stats["regions_used"], stats["regions_speculated"]),
+        geocode_coverage=rate(stats["geocode_hits"], stats["geocode_calls"]),
+        map_coverage=rate(stats["map_hits"], stats["map_calls"]),
+    )
+
+
+def _speculation_stats() -> Dict[str, int]:
+    keys = (
+        "queries", "places_speculated", "places_used", "regions_speculated", "regions_used",
+        "geocode_calls", "geocode_hits", "map_calls", "map_hits", "cancelled", "errors",
+    )
+    return dict.fromkeys(keys, 0)
+
+
 class MCPOpenAIClient:
-    def __init__(self):
+    def __init__(
+        self,
+        runner: Optional[LoopRunner] = None,
+        openai_client: Optional[AsyncOpenAI] = None,
+        speculate: bool = False,
+    ):
         """Initialize the OpenAI MCP client.
 
         Args:
-            model: The OpenAI model to use.
+            runner: Event loop thread to run on; a new one is started if not given.
+            openai_client: OpenAI client to share; a new one is created if not given.
+            speculate: Warm the server's caches for each query while its first
+                completion is in flight (see `Speculator`).
         """
         # Initialize session and client objects
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
         self.model = "gpt-4o"
-        self.openai_client = AsyncOpenAI()
+        self.openai_client = openai_client or AsyncOpenAI()
         self.read_stream = None
         self.write_stream = None
-        self.runner = LoopRunner()
+        self.runner = runner or LoopRunner()
+        # tool calls from one assistant turn run concurrently, up to this many at once
+        self.max_concurrent_tools = 4
+        self.tool_timeout = 120.0
+        self.max_retry_after = 5.0
+        # side-effecting tools that must never run alongside other calls; tools the
+        # server annotates with destructiveHint=True are added when listed
+        self.serial_tools = {"instagram_post_images"}
+        # OpenAI-format tool schema, reused until the server reports a change or the TTL expires
+        self.tools_ttl = 300.0
+        self._tools: Optional[List[Dict[str, Any]]] = None
+        self._tools_fetched_at = 0.0
+        # multi-turn history for this client's user
+        self.conversation = Conversation(model=self.model)
+        self.speculate = speculate
+        # speculation counters; see speculation_report
+        self.speculation_stats = _speculation_stats()
+        # sent with every request as the server's quota key; ClientRuntime sets it to
+        # the id of the handle a pooled connection is serving
+        self.client_id = uuid.uuid4().hex
 
     def connect_to_server(self, address: str) -> None:
         """Connect to an MCP server via streamable HTTP.
@@ -54,20 +480,26 @@ class MCPOpenAIClient:
         """
         # connect to the server
         self.read_stream, self.write_stream, _ = await self.exit_stack.enter_async_context(
-            streamablehttp_client(address)
+            streamablehttp_client(address, auth=_ClientIdAuth(self))
         )
         self.session = await self.exit_stack.enter_async_context(
-            ClientSession(self.read_stream, self.write_stream)
+            ClientSession(self.read_stream, self.write_stream, message_handler=self._handle_message)
         )
 
         # initialize the session
         await self.session.initialize()
 
-        # list available tools
-        tools_result = await self.session.list_tools()
+        # list available tools (this also fills the tool cache)
+        await self._get_mcp_tools(refresh=True)
         logging.info("\nConnected to server with tools:")
-        for tool in tools_result.tools:
-            logging.info(f"  - {tool.name}: {tool.description}")
+        for tool in self._tools:
+            logging.info(f"  - {tool['function']['name']}: {tool['function']['description']}")
+
+    async def _handle_message(self, message: Any) -> None:
+        """Handle server-initiated messages; drops the tool cache on tools/list_changed."""
+        if isinstance(message, ServerNotification) and isinstance(message.root, ToolListChangedNotification):
+            logging.info("Server tool list changed, invalidating cached tools")
+            self._tools = None
 
     def get_mcp_tools(self) -> List[Dict[str, Any]]:
         """Get available tools from the MCP server in OpenAI format.
@@ -77,14 +509,26 @@ class MCPOpenAIClient:
         """
         logging.info("get_mcp_tools: Fetching available tools from MCP server")
         return self.runner.run(self._get_mcp_tools())
-    async def _get_mcp_tools(self) -> List[Dict[str, Any]]:
+    async def _get_mcp_tools(self, refresh: bool = False) -> List[Dict[str, Any]]:
         """Get available tools from the MCP server in OpenAI format.
 
+        The converted list is cached until the server sends a tools/list_changed
+        notification or `tools_ttl` seconds pass.
+
+        Args:
+            refresh: Ignore the cache and list the tools again.
+
         Returns:
             A list of tools in OpenAI format.
         """
+        if not refresh and self._tools is not None and time.monotonic() - self._tools_fetched_at < self.tools_ttl:
+            return self._tools
+
         tools_result = await self.session.list_tools()
-        return [
+        for tool in tools_result.tools:
+            if tool.annotations is not None and tool.annotations.destructiveHint:
+                self.serial_tools.add(tool.name)
+        self._tools = [
             {
                 "type": "function",
                 "function": {
@@ -95,92 +539,277 @@ class MCPOpenAIClient:
             }
             for tool in tools_result.tools
         ]
+        self._tools_fetched_at = time.monotonic()
+        # %-style arguments: the tool list is only formatted when DEBUG is enabled
+        logging.debug("_get_mcp_tools: Fetched tools: %s", self._tools)
+        return self._tools
 
-    def process_query(self, query: str) -> str:
+    def process_query(self, query: str, conversation: Optional[Conversation] = None) -> str:
         """Process a query using OpenAI and available MCP tools.
 
         Args:
             query: The user query.
+            conversation: History to continue; defaults to `self.conversation`.
 
         Returns:
             The response from OpenAI.
         """
-        return self.runner.run(self._process_query(query))
-    async def _process_query(self, query: str) -> str:
+        return self.runner.run(self._process_query(query, conversation))
+    async def _process_query(self, query: str, conversation: Optional[Conversation] = None) -> str:
         """Process a query using OpenAI and available MCP tools.
 
         Args:
             query: The user query.
+            conversation: History to continue; defaults to `self.conversation`.
 
         Returns:
             The response from OpenAI.
         """
+        content = ""
+        async for event in self._process_query_stream(query, conversation):
+            if event["type"] == "done":
+                content = event["content"]
+        return content
+
+    def process_query_stream(self, query: str, conversation: Optional[Conversation] = None) -> Iterator[Dict[str, Any]]:
+        """Process a query, yielding events as the response streams in.
+
+        Events are dicts with a "type" key:
+            {"type": "delta", "content": str}: a chunk of assistant text.
+            {"type": "tool_call", "id": str, "name": str, "arguments": str}: a tool is about to run.
+            {"type": "tool_result", "id": str, "name": str, "content": str}: a tool finished.
+            {"type": "done", "content": str, "usage": dict}: the final assistant text of the
+                turn and its token counts (see `_process_query_stream`).
+
+        Args:
+            query: The user query.
+            conversation: History to continue; defaults to `self.conversation`.
+        """
+        return self.runner.iterate(self._process_query_stream(query, conversation))
+    async def _process_query_stream(
+        self, query: str, conversation: Optional[Conversation] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Process a query using OpenAI and available MCP tools, streaming every completion.
+
+        The request carries the conversation history followed by this turn; the turn is
+        added to the history once it completes. Tool outputs are compacted before they
+        are sent back to the model.
+
+        With `speculate` set, a `Speculator` warms the server's caches for the query
+        while the first completion streams, and is cancelled when the turn ends.
+
+        The done event's usage sums every completion of the turn: prompt_tokens,
+        completion_tokens and cached_tokens as reported by OpenAI, plus the local
+        history_tokens estimate after the turn was stored.
+
+        Args:
+            query: The user query.
+            conversation: History to continue; defaults to `self.conversation`.
+
+        Yields:
+            The events described in `process_query_stream`.
+        """
         logging.info(f"process_query: Processing query: {query}")
 
-        # get available tools
-        logging.info("process_query: Fetching available tools from MCP server")
+        # get available tools (cached between queries)
         tools = await self._get_mcp_tools()
-        logging.info(f"process_query: Available tools: {tools}")
 
-        # track messages
-        messages = [{"role": "user", "content": query}]
+        if conversation is None:
+            conversation = self.conversation
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "requests": 0}
 
-        # initial OpenAI API call
-        logging.info(f"process_query: Making initial OpenAI API call with model {self.model}")
-        response = await self.openai_client.chat.completions.create(
-            model=self.model,
-            messages=[{"role": "user", "content": query}],
-            tools=tools,
-            tool_choice="auto",
-        )
-        logging.info(f"process_query: OpenAI API initial response: {response}")
+        # messages of this turn; the history goes in front of them
+        turn: List[Dict[str, Any]] = [{"role": "user", "content": query}]
 
-        # update messages
-        assistant_message = response.choices[0].message
-        messages.append(assistant_message)
+        speculator = None
+        if self.speculate:
+            speculator = Speculator(self, query, self.speculation_stats)
+            speculator.start(tools)
+        try:
+            async for event in self._complete_turn(turn, tools, conversation, usage, speculator):
+                yield event
+        finally:
+            if speculator is not None:
+                speculator.cancel()
 
-        # handle tool calls
-        while assistant_message.tool_calls:
-            for tool_call in assistant_message.tool_calls:
-                logging.info(f"process_query: Calling tool {tool_call.function.name} with arguments {tool_call.function.arguments}")
-                try:
-                    result: CallToolResult = await self.session.call_tool(
-                        tool_call.function.name,
-                        arguments=json.loads(tool_call.function.arguments),
-                    )
-                    assert result.isError is False and result.content is not None
-                    messages.append(
-                        {
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "content": result.content[0].text if result.content else "",
-                        }
-                    )
-                except Exception as e:
-                    logging.info(f"Error calling tool {tool_call.function.name}: {e}")
-                    messages.append(
-                        {
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "content": f"Error calling tool {tool_call.function.name}: {e}",
-                        }
-                    )
-
-            # Get updated response from OpenAI with tool results
+    async def _complete_turn(
+        self,
+        turn: List[Dict[str, Any]],
+        tools: List[Dict[str, Any]],
+        conversation: Conversation,
+        usage: Dict[str, int],
+        speculator: Optional[Speculator],
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Run completions and tool calls until the model answers; see `_process_query_stream`."""
+        logging.info(f"process_query: Making initial OpenAI API call with model {self.model}")
+        first = True
+        while True:
+            content_parts: List[str] = []
+            # streamed tool calls arrive as fragments keyed by their index in the turn
+            partial_calls: Dict[int, Dict[str, str]] = {}
             try:
-                response = await self.openai_client.chat.completions.create(
+                stream = await self.openai_client.chat.completions.create(
                     model=self.model,
-                    messages=messages,
+                    messages=conversation.messages(turn),
                     tools=tools,
                     tool_choice="auto",
+                    stream=True,
+                    stream_options={"include_usage": True},
                 )
-                assistant_message = response.choices[0].message
-                messages.append(assistant_message)
+                usage["requests"] += 1
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        usage["prompt_tokens"] += chunk.usage.prompt_tokens
+                        usage["completion_tokens"] += chunk.usage.completion_tokens
+                        details = chunk.usage.prompt_tokens_details
+                        if details is not None and details.cached_tokens:
+                            usage["cached_tokens"] += details.cached_tokens
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        yield {"type": "delta", "content": delta.content}
+                    for fragment in delta.tool_calls or []:
+                        call = partial_calls.setdefault(fragment.index, {"id": "", "name": "", "arguments": ""})
+                        if fragment.id:
+                            call["id"] = fragment.id
+                        if fragment.function is not None:
+                            call["name"] += fragment.function.name or ""
+                            call["arguments"] += fragment.function.arguments or ""
             except Exception as e:
+                if first:
+                    raise
+                # the unfinished turn is not added to the history
                 logging.info(f"Error during OpenAI chat completion: {e}")
-                return ""
+                yield {"type": "done", "content": "", "usage": usage}
+                return
+            first = False
 
-        return assistant_message.content
+            content = "".join(content_parts)
+            if not partial_calls:
+                turn.append({"role": "assistant", "content": content})
+                conversation.add_turn(turn, usage)
+                usage["history_tokens"] = conversation.tokens()
+                logging.info(f"process_query: Turn usage: {usage}")
+                yield {"type": "done", "content": content, "usage": usage}
+                return
+
+            tool_calls = [
+                ChatCompletionMessageToolCall(
+                    id=call["id"],
+                    type="function",
+                    function=Function(name=call["name"], arguments=call["arguments"] or "{}"),
+                )
+                for _, call in sorted(partial_calls.items())
+            ]
+            turn.append({
+                "role": "assistant",
+                "content": content or None,
+                "tool_calls": [tool_call.model_dump() for tool_call in tool_calls],
+            })
+            for tool_call in tool_calls:
+                yield {
+                    "type": "tool_call",
+                    "id": tool_call.id,
+                    "name": tool_call.function.name,
+                    "arguments": tool_call.function.arguments,
+                }
+
+            if speculator is not None:
+                await speculator.settle(tool_calls)
+            results = await self._call_tools(tool_calls)
+            for tool_call, result in zip(tool_calls, results):
+                yield {
+                    "type": "tool_result",
+                    "id": tool_call.id,
+                    "name": tool_call.function.name,
+                    "content": result["content"],
+                }
+                result["content"] = conversation.compact(result["content"])
+            turn.extend(results)
+
+    async def _call_tool(self, tool_call: Any, retry: bool = True) -> Dict[str, Any]:
+        """Call one MCP tool and wrap the result (or error) as a tool message.
+
+        A call the server turns away with a retry-after hint of at most
+        `max_retry_after` seconds is retried once after that delay.
+        """
+        logging.info(f"process_query: Calling tool {tool_call.function.name}")
+        logging.debug("process_query: Tool %s arguments: %s", tool_call.function.name, tool_call.function.arguments)
+        try:
+            result: CallToolResult = await asyncio.wait_for(
+                self.session.call_tool(
+                    tool_call.function.name,
+                    arguments=json.loads(tool_call.function.arguments),
+                ),
+                self.tool_timeout,
+            )
+            if result.isError:
+                error = " ".join(block.text for block in result.content or [] if isinstance(block, TextContent))
+                # a busy server says when to come back; wait once if that is soon
+                hint = _RETRY_AFTER.search(error)
+                if hint and retry and float(hint.group(1)) <= self.max_retry_after:
+                    logging.info(f"Tool {tool_call.function.name} refused, retrying in {hint.group(1)}s")
+                    await asyncio.sleep(float(hint.group(1)))
+                    return await self._call_tool(tool_call, retry=False)
+                raise RuntimeError(error or "tool returned an error")
+            assert result.content is not None
+            # FastMCP returns one content block per item of a list result
+            texts = [block.text for block in result.content if isinstance(block, TextContent)]
+            if len(texts) > 1:
+                try:
+                    content = json.dumps([json.loads(text) for text in texts])
+                except ValueError:
+                    content = "\n".join(texts)
+            else:
+                content = texts[0] if texts else ""
+            return {
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": content,
+            }
+        except asyncio.TimeoutError:
+            logging.info(f"Tool {tool_call.function.name} timed out after {self.tool_timeout}s")
+            return {
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": f"Error calling tool {tool_call.function.name}: timed out after {self.tool_timeout}s",
+            }
+        except Exception as e:
+            logging.info(f"Error calling tool {tool_call.function.name}: {e}")
+            return {
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": f"Error calling tool {tool_call.function.name}: {e}",
+            }
+
+    async def _call_tools(self, tool_calls: List[Any]) -> List[Dict[str, Any]]:
+        """Run the tool calls of one assistant turn.
+
+        Consecutive calls run concurrently (at most `max_concurrent_tools` at a time);
+        a call to a tool in `serial_tools` waits for the calls before it and runs alone.
+
+        Returns:
+            The tool messages, in the same order as `tool_calls`.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_tools)
+
+        async def limited(tool_call: Any) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._call_tool(tool_call)
+
+        results: List[Dict[str, Any]] = []
+        batch: List[Any] = []
+        for tool_call in tool_calls:
+            if tool_call.function.name in self.serial_tools:
+                results.extend(await asyncio.gather(*(limited(c) for c in batch)))
+                batch = []
+                results.append(await self._call_tool(tool_call))
+            else:
+                batch.append(tool_call)
+        results.extend(await asyncio.gather(*(limited(c) for c in batch)))
+        return results
 
     def cleanup(self) -> None:
         """Cleanup resources."""
@@ -189,6 +818,222 @@ class MCPOpenAIClient:
         await self.exit_stack.aclose()
 
 
+class ChatHandle:
+    """One user's conversation on a shared `ClientRuntime`.
+
+    Handles own no threads or connections; a pooled MCP connection is borrowed
+    only while a query runs.
+    """
+
+    def __init__(self, runtime: "ClientRuntime", handle_id: str):
+        self.runtime = runtime
+        self.id = handle_id
+        self.conversation = Conversation()
+        self.last_used = time.monotonic()
+
+    def process_query(self, query: str) -> str:
+        """Process a query in this conversation; see `MCPOpenAIClient.process_query`."""
+        content = ""
+        for event in self.process_query_stream(query):
+            if event["type"] == "done":
+                content = event["content"]
+        return content
+
+    def process_query_stream(self, query: str) -> Iterator[Dict[str, Any]]:
+        """Stream a query in this conversation; see `MCPOpenAIClient.process_query_stream`."""
+        return self.runtime.runner.iterate(self.runtime._stream(self, query))
+
+    def close(self) -> None:
+        self.runtime.release(self.id)
+
+
+class ClientRuntime:
+    """Process-wide client state shared by every user of the app.
+
+    One event loop thread and one AsyncOpenAI client (and so one HTTP connection
+    pool) serve all users. MCP connections are pooled: one is opened when a query
+    needs it and none is free, up to `pool_size`, and connections left unused for
+    `connection_idle_timeout` seconds are closed again. Users get lightweight
+    `ChatHandle`s; a handle idle for `handle_idle_timeout` seconds is reaped and
+    its history dropped. With `speculate`, every connection speculates (see
+    `Speculator`) and the hit rates over all of them are in `stats()["speculation"]`.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        pool_size: int = 4,
+        handle_idle_timeout: float = 30 * 60,
+        connection_idle_timeout: float = 5 * 60,
+        reap_interval: float = 60.0,
+        speculate: bool = False,
+    ):
+        self.address = address
+        self.pool_size = pool_size
+        self.handle_idle_timeout = handle_idle_timeout
+        self.connection_idle_timeout = connection_idle_timeout
+        self.reap_interval = reap_interval
+        self.speculate = speculate
+        self.runner = LoopRunner()
+        self.openai_client = AsyncOpenAI()
+
+        self._lock = threading.Lock()
+        self._handles: Dict[str, ChatHandle] = {}
+        self._slots = asyncio.Semaphore(pool_size)
+        # connected clients not in use, with the time they were returned
+        self._idle: List[Tuple[MCPOpenAIClient, float]] = []
+        # every open connection, mapped to the event that closes it
+        self._connections: Dict[MCPOpenAIClient, asyncio.Event] = {}
+        self._active = 0
+        self._stats = {"connections_opened": 0, "connections_closed": 0, "handles_reaped": 0, "queries": 0}
+        # shared by every pooled connection (only updated on the loop thread)
+        self._speculation_stats = _speculation_stats()
+
+        # connect once up front so a bad address fails at startup
+        self.runner.run(self._warm())
+        asyncio.run_coroutine_threadsafe(self._reap_forever(), self.runner.loop)
+
+    def handle(self, handle_id: Optional[str] = None) -> ChatHandle:
+        """Create (or return the existing) handle for one user session."""
+        handle_id = handle_id or uuid.uuid4().hex
+        with self._lock:
+            handle = self._handles.get(handle_id)
+            if handle is None:
+                handle = self._handles[handle_id] = ChatHandle(self, handle_id)
+            return handle
+
+    def release(self, handle_id: str) -> None:
+        """Forget a handle and its history."""
+        with self._lock:
+            handle = self._handles.pop(handle_id, None)
+        if handle is not None:
+            handle.conversation.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                self._stats,
+                handles=len(self._handles),
+                active_queries=self._active,
+                connections=len(self._connections),
+                idle_connections=len(self._idle),
+                speculation=speculation_report(self._speculation_stats),
+            )
+
+    def close(self) -> None:
+        """Close every pooled connection."""
+        self.runner.run(self._close_all())
+
+    async def _open(self) -> MCPOpenAIClient:
+        """Open a pooled connection, held by its own task until its close event is set.
+
+        The streamable HTTP transport must be closed by the task that opened it, so
+        the connection lives in a dedicated task rather than in whichever request
+        happened to need it.
+        """
+        client = MCPOpenAIClient(runner=self.runner, openai_client=self.openai_client, speculate=self.speculate)
+        client.speculation_stats = self._speculation_stats
+        ready = asyncio.get_running_loop().create_future()
+        closing = asyncio.Event()
+
+        async def hold() -> None:
+            try:
+                await client._connect_to_server(self.address)
+            except Exception as e:
+                await client._cleanup()
+                ready.set_exception(e)
+                return
+            ready.set_result(None)
+            await closing.wait()
+            try:
+                await client._cleanup()
+            except Exception as e:
+                logging.info(f"ClientRuntime: error closing MCP connection: {e}")
+
+        asyncio.create_task(hold())
+        await ready
+        with self._lock:
+            self._connections[client] = closing
+            self._stats["connections_opened"] += 1
+        return client
+
+    def _discard(self, client: MCPOpenAIClient) -> None:
+        with self._lock:
+            closing = self._connections.pop(client, None)
+            if closing is not None:
+                self._stats["connections_closed"] += 1
+        if closing is not None:
+            closing.set()
+
+    async def _warm(self) -> None:
+        client = await self._open()
+        self._idle.append((client, time.monotonic()))
+
+    async def _stream(self, handle: ChatHandle, query: str) -> AsyncIterator[Dict[str, Any]]:
+        handle.last_used = time.monotonic()
+        with self._lock:
+            # re-register a handle that was reaped while its tab stayed open
+            self._handles.setdefault(handle.id, handle)
+            self._stats["queries"] += 1
+        async with self._slots:
+            client = self._idle.pop()[0] if self._idle else await self._open()
+            # quotas are per user session, not per shared connection
+            client.client_id = handle.id
+            with self._lock:
+                self._active += 1
+            healthy = False
+            try:
+                async for event in client._process_query_stream(query, handle.conversation):
+                    yield event
+                healthy = True
+            except OpenAIError:
+                # an API error says nothing about the MCP connection
+                healthy = True
+                raise
+            finally:
+                with self._lock:
+                    self._active -= 1
+                if healthy:
+                    self._idle.append((client, time.monotonic()))
+                else:
+                    # the connection may be broken; don't hand it to the next request
+                    self._discard(client)
+                handle.last_used = time.monotonic()
+
+    async def _reap_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                self._reap()
+            except Exception as e:
+                logging.info(f"ClientRuntime: reaper error: {e}")
+
+    def _reap(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            stale = [h for h in self._handles.values() if now - h.last_used > self.handle_idle_timeout]
+            for handle in stale:
+                del self._handles[handle.id]
+            self._stats["handles_reaped"] += len(stale)
+        for handle in stale:
+            handle.conversation.clear()
+
+        keep = []
+        for client, released in self._idle:
+            if now - released > self.connection_idle_timeout:
+                self._discard(client)
+            else:
+                keep.append((client, released))
+        self._idle = keep
+        if stale:
+            logging.info(f"ClientRuntime: reaped {len(stale)} idle sessions")
+
+    async def _close_all(self) -> None:
+        self._idle = []
+        for client in list(self._connections):
+            self._discard(client)
+
+
 # async def main():
 #     client = MCPOpenAIClient()
 #     await client.connect_to_server("http://localhost:8050/mcp")
@@ -1,47 +1,403 @@
-from mcp.server.fastmcp import FastMCP
-from typing import List, Tuple, Optional, Any, Dict
-from service.generate_map import generate_map, MarkerType
-from service.geocode import geocode_place
-from service.instagram import post_images_to_instagram
+import argparse
+import asyncio
+import contextvars
+import functools
+import importlib
+import inspect
+import json
+import logging
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from mcp.server.fastmcp import Context, FastMCP, Image
+from mcp.types import ToolAnnotations
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+# only light modules are imported here so the server starts listening quickly;
+# service.generate_map / service.tiles (matplotlib, contextily, pyproj) and
+# instagrapi are imported by the tools that need them, or by warm_up()
+from service.geocode import geocode_place, geocode_many as geocode_place_list, geocode_cache, place_index
+from service.render_engine import render_engine
+from service.render_cache import render_cache
+from service.instagram import enqueue_post, publish_queue, session_stats as instagram_session_stats
+from service.artifacts import artifact_store
+from service.admission import AdmissionController, CostClass, client_key
+from service import metrics
+from service.tracing import span
+
+# heavy modules loaded in the background by warm_up()
+WARMUP_MODULES = ("service.tiles", "service.generate_map", "service.image_prep", "instagrapi")
+
+logger = logging.getLogger("uncover.server")
 
 # create MCP server instance (configured for stateless HTTP)
 mcp = FastMCP(
     name="Dan's Server",
-    host="0.0.0.0",
-    port=8050,
+    host=os.environ.get("MCP_HOST", "0.0.0.0"),
+    port=int(os.environ.get("MCP_PORT", 8050)),
     stateless_http=True,
 )
 
 
+async def report_progress(ctx: Context, progress: float, total: Optional[float] = None, message: Optional[str] = None) -> None:
+    """
+    `ctx.report_progress`, but attached to the current request.
+
+    FastMCP's version sends progress on the standalone stream, which stateless HTTP
+    does not have, so clients would never see it.
+    """
+    meta = ctx.request_context.meta
+    if meta is None or meta.progressToken is None:
+        return
+    await ctx.session.send_progress_notification(
+        progress_token=meta.progressToken,
+        progress=progress,
+        total=total,
+        message=message,
+        related_request_id=ctx.request_id,
+    )
+
+
+# per-tool metrics, served with the cache and queue counters from /metrics
+tool_calls = metrics.counter("mcp_tool_calls_total", "Tool calls.", ("tool",))
+tool_errors = metrics.counter("mcp_tool_errors_total", "Tool calls that raised an error.", ("tool",))
+tool_latency = metrics.histogram("mcp_tool_latency_seconds", "Tool call latency.", ("tool",))
+tool_in_flight = metrics.gauge("mcp_tool_in_flight", "Tool calls currently running.", ("tool",))
+tool_request_bytes = metrics.histogram(
+    "mcp_tool_request_bytes", "Size of tool arguments as JSON.", ("tool",), metrics.BYTES_BUCKETS
+)
+tool_response_bytes = metrics.histogram(
+    "mcp_tool_response_bytes", "Size of tool results as JSON.", ("tool",), metrics.BYTES_BUCKETS
+)
+
+
+def _payload_size(value: Any) -> int:
+    # images are sent base64-encoded; count that rather than serializing them here
+    images: List[Image] = []
+
+    def default(o: Any) -> Any:
+        if isinstance(o, Image):
+            images.append(o)
+            return ""
+        return str(o)
+
+    size = len(json.dumps(value, default=default))
+    return size + sum(4 * ((len(image.data or b"") + 2) // 3) for image in images)
+
+
+@contextmanager
+def _measure(name: str, arguments: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Record one tool call; the caller stores the tool's return value under "result"."""
+    arguments = {k: v for k, v in arguments.items() if not isinstance(v, Context)}
+    tool_calls.inc(name)
+    tool_request_bytes.observe(name, value=_payload_size(arguments))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s arguments: %s", name, arguments)
+    tool_in_flight.inc(name)
+    start = time.perf_counter()
+    call: Dict[str, Any] = {}
+    try:
+        with span(name):
+            yield call
+    except Exception:
+        tool_errors.inc(name)
+        raise
+    finally:
+        tool_latency.observe(name, value=time.perf_counter() - start)
+        tool_in_flight.dec(name)
+    tool_response_bytes.observe(name, value=_payload_size(call.get("result")))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s result: %s", name, call.get("result"))
+
+
+# cost classes tools are admitted by (see service/admission.py): cheap calls are never
+# stuck behind renders, and a burst of renders queues briefly, then is turned away
+admission = AdmissionController({
+    "cheap": CostClass("cheap", concurrency=32, queue=256, queue_timeout=10),
+    # uncached geocodes wait on Nominatim's rate limit
+    "geocode": CostClass("geocode", concurrency=8, queue=64, queue_timeout=60),
+    "io": CostClass("io", concurrency=4, queue=16, queue_timeout=60, quota_cost=5),
+    "render": CostClass(
+        "render", concurrency=render_engine.workers, queue=render_engine.max_queue, queue_timeout=30, quota_cost=10
+    ),
+})
+metrics.callback(
+    "mcp_admission_calls", "Admitted tool calls running and waiting, by cost class.", ("cost_class", "state"),
+    admission.gauges,
+)
+# a thread pool per cost class, as large as the class's concurrency: plain-function tools
+# never share the loop's default executor, so blocking geocodes cannot starve cheap calls
+tool_executors = {
+    name: ThreadPoolExecutor(max_workers=c.concurrency, thread_name_prefix=f"tool-{name}")
+    for name, c in admission.classes.items()
+}
+
+
+def _client() -> Optional[str]:
+    """Quota key of the HTTP request being served, None outside a request."""
+    try:
+        return client_key(mcp.get_context().request_context.request)
+    except (LookupError, ValueError):
+        return None
+
+
+def tool(
+    cost: str = "cheap", units: Optional[Callable[[Dict[str, Any]], int]] = None, **kwargs: Any
+) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    `mcp.tool()` that admits each call through `admission` under cost class `cost`
+    (`units(arguments)` scales its quota cost), records call/error counts, latency,
+    in-flight calls and payload sizes per tool, and opens a span around each call.
+
+    Plain functions run on their cost class's thread pool (`tool_executors`), so a slow
+    one neither blocks the event loop nor holds a thread that another class needs.
+    """
+    executor = tool_executors[cost]
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        name = func.__name__
+        if inspect.iscoroutinefunction(func):
+            run = func
+        else:
+            async def run(*args: Any, **kw: Any) -> Any:
+                # run in a copy of the context, so spans opened by the tool nest under this call
+                call = functools.partial(contextvars.copy_context().run, func, *args, **kw)
+                return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+        # functools.wraps keeps the signature FastMCP builds the tool schema from
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kw: Any) -> Any:
+            async with admission.admit(cost, _client(), units(kw) if units else 1):
+                with _measure(name, kw) as call:
+                    call["result"] = await run(*args, **kw)
+            return call["result"]
+
+        return mcp.tool(**kwargs)(wrapper)
+
+    return decorator
+
+
+def _cache_lookups() -> Dict[Tuple[str, ...], float]:
+    stats = {"geocode": geocode_cache.stats(), "renders": render_cache.stats()}
+    # tile stats only once something has loaded the (heavy) tiles module
+    tiles = sys.modules.get("service.tiles")
+    if tiles is not None:
+        stats["tiles"] = tiles.tile_store.stats()
+    return {(cache, result): s[result] for cache, s in stats.items() for result in ("hits", "misses")}
+
+
+def _render_jobs() -> Dict[Tuple[str, ...], float]:
+    stats = render_engine.stats()
+    return {(state,): stats[state] for state in ("in_flight", "completed", "failed", "rejected", "timed_out")}
+
+
+metrics.callback(
+    "uncover_cache_lookups", "Cache lookups by result since start (render cache: all processes).",
+    ("cache", "result"), _cache_lookups,
+)
+metrics.callback("uncover_render_jobs", "Render engine jobs by state.", ("state",), _render_jobs)
+metrics.callback(
+    "uncover_artifacts", "In-memory artifact store usage.", ("measure",),
+    lambda: {(measure,): value for measure, value in artifact_store.stats().items() if measure in ("entries", "bytes")},
+)
+metrics.callback(
+    "uncover_place_index", "Places known to the local spatial index, and queries answered from it.", ("measure",),
+    lambda: {(measure,): value for measure, value in place_index.stats().items() if measure in ("places", "queries")},
+)
+metrics.callback(
+    "uncover_publish_jobs", "Instagram publish queue jobs by status.", ("status",),
+    lambda: {(status,): count for status, count in publish_queue.stats().items()},
+)
+metrics.callback(
+    "uncover_instagram_sessions", "Instagram client logins and session reuse since start.", ("event",),
+    lambda: {(event,): value for event, value in instagram_session_stats().items() if event != "client_ready"},
+)
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """Prometheus scrape endpoint, served next to /mcp."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 # tools
-@mcp.tool()
+@tool()
 def add(a: int, b: int) -> int:
     """Add two numbers"""
     return a + b
 
-@mcp.tool()
-def create_map(
-    output_filename: str,
+# create_map returns image content in some modes, so its result is not a structured (schema'd) value
+@tool(cost="render", structured_output=False)
+async def create_map(
     border: List[List[float]],
     markers: List[List[float | str]] = [],
-) -> str:
+    profile: str = "instagram_square",
+    format: Optional[str] = None,
+    output_filename: Optional[str] = None,
+    return_image: bool = False,
+    auto_label: bool = False,
+) -> Any:
     """
     Generate a map with a rectangle and markers.
     
-    `output_filename`: desired output PNG file name
     `border`: [[lat1, lon1], [lat2, lon2]] bottom-left, top-right
     `markers`: [[lat, lon, optional color, optional label], ...]
+    `profile`: "preview" (400px JPEG, fast - use while iterating on a map),
+        "instagram_square" (1080x1080 JPEG) or "print" (4000x4000 PNG)
+    `format`: optional override of the profile's format: "png", "jpeg" or "webp"
+    `output_filename`: write the map to this file on the server instead (the extension
+        is corrected to match the format) and return its path
+    `return_image`: also return the image itself
+    `auto_label`: label unlabelled markers with the name of a known (previously
+        geocoded) place centered on them; no new geocoding requests are made
     
-    Returns the path to the generated PNG file.
+    By default the map is kept in server memory and a handle is returned:
+    {"handle": "artifact:...", "format": "jpeg", "bytes": 123456, "expires_in": 3600}
+    Pass the handle to instagram_post_images to post the map.
+    """
+
+    logger.debug("create_map: border=%s markers=%s", border, markers)
+    if auto_label:
+        markers = place_index.label_markers(markers)
+    if output_filename:
+        with span("render", profile=profile):
+            output_location: str = await render_engine.render(
+                output_filename=output_filename, border=border, markers=markers, profile=profile, format=format
+            )
+        logger.info("create_map: map generated at %s", output_location)
+        return output_location
+
+    with span("render", profile=profile):
+        data, image_format = await render_engine.render_bytes(
+            border=border, markers=markers, profile=profile, format=format
+        )
+    result = _store_map(data, image_format)
+    logger.info("create_map: map generated as %s (%d bytes)", result["handle"], len(data))
+    if return_image:
+        return [result, Image(data=data, format=image_format)]
+    return result
+
+
+def _store_map(data: bytes, image_format: str) -> Dict[str, Any]:
+    """Keep a rendered map in the artifact store; returns the description create_map reports."""
+    handle = artifact_store.put(data, f"image/{image_format}")
+    return {
+        "handle": handle,
+        "format": image_format,
+        "bytes": len(data),
+        "expires_in": round(artifact_store.expires_in(handle)),
+    }
+
+
+MAP_SPEC_KEYS = ("border", "markers", "profile", "format", "output_filename")
+
+
+@tool(cost="render", units=lambda arguments: len(arguments.get("maps") or []), structured_output=False)
+async def create_maps_batch(
+    maps: List[Dict[str, Any]],
+    ctx: Context,
+    profile: str = "instagram_square",
+    format: Optional[str] = None,
+    return_images: bool = False,
+    auto_label: bool = False,
+) -> Any:
+    """
+    Generate many maps in one call. Prefer this over repeated create_map calls for a
+    series of related maps (e.g. one city with different markers): maps of overlapping
+    areas share the basemap, so each extra map is cheap.
+
+    `maps`: list of map specs, each with the create_map arguments
+        {"border": [[lat1, lon1], [lat2, lon2]], "markers": [...],
+         optional "profile", "format" and "output_filename"}
+    `profile`, `format`: defaults for specs that do not set them
+    `return_images`: also return the images themselves
+    `auto_label`: label unlabelled markers after known places, as in create_map
+
+    Returns one entry per map, in the same order:
+    [{"index": 0, "handle": "artifact:...", "format": "jpeg", "bytes": 123456, "expires_in": 3600},
+     {"index": 1, "path": "/path/written.png"}]
+    Clients that send a progress token get each entry as a progress message as soon as that map is ready.
+    """
+    specs = []
+    for index, spec in enumerate(maps):
+        if "border" not in spec:
+            raise ValueError(f"Map {index} has no border")
+        spec = {key: spec[key] for key in MAP_SPEC_KEYS if spec.get(key) is not None}
+        spec.setdefault("profile", profile)
+        if auto_label and spec.get("markers"):
+            spec["markers"] = place_index.label_markers(spec["markers"])
+        if format:
+            spec.setdefault("format", format)
+        specs.append(spec)
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(specs)
+    images: List[Optional[Image]] = [None] * len(specs)
+    with span("render_batch", maps=len(specs)):
+        async for index, output in render_engine.render_many(specs):
+            if isinstance(output, str):
+                entry = {"index": index, "path": output}
+            else:
+                data, image_format = output
+                entry = {"index": index, **_store_map(data, image_format)}
+                if return_images:
+                    images[index] = Image(data=data, format=image_format)
+            results[index] = entry
+            done = sum(result is not None for result in results)
+            await report_progress(ctx, done, len(specs), message=json.dumps(entry))
+    logger.info("create_maps_batch: generated %d maps", len(specs))
+
+    if return_images:
+        return [item for entry, image in zip(results, images) for item in (entry, image) if item is not None]
+    return results
+
+
+@tool(cost="io")
+def prefetch_tiles(
+    border: List[List[float]], min_zoom: int = 10, max_zoom: int = 14, low_priority: bool = False
+) -> Dict[str, Any]:
+    """
+    Downloads the basemap tiles for a region ahead of time so later maps of it render faster.
+
+    `border`: [[lat1, lon1], [lat2, lon2]] bottom-left, top-right
+    `min_zoom`, `max_zoom`: inclusive range of zoom levels to fetch
+    `low_priority`: fetch one tile at a time, leaving the tile server to other work
+
+    Returns counts of tiles requested, already cached, fetched and failed.
     """
+    from service.generate_map import BASEMAP_SOURCE
+    from service.tiles import TILE_WORKERS, prefetch_tiles as prefetch_basemap_tiles
 
-    print(f"Creating map with border: {border} and markers: {markers}")
-    output_location: str = generate_map(output_filename=output_filename, border=border, markers=markers)
-    print(f"Map generated at: {output_location}")
-    return output_location
+    workers = 1 if low_priority else TILE_WORKERS
+    return prefetch_basemap_tiles(border, (min_zoom, max_zoom), source=BASEMAP_SOURCE, workers=workers)
 
 
-@mcp.tool()
+@tool()
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns statistics for the geocode cache and place index, basemap tile and rendered map caches, in-memory map artifacts, the render engine, admission control and Instagram publishing."""
+    from service.tiles import tile_store
+
+    return {
+        "geocode": geocode_cache.stats(),
+        "place_index": place_index.stats(),
+        "tiles": tile_store.stats(),
+        "renders": render_cache.stats(),
+        "artifacts": artifact_store.stats(),
+        "render_engine": render_engine.stats(),
+        "admission": admission.stats(),
+        "instagram_session": instagram_session_stats(),
+        "publish_queue": publish_queue.stats(),
+    }
+
+
+@tool(cost="geocode")
 def geocode_point(place: str) -> Dict[str, float]:
     """
     Returns the center point of a place.
@@ -59,7 +415,7 @@ def geocode_point(place: str) -> Dict[str, float]:
     return {"lat": float(result["lat"]), "lon": float(result["lon"])}
 
 
-@mcp.tool()
+@tool(cost="geocode")
 def geocode_bbox(place: str) -> List[List[float]]:
     """
     Returns the bounding box of a place as two points: southwest and northeast.
@@ -75,24 +431,211 @@ def geocode_bbox(place: str) -> List[List[float]]:
     northeast = result["northeast"]
     return [southwest, northeast]
 
-@mcp.tool()
+# local-only lookups make no remote requests, so they cost a single unit of quota
+@tool(cost="geocode", units=lambda arguments: 1 if arguments.get("local_only") else len(arguments.get("places") or []))
+def geocode_many(places: List[str], local_only: bool = False) -> List[Dict[str, Any]]:
+    """
+    Geocodes many places in one call. Prefer this over repeated geocode_point/geocode_bbox
+    calls when several places are needed.
+
+    `local_only`: answer only from the cache and the offline gazetteer, without remote
+    requests; places not known locally get an error entry
+
+    Returns one entry per place, in the same order:
+    [
+        {"place": "Minneapolis", "lat": 44.9778, "lon": -93.2650,
+         "southwest": [south_lat, west_lon], "northeast": [north_lat, east_lon]},
+        {"place": "Nowhere", "error": "No results found"}
+    ]
+    """
+    return geocode_place_list(places, local_only=local_only)
+
+@tool()
+def places_within(border: List[List[float]], limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Lists already geocoded places whose center lies inside a region, nearest to its
+    center first. Answered locally, without geocoding requests.
+
+    `border`: [[lat1, lon1], [lat2, lon2]] bottom-left, top-right
+    `limit`: maximum number of places to return
+
+    Returns entries in the geocode_many format:
+    [{"place": "Minneapolis", "lat": 44.9778, "lon": -93.2650,
+      "southwest": [south_lat, west_lon], "northeast": [north_lat, east_lon]}]
+    """
+    (south, west), (north, east) = border
+    return [place.to_dict() for place in place_index.within(south, west, north, east, limit=limit)]
+
+@tool()
+def nearest_place(lat: float, lon: float, max_distance_km: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Returns the already geocoded place whose center is nearest to a point, answered
+    locally without geocoding requests.
+
+    `max_distance_km`: only consider places at most this far away
+
+    Example return (an empty dict if no place is known):
+    {"place": "Minneapolis", "lat": 44.9778, "lon": -93.2650,
+     "southwest": [south_lat, west_lon], "northeast": [north_lat, east_lon], "distance_km": 1.2}
+    """
+    found = place_index.nearest(lat, lon, max_km=max_distance_km)
+    if found is None:
+        return {}
+    place, distance = found
+    return dict(place.to_dict(), distance_km=round(distance, 3))
+
+@tool()
+def covering_bbox(places: List[str], padding: float = 0.0) -> Dict[str, Any]:
+    """
+    Returns the bounding box covering several already geocoded places, answered locally
+    without geocoding requests. Geocode places listed in "missing" first (geocode_many).
+
+    `padding`: fraction of the box size to add on every side, e.g. 0.1
+
+    Example return:
+    {"southwest": [south_lat, west_lon], "northeast": [north_lat, east_lon], "missing": ["Nowhere"]}
+    """
+    bbox, missing = place_index.covering(places)
+    if bbox is None:
+        return {"missing": missing}
+    south, west, north, east = bbox
+    pad_lat, pad_lon = (north - south) * padding, (east - west) * padding
+    return {
+        "southwest": [max(-90.0, south - pad_lat), west - pad_lon],
+        "northeast": [min(90.0, north + pad_lat), east + pad_lon],
+        "missing": missing,
+    }
+
+@tool(cost="io", annotations=ToolAnnotations(destructiveHint=True, idempotentHint=False))
 def instagram_post_images(image_paths: List[str], caption: str) -> str:
     """
-    Posts a list of images to Instagram with the same caption.
+    Queues a list of images to be posted to Instagram with the same caption.
     If multiple images are provided, posts them as a carousel.
+    The post is published in the background; use post_status with the returned job id to follow it.
 
     Args:
-        image_paths: List of file paths to images.
+        image_paths: List of images: file paths, or artifact handles returned by create_map.
         caption: Caption for the post.
 
-    Returns a status message.
+    Returns a status message with the job id.
     """
 
-    post_images_to_instagram(image_paths, caption)
-    return "Posted images to Instagram."
+    job_id, duplicate = enqueue_post(image_paths, caption)
+    if duplicate:
+        return f"An identical post is already queued or published as job {job_id}."
+    return f"Queued Instagram post as job {job_id}."
+
+
+@tool()
+def post_status(job_id: str) -> Dict[str, Any]:
+    """
+    Returns the progress of a queued Instagram post.
+
+    `status` is one of "queued", "running", "retrying", "done" or "failed";
+    `attempts` and `last_error` describe failed attempts.
+    """
+    job = publish_queue.status(job_id)
+    if job is None:
+        return {"job_id": job_id, "error": "Unknown job id"}
+    return job
+
+def warm_up(modules: Tuple[str, ...] = WARMUP_MODULES, wait_timeout: float = 30.0) -> threading.Thread:
+    """
+    Preload heavy dependencies in a background thread once the server is listening.
+
+    Waits until the HTTP port accepts connections so warm-up never delays the first
+    requests, then imports `modules` and starts the render worker processes.
+    """
+    def run() -> None:
+        host = "127.0.0.1" if mcp.settings.host in ("0.0.0.0", "") else mcp.settings.host
+        deadline = time.monotonic() + wait_timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((host, mcp.settings.port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        start = time.perf_counter()
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                logger.warning("warm_up: could not import %s: %s", name, e)
+        render_engine.start()
+        logger.info("warm_up: preloaded %s in %.2fs", ", ".join(modules), time.perf_counter() - start)
+
+    thread = threading.Thread(target=run, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def import_time_report(top: int = 15) -> str:
+    """
+    Summarize `python -X importtime` for importing this server, then for the modules it defers.
+
+    Lists the slowest imports of each phase by cumulative time (nested imports are
+    included in their parent's time).
+    """
+    code = "import server; print('--deferred--', file=__import__('sys').stderr); " + "; ".join(
+        f"import {name}" for name in WARMUP_MODULES
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    # phase -> (depth of the rows to list, rows); startup lists what `server` itself imports
+    phases: Dict[str, Tuple[int, List[Tuple[int, str]]]] = {
+        "startup (import server)": (1, []),
+        "deferred to first use": (0, []),
+    }
+    phase = "startup (import server)"
+    row = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+    for line in result.stderr.splitlines():
+        if line == "--deferred--":
+            phase = "deferred to first use"
+            continue
+        match = row.match(line)
+        if match and len(match.group(3)) // 2 == phases[phase][0]:
+            phases[phase][1].append((int(match.group(2)), match.group(4)))
+
+    lines = []
+    for name, (_, rows) in phases.items():
+        lines.append(f"{name}: {sum(us for us, _ in rows) / 1e6:.2f}s")
+        for us, module in sorted(rows, reverse=True)[:top]:
+            lines.append(f"  {us / 1e3:9.1f} ms  {module}")
+    return "\n".join(lines)
+
 
 # run the server
 if __name__ == "__main__":
-    mcp.run(transport="streamable-http")
+    parser = argparse.ArgumentParser(description="Run the MCP server.")
+    parser.add_argument(
+        "--warm-up",
+        action="store_true",
+        default=os.environ.get("SERVER_WARMUP", "") not in ("", "0"),
+        help="preload map rendering and Instagram dependencies in the background after startup",
+    )
+    parser.add_argument("--import-time", action="store_true", help="print an import time report and exit")
+    args = parser.parse_args()
+
+    if args.import_time:
+        print(import_time_report())
+        sys.exit(0)
+
+    # uvicorn re-raises SIGTERM after its graceful shutdown; exit normally instead so
+    # atexit handlers run and the render worker processes are shut down with us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # resume any posts left in the queue by a previous run
+    publish_queue.start()
+    if args.warm_up:
+        warm_up()
+    try:
+        mcp.run(transport="streamable-http")
+    finally:
+        render_engine.shutdown()
     #mcp.run(transport="stdio")
     
\ No newline at end of file
@@ -0,0 +1,217 @@
+# admission.py
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Tuple
+
+from service import metrics
+from service.ratelimit import TokenBucket
+
+# per-client quotas: every tool call costs its class's quota_cost tokens from the
+# caller's bucket, refilled at ADMISSION_CLIENT_RATE per second (0 disables quotas)
+ADMISSION_CLIENT_HEADER = os.environ.get("ADMISSION_CLIENT_HEADER", "x-client-id")
+ADMISSION_CLIENT_RATE = float(os.environ.get("ADMISSION_CLIENT_RATE", 20))
+ADMISSION_CLIENT_BURST = float(os.environ.get("ADMISSION_CLIENT_BURST", 100))
+# buckets of clients beyond this many are dropped, least recently seen first
+ADMISSION_MAX_CLIENTS = int(os.environ.get("ADMISSION_MAX_CLIENTS", 10000))
+
+admission_decisions = metrics.counter(
+    "mcp_admission_decisions_total", "Admission decisions by cost class.", ("cost_class", "decision")
+)
+admission_wait = metrics.histogram(
+    "mcp_admission_wait_seconds", "Time admitted calls spent queued for their cost class.", ("cost_class",)
+)
+
+
+class Overloaded(Exception):
+    """Raised when a call is turned away; `retry_after` is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(f"{message}; retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class QuotaExceeded(Overloaded):
+    """Raised when a client has used up its quota."""
+
+
+class CostClass:
+    """
+    Calls of one cost class: at most `concurrency` run at once and at most `queue`
+    wait, each for up to `queue_timeout` seconds.
+
+    Limits can be overridden with ADMISSION_<NAME>_CONCURRENCY and ADMISSION_<NAME>_QUEUE.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue: int, queue_timeout: float, quota_cost: float = 1.0):
+        self.name = name
+        self.concurrency = max(1, int(os.environ.get(f"ADMISSION_{name.upper()}_CONCURRENCY", concurrency)))
+        self.queue = max(0, int(os.environ.get(f"ADMISSION_{name.upper()}_QUEUE", queue)))
+        self.queue_timeout = queue_timeout
+        self.quota_cost = quota_cost
+        self.running = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        # moving average of call durations, for retry-after hints
+        self.mean_duration = 1.0
+
+    def retry_after(self) -> float:
+        """Roughly when a slot frees up for a newly queued call."""
+        return round(max(0.5, self.mean_duration * (len(self.waiters) + 1) / self.concurrency), 1)
+
+
+class AdmissionController:
+    """
+    Admission control for tool calls.
+
+    Each tool belongs to a cost class (see CostClass). A call first pays its class's
+    quota_cost from its client's token bucket, then takes a slot in its class or
+    waits in the class's queue. Calls are refused with Overloaded (or QuotaExceeded)
+    and a retry-after hint when the bucket is empty, the queue is full or the wait
+    times out, so a saturated server answers at once instead of letting latency grow.
+    Slots are handed to waiters in arrival order. `admit` must be used from one event loop.
+    """
+
+    def __init__(
+        self,
+        classes: Dict[str, CostClass],
+        client_rate: float = ADMISSION_CLIENT_RATE,
+        client_burst: float = ADMISSION_CLIENT_BURST,
+        max_clients: int = ADMISSION_MAX_CLIENTS,
+    ):
+        self.classes = classes
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, client: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.client_rate, self.client_burst)
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            return bucket
+
+    def _charge(self, cost_class: CostClass, client: Optional[str], units: int) -> Optional[Tuple[TokenBucket, float]]:
+        """Take the call's quota cost from `client`'s bucket; returns (bucket, cost) for a refund."""
+        if self.client_rate <= 0 or client is None:
+            return None
+        bucket = self._bucket(client)
+        # a call costing more than the burst could never be admitted; cap it at the burst
+        cost = min(self.client_burst, cost_class.quota_cost * max(1, units))
+        if not bucket.try_acquire(cost):
+            admission_decisions.inc(cost_class.name, "rejected_quota")
+            raise QuotaExceeded(
+                f"Quota exceeded for client {client}", round(max(0.1, bucket.retry_after(cost)), 1)
+            )
+        return bucket, cost
+
+    async def _acquire(self, cost_class: CostClass) -> float:
+        """Take a slot of `cost_class`; returns the time spent waiting."""
+        if cost_class.running < cost_class.concurrency and not cost_class.waiters:
+            cost_class.running += 1
+            admission_decisions.inc(cost_class.name, "admitted")
+            return 0.0
+        if len(cost_class.waiters) >= cost_class.queue:
+            admission_decisions.inc(cost_class.name, "rejected_queue_full")
+            raise Overloaded(f"Server busy ({cost_class.name} calls)", cost_class.retry_after())
+
+        start = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        cost_class.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), cost_class.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as we gave up; pass it on
+                self._release(cost_class)
+            else:
+                waiter.cancel()
+                try:
+                    cost_class.waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            admission_decisions.inc(cost_class.name, "rejected_timeout")
+            raise Overloaded(
+                f"Server busy ({cost_class.name} calls queued for {cost_class.queue_timeout:.0f}s)",
+                cost_class.retry_after(),
+            ) from None
+        admission_decisions.inc(cost_class.name, "queued")
+        return time.monotonic() - start
+
+    def _release(self, cost_class: CostClass) -> None:
+        # hand the slot straight to the oldest live waiter, so it cannot be taken out of turn
+        while cost_class.waiters:
+            waiter = cost_class.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        cost_class.running -= 1
+
+    @asynccontextmanager
+    async def admit(self, name: str, client: Optional[str] = None, units: int = 1) -> AsyncIterator[None]:
+        """
+        Run the block as a call of cost class `name` by `client` (None: no quota).
+
+        `units` multiplies the quota cost, e.g. the number of maps in a batch.
+        """
+        cost_class = self.classes[name]
+        charge = self._charge(cost_class, client, units)
+        try:
+            wait = await self._acquire(cost_class)
+        except BaseException:
+            # turned away (or cancelled) before it ran: an overloaded server must not drain quotas too
+            if charge is not None:
+                charge[0].release(charge[1])
+            raise
+        admission_wait.observe(name, value=wait)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            cost_class.mean_duration = 0.8 * cost_class.mean_duration + 0.2 * (time.monotonic() - start)
+            self._release(cost_class)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            clients = len(self._buckets)
+        return {
+            "clients": clients,
+            "classes": {
+                name: {
+                    "running": c.running,
+                    "waiting": len(c.waiters),
+                    "concurrency": c.concurrency,
+                    "queue": c.queue,
+                    "mean_duration": round(c.mean_duration, 3),
+                }
+                for name, c in self.classes.items()
+            },
+        }
+
+    def gauges(self) -> Dict[Tuple[str, ...], float]:
+        """Running and waiting calls per cost class, for a metrics callback."""
+        return {
+            (name, state): value
+            for name, c in self.classes.items()
+            for state, value in (("running", c.running), ("waiting", len(c.waiters)))
+        }
+
+
+def client_key(request: Any, header: str = ADMISSION_CLIENT_HEADER) -> Optional[str]:
+    """The quota key of an HTTP request: the `header` value, else the peer address."""
+    if request is None:
+        return None
+    value = request.headers.get(header)
+    if value:
+        return value
+    return f"ip:{request.client.host}" if request.client else None
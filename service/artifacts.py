@@ -0,0 +1,116 @@
+# artifacts.py
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+
+ARTIFACT_MAX_BYTES = int(os.environ.get("ARTIFACT_MAX_BYTES", 256 * 1024 * 1024))
+ARTIFACT_MAX_ITEM_BYTES = int(os.environ.get("ARTIFACT_MAX_ITEM_BYTES", 32 * 1024 * 1024))
+ARTIFACT_TTL = float(os.environ.get("ARTIFACT_TTL", 60 * 60))  # seconds
+
+HANDLE_PREFIX = "artifact:"
+
+
+class ArtifactTooLarge(ValueError):
+    """Raised when a single artifact exceeds the per-item size limit."""
+
+
+class Artifact(NamedTuple):
+    data: bytes
+    mime_type: str
+    expires: float
+
+
+def is_handle(value: str) -> bool:
+    return isinstance(value, str) and value.startswith(HANDLE_PREFIX)
+
+
+class ArtifactStore:
+    """
+    In-memory store of rendered images, addressed by opaque handles ("artifact:...").
+
+    Artifacts expire `ttl` seconds after they are stored. The store holds at most
+    `max_bytes`; storing beyond that evicts the least recently used artifacts first.
+    `get` returns the stored bytes object itself, so handing an artifact to another
+    tool does not copy it.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = ARTIFACT_MAX_BYTES,
+        max_item_bytes: int = ARTIFACT_MAX_ITEM_BYTES,
+        ttl: float = ARTIFACT_TTL,
+    ):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = min(max_item_bytes, max_bytes)
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Artifact]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"puts": 0, "hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def put(self, data: bytes, mime_type: str) -> str:
+        """Store `data` and return its handle. Raises ArtifactTooLarge above the per-item limit."""
+        if len(data) > self.max_item_bytes:
+            raise ArtifactTooLarge(
+                f"Artifact of {len(data)} bytes exceeds the {self.max_item_bytes} byte limit"
+            )
+        handle = HANDLE_PREFIX + secrets.token_urlsafe(12)
+        with self._lock:
+            self._expire(time.monotonic())
+            while self._items and self._bytes + len(data) > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted.data)
+                self._stats["evictions"] += 1
+            self._items[handle] = Artifact(data, mime_type, time.monotonic() + self.ttl)
+            self._bytes += len(data)
+            self._stats["puts"] += 1
+        return handle
+
+    def get(self, handle: str) -> Optional[Artifact]:
+        """The artifact for `handle`, or None when it is unknown, expired or evicted."""
+        with self._lock:
+            self._expire(time.monotonic())
+            artifact = self._items.get(handle)
+            if artifact is None:
+                self._stats["misses"] += 1
+                return None
+            self._items.move_to_end(handle)
+            self._stats["hits"] += 1
+            return artifact
+
+    def expires_in(self, handle: str) -> float:
+        with self._lock:
+            artifact = self._items.get(handle)
+        return max(0.0, artifact.expires - time.monotonic()) if artifact else 0.0
+
+    def delete(self, handle: str) -> bool:
+        with self._lock:
+            artifact = self._items.pop(handle, None)
+            if artifact is not None:
+                self._bytes -= len(artifact.data)
+        return artifact is not None
+
+    def _expire(self, now: float) -> None:
+        # must be called with the lock held; expiry is checked lazily, no sweeper thread
+        expired = [handle for handle, artifact in self._items.items() if artifact.expires <= now]
+        for handle in expired:
+            self._bytes -= len(self._items.pop(handle).data)
+            self._stats["expirations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.monotonic())
+            return dict(
+                self._stats,
+                entries=len(self._items),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                max_item_bytes=self.max_item_bytes,
+                ttl=self.ttl,
+            )
+
+
+artifact_store = ArtifactStore()
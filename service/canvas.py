@@ -0,0 +1,135 @@
+# canvas.py
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# per-render budget: the rasterized canvas (4 bytes per pixel, plus about as much again
+# while encoding) and the decoded basemap (256x256 RGBA tiles, 256 KiB each)
+RENDER_MAX_PIXELS = int(os.environ.get("RENDER_MAX_PIXELS", 25_000_000))
+RENDER_MAX_BASEMAP_TILES = int(os.environ.get("RENDER_MAX_BASEMAP_TILES", 256))
+# idle figures kept per figure size; one per thread rendering that size at once is enough
+RENDER_CANVAS_POOL = int(os.environ.get("RENDER_CANVAS_POOL", 2))
+
+FigSize = Tuple[float, float]
+
+
+class RenderTooLarge(ValueError):
+    """Raised when a render would exceed the pixel or basemap budget."""
+
+
+def check_pixels(figsize: FigSize, dpi: float, max_pixels: int = RENDER_MAX_PIXELS) -> int:
+    """The pixel count of a `figsize` canvas at `dpi`; raises RenderTooLarge above `max_pixels`."""
+    pixels = int(round(figsize[0] * dpi)) * int(round(figsize[1] * dpi))
+    if pixels > max_pixels:
+        raise RenderTooLarge(
+            f"A {figsize[0]}x{figsize[1]} inch map at {dpi} dpi has {pixels} pixels, over the limit of {max_pixels}"
+        )
+    return pixels
+
+
+def check_tiles(count: int, max_tiles: int = RENDER_MAX_BASEMAP_TILES) -> int:
+    """Raises RenderTooLarge if a basemap of `count` tiles is over `max_tiles`."""
+    if count > max_tiles:
+        raise RenderTooLarge(f"The basemap needs {count} tiles, over the limit of {max_tiles}; use a smaller area")
+    return count
+
+
+class _Canvas:
+    __slots__ = ("figure", "axes", "dpi", "layout")
+
+    def __init__(self, figsize: FigSize):
+        # built without pyplot: nothing global refers to the figure, and no figure manager
+        # has to be told to close it
+        self.figure = Figure(figsize=figsize)
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        self.axes.set_axis_off()
+        self.dpi = self.figure.dpi
+        self.layout = {k: getattr(self.figure.subplotpars, k) for k in ("left", "right", "bottom", "top")}
+
+    def reset(self) -> None:
+        """Back to the state of a new figure: no artists, initial dpi and layout."""
+        self.axes.clear()
+        self.axes.set_axis_off()
+        self.figure.set_dpi(self.dpi)
+        self.figure.subplots_adjust(**self.layout)
+
+
+class CanvasPool:
+    """
+    Reusable Agg figures, each with one axes, keyed by figure size.
+
+    `figure` lends a figure to one caller at a time and takes it back however the block
+    ends: reset for the next render, or dropped if it failed mid-render. Nothing goes
+    through pyplot, so threads can render on separate figures concurrently. Up to
+    `max_idle` figures per size are kept; each keeps its Agg buffer for the next render.
+    """
+
+    def __init__(self, max_idle: int = RENDER_CANVAS_POOL, max_pixels: int = RENDER_MAX_PIXELS):
+        self.max_idle = max_idle
+        self.max_pixels = max_pixels
+        self._idle: Dict[FigSize, List[_Canvas]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "reused": 0, "discarded": 0, "in_use": 0}
+
+    def preallocate(self, figsize: FigSize, count: int = 1) -> None:
+        """Create idle figures of `figsize` ahead of the first render."""
+        canvases = [_Canvas(figsize) for _ in range(count)]
+        with self._lock:
+            self._stats["created"] += count
+            idle = self._idle.setdefault(tuple(figsize), [])
+            idle.extend(canvases[: max(0, self.max_idle - len(idle))])
+
+    @contextmanager
+    def figure(self, figsize: FigSize, dpi: float) -> Iterator[Tuple[Any, Any]]:
+        """
+        Borrow a (figure, axes) of `figsize` for a render at `dpi`.
+
+        The figure starts at the default dpi (layout is computed there, as with a new
+        figure); the render sets `dpi` when it rasterizes. Raises RenderTooLarge if
+        the canvas would exceed the pixel budget.
+        """
+        check_pixels(figsize, dpi, self.max_pixels)
+        figsize = tuple(figsize)
+        with self._lock:
+            idle = self._idle.get(figsize)
+            canvas = idle.pop() if idle else None
+            self._stats["reused" if canvas else "created"] += 1
+            self._stats["in_use"] += 1
+        if canvas is None:
+            canvas = _Canvas(figsize)
+
+        ok = False
+        try:
+            yield canvas.figure, canvas.axes
+            ok = True
+        finally:
+            keep = False
+            if ok:
+                try:
+                    canvas.reset()
+                    keep = True
+                except Exception:
+                    pass
+            with self._lock:
+                self._stats["in_use"] -= 1
+                idle = self._idle.setdefault(figsize, [])
+                if keep and len(idle) < self.max_idle:
+                    idle.append(canvas)
+                else:
+                    keep = False
+                    self._stats["discarded"] += 1
+            if not keep:
+                # drop the artists (and the arrays they hold) now rather than at the next gc
+                canvas.figure.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, idle=sum(len(v) for v in self._idle.values()))
+
+
+canvas_pool = CanvasPool()
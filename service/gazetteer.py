@@ -0,0 +1,266 @@
+# gazetteer.py
+import csv
+import hashlib
+import json
+import math
+import os
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from service.geocode_cache import normalize_query
+
+INDEX_VERSION = 1
+DEFAULT_HALF_EXTENT = 0.01  # degrees, used when the source has no bounding box
+FUZZY_THRESHOLD = 0.6
+
+# (names, lat, lon, south, west, north, east, rank); the first name is the primary one
+GazetteerRow = Tuple[List[str], float, float, float, float, float, float, float]
+
+
+def _name_hash(name: str) -> int:
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _trigrams(name: str) -> List[int]:
+    padded = f"  {name} "
+    return sorted({zlib.crc32(padded[i:i + 3].encode("utf-8")) for i in range(len(padded) - 2)})
+
+
+def _with_bbox(names: List[str], lat: float, lon: float, bbox: Optional[List[str]], rank: float) -> GazetteerRow:
+    if bbox and all(v not in (None, "") for v in bbox):
+        south, west, north, east = (float(v) for v in bbox)
+    else:
+        south, west = lat - DEFAULT_HALF_EXTENT, lon - DEFAULT_HALF_EXTENT
+        north, east = lat + DEFAULT_HALF_EXTENT, lon + DEFAULT_HALF_EXTENT
+    return names, lat, lon, south, west, north, east, rank
+
+
+def _split_alternates(value: Optional[str], sep: str) -> List[str]:
+    return [n for n in (value or "").split(sep) if n.strip()]
+
+
+def _read_records(records: Iterable[Dict[str, Any]]) -> Iterator[GazetteerRow]:
+    for rec in records:
+        names = [rec["name"]] + _split_alternates(rec.get("alternatenames"), "|")
+        rank = rec.get("importance") or rec.get("population") or 0
+        bbox = [rec.get("south"), rec.get("west"), rec.get("north"), rec.get("east")]
+        yield _with_bbox(names, float(rec["lat"]), float(rec["lon"]), bbox, float(rank))
+
+
+def read_csv(path: str) -> Iterator[GazetteerRow]:
+    """
+    Read a CSV extract with a header row.
+
+    Required columns: name, lat, lon. Optional: south, west, north, east,
+    importance (or population) and alternatenames separated by "|".
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        yield from _read_records(csv.DictReader(f))
+
+
+def read_parquet(path: str) -> Iterator[GazetteerRow]:
+    """Read a Parquet extract with the same columns as `read_csv`."""
+    import pandas as pd
+
+    frame = pd.read_parquet(path)
+    yield from _read_records(frame.where(frame.notna(), None).to_dict("records"))
+
+
+def read_geonames(path: str) -> Iterator[GazetteerRow]:
+    """Read a GeoNames dump (tab-separated, e.g. US.txt or cities15000.txt)."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 15:
+                continue
+            names = [cols[1], cols[2]] + _split_alternates(cols[3], ",")
+            yield _with_bbox(names, float(cols[4]), float(cols[5]), None, float(cols[14] or 0))
+
+
+READERS = {"csv": read_csv, "parquet": read_parquet, "geonames": read_geonames}
+
+
+def build_index(source: str, output_dir: str, fmt: Optional[str] = None) -> int:
+    """
+    Build a memory-mappable gazetteer index from a raw extract.
+
+    `fmt` is one of "csv", "parquet" or "geonames"; it is inferred from the file
+    extension when omitted (.csv, .parquet, anything else is treated as GeoNames).
+
+    Returns the number of places indexed.
+    """
+    if fmt is None:
+        ext = os.path.splitext(source)[1].lower()
+        fmt = {".csv": "csv", ".parquet": "parquet"}.get(ext, "geonames")
+    rows = list(READERS[fmt](source))
+
+    # best ranked rows first so that the first match for a name is the most important place
+    rows.sort(key=lambda r: -r[7])
+
+    coords = np.array([r[1:7] for r in rows], dtype=np.float64).reshape(-1, 6)
+    rank = np.array([r[7] for r in rows], dtype=np.float32)
+
+    keys: Dict[Tuple[int, str], int] = {}
+    postings: Dict[int, List[int]] = {}
+    tri_count = np.zeros(len(rows), dtype=np.uint16)
+    for row_id, row in enumerate(rows):
+        names = [normalize_query(n) for n in row[0]]
+        for name in names:
+            keys.setdefault((_name_hash(name), name), row_id)
+        # fuzzy matching only considers the primary name
+        grams = _trigrams(names[0])
+        tri_count[row_id] = min(len(grams), np.iinfo(np.uint16).max)
+        for gram in grams:
+            postings.setdefault(gram, []).append(row_id)
+
+    ordered_keys = sorted(keys.items(), key=lambda kv: (kv[0][0], kv[1]))
+    name_hash = np.array([k[0] for k, _ in ordered_keys], dtype=np.uint64)
+    name_row = np.array([row for _, row in ordered_keys], dtype=np.int32)
+    encoded = [k[1].encode("utf-8") for k, _ in ordered_keys]
+    name_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    name_offsets[1:] = np.cumsum([len(e) for e in encoded])
+    name_blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    tri_keys = np.array(sorted(postings), dtype=np.uint32)
+    tri_offsets = np.zeros(len(tri_keys) + 1, dtype=np.int64)
+    tri_offsets[1:] = np.cumsum([len(postings[int(k)]) for k in tri_keys])
+    tri_rows = np.array([r for k in tri_keys for r in postings[int(k)]], dtype=np.int32)
+
+    os.makedirs(output_dir, exist_ok=True)
+    arrays = {
+        "coords": coords,
+        "rank": rank,
+        "name_hash": name_hash,
+        "name_row": name_row,
+        "name_offsets": name_offsets,
+        "name_blob": name_blob,
+        "tri_keys": tri_keys,
+        "tri_offsets": tri_offsets,
+        "tri_rows": tri_rows,
+        "tri_count": tri_count,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(output_dir, f"{name}.npy"), array)
+    with open(os.path.join(output_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": INDEX_VERSION, "places": len(rows), "names": len(name_hash)}, f)
+    return len(rows)
+
+
+class Gazetteer:
+    """Read-only, memory-mapped view of an index written by `build_index`."""
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported gazetteer index version: {meta.get('version')}")
+        self.index_dir = index_dir
+        self.places = meta["places"]
+
+        def load(name: str) -> np.ndarray:
+            return np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.coords = load("coords")
+        self.rank = load("rank")
+        self.name_hash = load("name_hash")
+        self.name_row = load("name_row")
+        self.name_offsets = load("name_offsets")
+        self.name_blob = load("name_blob")
+        self.tri_keys = load("tri_keys")
+        self.tri_offsets = load("tri_offsets")
+        self.tri_rows = load("tri_rows")
+        self.tri_count = load("tri_count")
+
+    def _name_at(self, i: int) -> str:
+        return bytes(self.name_blob[self.name_offsets[i]:self.name_offsets[i + 1]]).decode("utf-8")
+
+    def exact(self, name: str) -> Optional[int]:
+        """Row id of the best ranked place called exactly `name` (after normalization)."""
+        h = np.uint64(_name_hash(name))
+        i = int(np.searchsorted(self.name_hash, h))
+        while i < len(self.name_hash) and self.name_hash[i] == h:
+            if self._name_at(i) == name:
+                return int(self.name_row[i])
+            i += 1
+        return None
+
+    def fuzzy(self, name: str, threshold: float = FUZZY_THRESHOLD) -> Optional[int]:
+        """Row id of the place whose primary name shares the most trigrams with `name`."""
+        grams = _trigrams(name)
+        postings = []
+        for gram in grams:
+            i = int(np.searchsorted(self.tri_keys, np.uint32(gram)))
+            if i < len(self.tri_keys) and self.tri_keys[i] == gram:
+                postings.append(self.tri_rows[self.tri_offsets[i]:self.tri_offsets[i + 1]])
+        if not postings:
+            return None
+
+        # a row scoring >= threshold shares at least `need` trigrams with `name`, so it is in at
+        # least one of any len(grams) - need + 1 posting lists: candidates come from that many of
+        # the shortest lists, and the long ones (common trigrams) are only probed for them
+        need = max(1, math.ceil(threshold * len(grams)))
+        postings.sort(key=len)
+        split = len(grams) - need + 1
+        candidates, shared = np.unique(np.concatenate(postings[:split]), return_counts=True)
+        for rows in postings[split:]:
+            # posting lists are in row order
+            pos = np.searchsorted(rows, candidates)
+            found = pos < len(rows)
+            found[found] = rows[pos[found]] == candidates[found]
+            shared += found
+
+        scores = shared / (len(grams) + self.tri_count[candidates].astype(np.int64) - shared)
+        scores[scores < threshold] = -1.0
+        # candidates are in row order and rows are stored best-ranked first, so argmax picks
+        # the lowest id among ties
+        best = int(np.argmax(scores))
+        return int(candidates[best]) if scores[best] >= 0 else None
+
+    def result(self, row: int) -> Dict[str, Any]:
+        lat, lon, south, west, north, east = (float(v) for v in self.coords[row])
+        return {
+            "lat": str(lat),
+            "lon": str(lon),
+            "southwest": [south, west],
+            "northeast": [north, east],
+        }
+
+    def lookup(self, place: str, fuzzy: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Geocode `place` from the local index, in the same format as `geocode_place`.
+
+        Returns None if there is no exact (or, with `fuzzy`, close enough) match.
+        """
+        name = normalize_query(place)
+        row = self.exact(name)
+        if row is None and fuzzy:
+            row = self.fuzzy(name)
+        return self.result(row) if row is not None else None
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Build or query an offline gazetteer index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build an index from a raw extract")
+    build.add_argument("source")
+    build.add_argument("output_dir")
+    build.add_argument("--format", choices=sorted(READERS))
+    lookup = commands.add_parser("lookup", help="look a place up in an index")
+    lookup.add_argument("index_dir")
+    lookup.add_argument("place")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build_index(args.source, args.output_dir, args.format)
+        print(f"Indexed {count} places into {args.output_dir}")
+    else:
+        gazetteer = Gazetteer(args.index_dir)
+        start = time.perf_counter()
+        result = gazetteer.lookup(args.place)
+        elapsed = (time.perf_counter() - start) * 1e6
+        print(f"Lookup for '{args.place}' took {elapsed:.0f}us: {result}")
@@ -1,66 +1,578 @@
-import geopandas as gpd
-import matplotlib.pyplot as plt
+import os
+import numpy as np
+import matplotlib as mpl
+from matplotlib import cbook, image as mpl_image
+from matplotlib.artist import Artist
+from matplotlib.font_manager import FontProperties
 import contextily as ctx
-from shapely.geometry import Point, Polygon
+import mercantile
+from matplotlib.patches import Rectangle
+from pyproj import Transformer
+from xyzservices import TileProvider
 from io import BytesIO
-from typing import Tuple, List, Optional
+from contextlib import ExitStack
+from typing import Any, BinaryIO, Callable, Dict, Iterator, Tuple, List, Optional, Union
+
+from service.canvas import canvas_pool, check_pixels, check_tiles
+from service.render_cache import render_cache, render_key
+from service.tiles import Bounds, add_basemap, basemap_image, calculate_zoom, show_basemap, tile_count
+from service.tracing import span
+
+# BASEMAP_URL overrides the tile server with an XYZ template ("https://host/{z}/{x}/{y}.png"),
+# e.g. a self-hosted tile server or a local stand-in for benchmarks
+BASEMAP_URL = os.environ.get("BASEMAP_URL")
+BASEMAP_SOURCE = (
+    TileProvider(name="custom", url=BASEMAP_URL, attribution="")
+    if BASEMAP_URL
+    else ctx.providers.CartoDB.PositronNoLabels
+)
+
+# Named output settings. Every profile keeps the same figure size so a preview has
+# the same layout as the final render; only the pixel density and encoding change.
+#   preview:            400x400 JPEG for quick iteration
+#   instagram_square:   1080x1080 JPEG (Instagram's feed size)
+#   print:              4000x4000 PNG (the original output)
+RENDER_PROFILES: Dict[str, Dict[str, Any]] = {
+    "preview": {"figsize": (8, 8), "dpi": 50, "format": "jpeg", "quality": 70},
+    "instagram_square": {"figsize": (8, 8), "dpi": 135, "format": "jpeg", "quality": 90},
+    "print": {"figsize": (8, 8), "dpi": 500, "format": "png", "compress_level": 6},
+}
+DEFAULT_PROFILE = "print"
+
+FORMAT_EXTENSIONS = {"png": [".png"], "jpeg": [".jpg", ".jpeg"], "webp": [".webp"]}
 
 # Each marker: (lat, lon, optional color, optional label)
 MarkerType = Tuple[float, float, Optional[str], Optional[str]]
+# A rendered map: the path written, or (encoded image, format) when rendered in memory
+MapOutput = Union[str, Tuple[bytes, str]]
+
+# generate_maps shares one basemap between overlapping maps up to this many tiles
+# (256x256 RGBA each, so 64 tiles hold 16 MiB decoded)
+BATCH_BASEMAP_MAX_TILES = int(os.environ.get("BATCH_BASEMAP_MAX_TILES", 64))
+
+_to_web_mercator = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
+
+
+def _project(lons: np.ndarray, lats: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Project lon/lat arrays to EPSG:3857."""
+    return _to_web_mercator.transform(lons, lats)
+
+
+def resolve_profile(profile: str = DEFAULT_PROFILE, format: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Look up a render profile, optionally overriding its output format ("png", "jpeg" or "webp").
+
+    Raises ValueError for unknown profiles or formats.
+    """
+    if profile not in RENDER_PROFILES:
+        raise ValueError(f"Unknown render profile '{profile}', expected one of {sorted(RENDER_PROFILES)}")
+    settings = dict(RENDER_PROFILES[profile])
+    if format:
+        format = format.lower().lstrip(".")
+        format = "jpeg" if format == "jpg" else format
+        if format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Unsupported format '{format}', expected one of {sorted(FORMAT_EXTENSIONS)}")
+        settings["format"] = format
+    return settings
+
+
+def output_path(output_filename: str, format: str) -> str:
+    """`output_filename` with its extension corrected to match `format`."""
+    root, ext = os.path.splitext(output_filename)
+    if ext.lower() in FORMAT_EXTENSIONS[format]:
+        return output_filename
+    return root + FORMAT_EXTENSIONS[format][0]
+
+
+def _save_kwargs(settings: Dict[str, Any]) -> Dict[str, Any]:
+    # encoder options go straight to Pillow, so the figure is encoded exactly once
+    if settings["format"] == "png":
+        return {"compress_level": settings.get("compress_level", 6)}
+    if settings["format"] == "jpeg":
+        return {"quality": settings.get("quality", 90), "optimize": True}
+    return {"quality": settings.get("quality", 90), "method": 4}
+
+
+def map_key(
+    border: Tuple[Tuple[float, float], Tuple[float, float]],
+    markers: List[MarkerType],
+    settings: Optional[Dict[str, Any]] = None,
+    declutter_labels: bool = True,
+) -> str:
+    """Render cache key for a map: rounded border and markers, basemap source and output settings."""
+    settings = settings or resolve_profile()
+    return render_key(
+        border=[[round(float(v), 6) for v in corner] for corner in border],
+        markers=[
+            [
+                round(float(m[0]), 6),
+                round(float(m[1]), 6),
+                (m[2] if len(m) > 2 else None) or "red",
+                (m[3] if len(m) > 3 else None) or "",
+            ]
+            for m in markers
+        ],
+        basemap=[BASEMAP_SOURCE.name, BASEMAP_SOURCE.url],
+        settings={k: list(v) if isinstance(v, tuple) else v for k, v in settings.items()},
+        declutter_labels=declutter_labels,
+    )
+
 
 def generate_map(
     output_filename: str,
     border: Tuple[Tuple[float, float], Tuple[float, float]],
-    markers: List[MarkerType]
+    markers: List[MarkerType],
+    use_cache: bool = True,
+    declutter_labels: bool = True,
+    profile: str = DEFAULT_PROFILE,
+    format: Optional[str] = None,
 ) -> str:
-    # extend the border to fit all the markers
-    if markers:
-        lats = [m[0] for m in markers]
-        lons = [m[1] for m in markers]
+    """
+    Render a map using a named profile from RENDER_PROFILES (size, dpi, format and compression).
+
+    `format` overrides the profile's format. The extension of `output_filename` is
+    corrected to match the format, so callers should use the returned path.
+
+    Markers are drawn in one scatter call; with `declutter_labels`, labels that
+    would overlap an earlier marker's label are dropped.
+
+    Identical requests are served from `render_cache`; the output is then a
+    hardlink (or copy) of the cached artifact.
+
+    Returns the path of the written file.
+    """
+    with span("generate_map", profile=profile, markers=len(markers)) as record:
+        settings = resolve_profile(profile, format)
+        output_filename = output_path(output_filename, settings["format"])
+        if not use_cache:
+            return _render_map(output_filename, border, markers, settings, declutter_labels)
+
+        key = map_key(border, markers, settings, declutter_labels)
+        if render_cache.get(key, output_filename):
+            record["attributes"]["cache"] = "hit"
+            return output_filename
+        record["attributes"]["cache"] = "miss"
+
+        rendered = render_cache.temp_path(key, FORMAT_EXTENSIONS[settings["format"]][0].lstrip("."))
+        try:
+            _render_map(rendered, border, markers, settings, declutter_labels)
+        except BaseException:
+            if os.path.exists(rendered):
+                os.remove(rendered)
+            raise
+        render_cache.put(key, rendered, output_filename)
+        return output_filename
+
+
+def generate_map_bytes(
+    border: Tuple[Tuple[float, float], Tuple[float, float]],
+    markers: List[MarkerType],
+    use_cache: bool = True,
+    declutter_labels: bool = True,
+    profile: str = DEFAULT_PROFILE,
+    format: Optional[str] = None,
+) -> Tuple[bytes, str]:
+    """
+    Render a map like `generate_map`, encoding it in memory instead of to a file.
+
+    Returns (encoded image, format).
+    """
+    with span("generate_map", profile=profile, markers=len(markers), output="buffer") as record:
+        settings = resolve_profile(profile, format)
+        key = map_key(border, markers, settings, declutter_labels) if use_cache else None
+        if key is not None:
+            data = render_cache.read(key)
+            record["attributes"]["cache"] = "miss" if data is None else "hit"
+            if data is not None:
+                return data, settings["format"]
+
+        buffer = BytesIO()
+        _render_map(buffer, border, markers, settings, declutter_labels)
+        data = buffer.getvalue()
+        if key is not None:
+            render_cache.put_bytes(key, data, FORMAT_EXTENSIONS[settings["format"]][0].lstrip("."))
+        return data, settings["format"]
+
+
+def _marker_arrays(markers: List[MarkerType]) -> Tuple[np.ndarray, np.ndarray, List[str], List[str]]:
+    lats = np.fromiter((m[0] for m in markers), dtype=np.float64, count=len(markers))
+    lons = np.fromiter((m[1] for m in markers), dtype=np.float64, count=len(markers))
+    colors = [(m[2] if len(m) > 2 else None) or "red" for m in markers]
+    labels = [(m[3] if len(m) > 3 else None) or "" for m in markers]
+    return lats, lons, colors, labels
+
+
+def _declutter(points: np.ndarray, labels: List[str], fontsize: float, dpi: float) -> List[int]:
+    """
+    Greedy label decimation: keep labels in marker order, dropping any whose
+    (estimated) box would overlap a label already kept.
+
+    `points` are the label anchors in display pixels at `dpi`.
+    Returns the indices of the labels to draw.
+    """
+    scale = dpi / 72.0
+    height = fontsize * scale
+    char_width = 0.6 * fontsize * scale
+    cell = max(height, 1.0) * 4
+
+    grid: Dict[Tuple[int, int], List[Tuple[float, float, float, float]]] = {}
+    kept = []
+    for i, label in enumerate(labels):
+        if not label:
+            continue
+        x0, y0 = points[i]
+        box = (x0, y0, x0 + len(label) * char_width, y0 + height)
+        cells = [
+            (cx, cy)
+            for cx in range(int(box[0] // cell), int(box[2] // cell) + 1)
+            for cy in range(int(box[1] // cell), int(box[3] // cell) + 1)
+        ]
+        if any(
+            box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]
+            for c in cells for other in grid.get(c, ())
+        ):
+            continue
+        for c in cells:
+            grid.setdefault(c, []).append(box)
+        kept.append(i)
+    return kept
+
+
+class _LabelLayer(Artist):
+    """
+    A map's marker labels as one artist, placed like `ax.text(x, y, label, ha="left",
+    va="bottom")` on a single line.
+
+    With `declutter`, labels are decimated (see `_declutter`) when the layer is drawn,
+    so overlaps are judged where the labels land after the final layout and dpi.
+    """
+
+    zorder = 3  # as Text
+
+    def __init__(self, xs: np.ndarray, ys: np.ndarray, labels: List[str], colors: List[str], fontsize: float, declutter: bool):
+        super().__init__()
+        self.xs = xs
+        self.ys = ys
+        self.labels = [label.replace("\n", " ") for label in labels]
+        self.colors = colors
+        self.prop = FontProperties(size=fontsize)
+        self.declutter = declutter
+
+    def draw(self, renderer) -> None:
+        if not self.get_visible():
+            return
+        points = self.axes.transData.transform(np.column_stack([self.xs, self.ys]))
+        if self.declutter:
+            indices = _declutter(points, self.labels, self.prop.get_size_in_points(), self.figure.dpi)
+        else:
+            indices = [i for i, label in enumerate(self.labels) if label]
+
+        # a bottom-aligned Text has its baseline this far above the anchor
+        descent = renderer.get_text_width_height_descent("lp", self.prop, ismath=False)[2]
+        canvas_height = renderer.get_canvas_width_height()[1]
+        gc = renderer.new_gc()
+        gc.set_antialiased(mpl.rcParams["text.antialiased"])
+        try:
+            for i in indices:
+                x, y = points[i]
+                if not (np.isfinite(x) and np.isfinite(y)):
+                    continue
+                y += descent
+                if renderer.flipy():
+                    y = canvas_height - y
+                gc.set_foreground(self.colors[i])
+                label = self.labels[i]
+                renderer.draw_text(gc, x, y, label, self.prop, 0.0, ismath=cbook.is_math_text(label))
+        finally:
+            gc.restore()
+        self.stale = False
+
+
+def _map_extent(
+    border: Tuple[Tuple[float, float], Tuple[float, float]], lats: np.ndarray, lons: np.ndarray
+) -> Tuple[float, float, float, float]:
+    """The map's (minx, maxx, miny, maxy) in EPSG:3857: `border` extended to fit all the markers."""
+    if len(lats):
         border = (
-            (min(border[0][0], min(lats)), min(border[0][1], min(lons))),
-            (max(border[1][0], max(lats)), max(border[1][1], max(lons)))
+            (min(border[0][0], lats.min()), min(border[0][1], lons.min())),
+            (max(border[1][0], lats.max()), max(border[1][1], lons.max()))
         )
 
-    # create bounding box polygon
-    bbox_poly = Polygon([
-        (border[0][1], border[0][0]),
-        (border[0][1], border[1][0]),
-        (border[1][1], border[1][0]),
-        (border[1][1], border[0][0]),
-        (border[0][1], border[0][0])
-    ])
-    bbox_gdf = gpd.GeoDataFrame(geometry=[bbox_poly], crs="EPSG:4326").to_crs(epsg=3857)
-
-    # markers GeoDataFrame
-    points = [Point(m[1], m[0]) for m in markers]
-    colors = [m[2] if m[2] else "red" for m in markers]
-    labels = [m[3] if m[3] else "" for m in markers]
-    marker_gdf = gpd.GeoDataFrame(geometry=points, crs="EPSG:4326").to_crs(epsg=3857)
-
-    # plot
-    fig, ax = plt.subplots(figsize=(8, 8))
-    bbox_gdf.plot(ax=ax, facecolor="none", edgecolor="black", linewidth=2)
-    for geom, color, label in zip(marker_gdf.geometry, colors, labels):
-        ax.scatter(geom.x, geom.y, color=color, s=100)
-        if label:
-            ax.text(geom.x, geom.y, label, fontsize=10, ha="left", va="bottom", color=color)
+    # project the border corners in one vectorized call
+    (minx, maxx), (miny, maxy) = _project(
+        np.array([border[0][1], border[1][1]]), np.array([border[0][0], border[1][0]])
+    )
+    return minx, maxx, miny, maxy
+
+
+def _plot_layers(
+    ax,
+    extent: Tuple[float, float, float, float],
+    markers: List[MarkerType],
+    declutter_labels: bool = True,
+) -> List[Any]:
+    """Draw the border rectangle, markers and labels and set the view to `extent`. Returns the artists added."""
+    lats, lons, colors, labels = _marker_arrays(markers)
+    xs, ys = _project(lons, lats)
+    minx, maxx, miny, maxy = extent
+
+    artists = [
+        ax.add_patch(Rectangle((minx, miny), maxx - minx, maxy - miny, facecolor="none", edgecolor="black", linewidth=2))
+    ]
+    # one scatter per distinct color keeps matplotlib on its single-path fast path
+    # (markers are stamped rather than rasterized one by one)
+    if markers:
+        color_array = np.array(colors, dtype=object)
+        for color in dict.fromkeys(colors):
+            mask = color_array == color
+            artists.append(ax.scatter(xs[mask], ys[mask], color=color, s=100))
 
     # clip
-    minx, miny, maxx, maxy = bbox_gdf.total_bounds
+    ax.set_aspect("equal")
     ax.set_xlim(minx, maxx)
     ax.set_ylim(miny, maxy)
 
-    # add basemap
-    ctx.add_basemap(ax, source=ctx.providers.CartoDB.PositronNoLabels)
+    # all labels in one artist, decluttered when drawn
+    if any(labels):
+        layer = _LabelLayer(xs, ys, labels, colors, fontsize=10, declutter=declutter_labels)
+        ax.add_artist(layer)
+        # like ax.text, labels are not clipped to the axes
+        layer.set_clip_on(False)
+        artists.append(layer)
+    return artists
+
+
+def _encode(
+    fig, output: Union[str, BinaryIO], settings: Dict[str, Any], draw: Optional[Callable[[], None]] = None
+) -> None:
+    # draw and encode as separate steps (byte-identical to fig.savefig) so each is timed
+    with span("rasterize", dpi=settings["dpi"]):
+        fig.set_dpi(settings["dpi"])
+        (draw or fig.canvas.draw)()
+
+    # save to the file (replacing rather than writing through a hardlinked cache artifact) or buffer
+    with span("encode", format=settings["format"]):
+        if isinstance(output, str) and os.path.lexists(output):
+            os.remove(output)
+        mpl_image.imsave(
+            output,
+            np.asarray(fig.canvas.buffer_rgba()),
+            format=settings["format"],
+            dpi=settings["dpi"],
+            pil_kwargs=_save_kwargs(settings),
+        )
+
+
+def _render_map(
+    output: Union[str, BinaryIO],
+    border: Tuple[Tuple[float, float], Tuple[float, float]],
+    markers: List[MarkerType],
+    settings: Dict[str, Any],
+    declutter_labels: bool = True,
+) -> Union[str, BinaryIO]:
+    lats, lons, _, _ = _marker_arrays(markers)
+    extent = _map_extent(border, lats, lons)
+
+    # the pool resets (or drops) the figure whatever happens below
+    with canvas_pool.figure(settings["figsize"], settings["dpi"]) as (fig, ax):
+        with span("plot"):
+            _plot_layers(ax, extent, markers, declutter_labels)
+
+        # add basemap (tiles come from the shared tile store when cached)
+        xmin, xmax, ymin, ymax = ax.axis()
+        view = _basemap_bounds((xmin, xmax, ymin, ymax))
+        check_tiles(tile_count(view, calculate_zoom(view, BASEMAP_SOURCE)))
+        add_basemap(ax, source=BASEMAP_SOURCE)
+
+        ax.set_axis_off()
+        fig.tight_layout()
+
+        _encode(fig, output, settings)
+    return output
+
+
+def _basemap_bounds(extent: Tuple[float, float, float, float]) -> Bounds:
+    # the lon/lat bounds add_basemap fetches for a view of `extent`
+    minx, maxx, miny, maxy = extent
+    west, south = mercantile.lnglat(minx, miny)
+    east, north = mercantile.lnglat(maxx, maxy)
+    return west, south, east, north
+
+
+def _plan_basemaps(jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Group map jobs whose basemaps overlap at the same zoom level.
+
+    Each group's basemap covers the union of its maps' bounds and is fetched once;
+    a map joins the first group it overlaps unless the union would exceed
+    BATCH_BASEMAP_MAX_TILES tiles.
+    """
+    groups: List[Dict[str, Any]] = []
+    for job in jobs:
+        west, south, east, north = job["bounds"]
+        for group in groups:
+            g_west, g_south, g_east, g_north = group["bounds"]
+            if group["zoom"] != job["zoom"] or west > g_east or east < g_west or south > g_north or north < g_south:
+                continue
+            union = (min(west, g_west), min(south, g_south), max(east, g_east), max(north, g_north))
+            if tile_count(union, job["zoom"]) <= BATCH_BASEMAP_MAX_TILES:
+                group["bounds"] = union
+                group["jobs"].append(job)
+                break
+        else:
+            groups.append({"zoom": job["zoom"], "bounds": job["bounds"], "jobs": [job]})
+    return groups
+
+
+def _layered_draw(fig, ax, backgrounds: Dict[Tuple[Any, ...], Any], layers: List[Any]) -> Callable[[], None]:
+    """
+    A draw function that rasterizes everything but `layers` (the basemap) once per view
+    and only draws `layers` over it.
+
+    The basemap pixels depend only on the dpi, axes position and limits, so maps of
+    the same view reuse a saved copy of them from `backgrounds`. The layers are drawn
+    in the order a full draw would use, so the result is byte-identical to one.
+    """
+    def draw() -> None:
+        view = (
+            fig.dpi,
+            tuple(fig.get_size_inches()),
+            ax.get_position(original=True).bounds,
+            ax.get_xlim(),
+            ax.get_ylim(),
+        )
+        background = backgrounds.get(view)
+        if background is None:
+            for layer in layers:
+                layer.set_visible(False)
+            try:
+                fig.canvas.draw()
+            finally:
+                for layer in layers:
+                    layer.set_visible(True)
+            background = backgrounds[view] = fig.canvas.copy_from_bbox(fig.bbox)
+        else:
+            fig.canvas.restore_region(background)
+            # normally done by the full draw; the layers' transforms depend on it
+            ax.apply_aspect()
+        # a full draw orders an axes' artists by zorder, keeping insertion order for ties
+        order = {id(artist): i for i, artist in enumerate(ax.get_children())}
+        for layer in sorted(layers, key=lambda a: (a.get_zorder(), order.get(id(a), 0))):
+            ax.draw_artist(layer)
+
+    return draw
+
+
+def generate_maps(specs: List[Dict[str, Any]], use_cache: bool = True) -> Iterator[Tuple[int, MapOutput]]:
+    """
+    Render many maps, sharing basemaps and one figure between them.
+
+    Each spec is a dict of `generate_map` arguments: "border", optional "markers",
+    "profile", "format" and "declutter_labels", and "output_filename" to write a
+    file; without one the map is encoded in memory.
+
+    Cached maps are yielded first. The rest are grouped by overlapping extent
+    (see `_plan_basemaps`); each group's basemap is fetched and decoded once, and
+    every map is drawn on a reused figure by swapping only its marker layers.
+
+    Yields (spec index, path or (encoded image, format)) as each map finishes.
+    Raises ValueError before rendering anything if a spec has an unknown profile or format.
+    """
+    jobs = []
+    for index, spec in enumerate(specs):
+        settings = resolve_profile(spec.get("profile", DEFAULT_PROFILE), spec.get("format"))
+        markers = spec.get("markers") or []
+        output_filename = spec.get("output_filename")
+        declutter_labels = spec.get("declutter_labels", True)
+        jobs.append({
+            "index": index,
+            "border": spec["border"],
+            "markers": markers,
+            "settings": settings,
+            "declutter_labels": declutter_labels,
+            "output_filename": output_path(output_filename, settings["format"]) if output_filename else None,
+            "key": map_key(spec["border"], markers, settings, declutter_labels) if use_cache else None,
+        })
+
+    with span("generate_maps", maps=len(jobs)) as record:
+        pending = []
+        for job in jobs:
+            if job["key"] is not None:
+                if job["output_filename"]:
+                    if render_cache.get(job["key"], job["output_filename"]):
+                        yield job["index"], job["output_filename"]
+                        continue
+                else:
+                    data = render_cache.read(job["key"])
+                    if data is not None:
+                        yield job["index"], (data, job["settings"]["format"])
+                        continue
+            lats, lons, _, _ = _marker_arrays(job["markers"])
+            job["extent"] = _map_extent(job["border"], lats, lons)
+            job["bounds"] = _basemap_bounds(job["extent"])
+            job["zoom"] = calculate_zoom(job["bounds"], BASEMAP_SOURCE)
+            pending.append(job)
+
+        groups = _plan_basemaps(pending)
+        record["attributes"].update(rendered=len(pending), basemaps=len(groups))
+
+        for job in pending:
+            check_pixels(job["settings"]["figsize"], job["settings"]["dpi"])
+        for group in groups:
+            check_tiles(tile_count(group["bounds"], group["zoom"]))
+
+        # one pooled figure per figure size, reset to its initial layout and dpi before every map
+        with ExitStack() as figures_in_use:
+            figures: Dict[Tuple[float, float], Tuple[Any, Any, float, Dict[str, float]]] = {}
+            for group in groups:
+                with span("basemap", maps=len(group["jobs"])):
+                    image, image_extent = basemap_image(group["bounds"], BASEMAP_SOURCE, group["zoom"])
+                backgrounds: Dict[Tuple[Any, ...], Any] = {}
+                for job in group["jobs"]:
+                    settings = job["settings"]
+                    if settings["figsize"] not in figures:
+                        fig, ax = figures_in_use.enter_context(canvas_pool.figure(settings["figsize"], settings["dpi"]))
+                        layout = {k: getattr(fig.subplotpars, k) for k in ("left", "right", "bottom", "top")}
+                        figures[settings["figsize"]] = (fig, ax, fig.dpi, layout)
+                    fig, ax, dpi, layout = figures[settings["figsize"]]
+                    fig.set_dpi(dpi)
+                    fig.subplots_adjust(**layout)
+
+                    with span("map", markers=len(job["markers"])):
+                        with span("plot"):
+                            artists = _plot_layers(ax, job["extent"], job["markers"], job["declutter_labels"])
+                        basemap_layer, *overlays = show_basemap(ax, image, image_extent, BASEMAP_SOURCE)
+                        fig.tight_layout()
+                        draw = _layered_draw(fig, ax, backgrounds, artists + overlays)
+                        artists.extend([basemap_layer, *overlays])
 
-    ax.set_axis_off()
-    plt.tight_layout()
+                        output: Union[str, BinaryIO]
+                        if job["output_filename"]:
+                            output = job["output_filename"]
+                            if job["key"] is not None:
+                                output = render_cache.temp_path(job["key"], FORMAT_EXTENSIONS[settings["format"]][0].lstrip("."))
+                        else:
+                            output = BytesIO()
+                        try:
+                            _encode(fig, output, settings, draw)
+                        except BaseException:
+                            if isinstance(output, str) and output != job["output_filename"] and os.path.exists(output):
+                                os.remove(output)
+                            raise
+                        finally:
+                            for artist in artists:
+                                artist.remove()
 
-    # save to file
-    plt.savefig(output_filename, format="png", dpi=500)
-    plt.close()
-    return output_filename
+                    ext = FORMAT_EXTENSIONS[settings["format"]][0].lstrip(".")
+                    if isinstance(output, BytesIO):
+                        data = output.getvalue()
+                        if job["key"] is not None:
+                            render_cache.put_bytes(job["key"], data, ext)
+                        yield job["index"], (data, settings["format"])
+                    else:
+                        if output != job["output_filename"]:
+                            render_cache.put(job["key"], output, job["output_filename"])
+                        yield job["index"], job["output_filename"]
 
 
 if __name__ == "__main__":
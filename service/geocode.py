@@ -1,34 +1,62 @@
 # geocode.py
+import json
+import os
 import requests
-from typing import Dict, Any, Optional
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional
 
-NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+from service.geocode_cache import GeocodeCache, normalize_query
+from service.place_index import PlaceIndex
+from service.ratelimit import TokenBucket
+from service.tracing import bind, span
 
-def geocode_place(place: str) -> Optional[Dict[str, Any]]:
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+NOMINATIM_RATE = float(os.environ.get("NOMINATIM_RATE", 1.0))  # requests per second, per usage policy
+GEOCODE_WORKERS = int(os.environ.get("GEOCODE_WORKERS", 4))
+GAZETTEER_INDEX = os.environ.get(
+    "GAZETTEER_INDEX", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "gazetteer")
+)
+
+# shared two-tier (memory + sqlite) cache in front of Nominatim
+geocode_cache = GeocodeCache()
+# spatial index over every place resolved through the cache, stored in the same file
+place_index = PlaceIndex(geocode_cache.path)
+
+# one pooled HTTP session and one rate limiter for every Nominatim request
+nominatim_limiter = TokenBucket(rate=NOMINATIM_RATE, capacity=1)
+_session = requests.Session()
+_session.headers["User-Agent"] = "Dan-MCP-Server/1.0"  # required by Nominatim usage policy
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=GEOCODE_WORKERS))
+_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=GEOCODE_WORKERS))
+
+
+class GeocodeError(Exception):
+    """Raised when the geocoding service could not be reached or answered with an error."""
+
+
+def _query_nominatim(place: str) -> Optional[Dict[str, Any]]:
     """
-    Geocode a place name into a bounding box using OpenStreetMap Nominatim.
-    
-    Returns a dictionary with:
-    {
-        "lat": str,
-        "lon": str,
-        "boundingbox": [south, north, west, east]
-    }
-    
-    Returns None if no result is found.
+    Query Nominatim for a single place.
+
+    Returns None if the place has no result, raises GeocodeError on transport/HTTP errors
+    so that those are never cached as negative results.
     """
     params = {
         "q": place,
         "format": "json",
         "limit": 1
     }
-    headers = {
-        "User-Agent": "Dan-MCP-Server/1.0"  # required by Nominatim usage policy
-    }
-    
-    response = requests.get(NOMINATIM_URL, params=params, headers=headers)
+
+    nominatim_limiter.acquire()
+    try:
+        with span("geocode.http"):
+            response = _session.get(NOMINATIM_URL, params=params, timeout=30)
+    except requests.RequestException as e:
+        raise GeocodeError(str(e)) from e
     if response.status_code != 200:
-        return None
+        raise GeocodeError(f"Nominatim returned HTTP {response.status_code}")
 
     results = response.json()
     if not results:
@@ -43,10 +71,237 @@ def geocode_place(place: str) -> Optional[Dict[str, Any]]:
         "northeast": [float(result["boundingbox"][1]), float(result["boundingbox"][3])]
     }
 
+
+class GeocoderBackend(ABC):
+    """
+    A source of geocode results.
+
+    `lookup` returns a result in the `geocode_place` format, None if the place is
+    unknown to this backend, or raises GeocodeError if the backend failed.
+    `approximate` returns a near match, used only when no backend knows the place.
+    `remote` backends make network requests and are skipped by local-only lookups.
+    """
+
+    name = "backend"
+    remote = False
+
+    @abstractmethod
+    def lookup(self, place: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    def approximate(self, place: str) -> Optional[Dict[str, Any]]:
+        return None
+
+
+class NominatimBackend(GeocoderBackend):
+    """Remote lookups against OpenStreetMap Nominatim."""
+
+    name = "nominatim"
+    remote = True
+
+    def lookup(self, place: str) -> Optional[Dict[str, Any]]:
+        return _query_nominatim(place)
+
+
+class GazetteerBackend(GeocoderBackend):
+    """Offline lookups against a local index built with `python -m service.gazetteer build`."""
+
+    name = "gazetteer"
+
+    def __init__(self, index_dir: str = GAZETTEER_INDEX):
+        from service.gazetteer import Gazetteer
+
+        self.gazetteer = Gazetteer(index_dir)
+
+    def lookup(self, place: str) -> Optional[Dict[str, Any]]:
+        return self.gazetteer.lookup(place, fuzzy=False)
+
+    def approximate(self, place: str) -> Optional[Dict[str, Any]]:
+        # a fuzzy match can be a different town with a similar name: only used after
+        # every backend (Nominatim included) has no exact result
+        row = self.gazetteer.fuzzy(normalize_query(place))
+        return self.gazetteer.result(row) if row is not None else None
+
+
+def _default_backends() -> List[GeocoderBackend]:
+    # the offline index answers first when one has been built, Nominatim covers the misses
+    if os.path.isfile(os.path.join(GAZETTEER_INDEX, "meta.json")):
+        return [GazetteerBackend(GAZETTEER_INDEX), NominatimBackend()]
+    return [NominatimBackend()]
+
+
+# backends are tried in order until one returns a result
+backends: List[GeocoderBackend] = _default_backends()
+
+
+def _resolve(place: str, local_only: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Ask each backend in turn, then each for an approximate match.
+
+    Returns None only if every backend answered that the place is unknown; raises
+    GeocodeError if there was no result and at least one backend failed (an
+    approximate match is not trusted while a backend could not answer).
+    With `local_only`, only backends that are not `remote` are asked, for exact
+    matches; None then only means the place is not known locally.
+    """
+    error: Optional[GeocodeError] = None
+    for backend in backends:
+        if local_only and backend.remote:
+            continue
+        try:
+            with span(f"geocode.{backend.name}"):
+                result = backend.lookup(place)
+        except GeocodeError as e:
+            error = e
+            continue
+        if result is not None:
+            return result
+    if error is not None:
+        raise error
+    if local_only:
+        return None
+    for backend in backends:
+        result = backend.approximate(place)
+        if result is not None:
+            return result
+    return None
+
+
+def _remember(place: str, result: Optional[Dict[str, Any]]) -> None:
+    geocode_cache.set(place, result)
+    place_index.add(place, result)
+
+
+def geocode_place(place: str) -> Optional[Dict[str, Any]]:
+    """
+    Geocode a place name into a bounding box using the configured `backends`
+    (a local gazetteer if one is built, then OpenStreetMap Nominatim).
+    Results (including misses) are served from `geocode_cache` when available;
+    new results are also added to `place_index`.
+
+    Returns a dictionary with:
+    {
+        "lat": str,
+        "lon": str,
+        "southwest": [south, west],
+        "northeast": [north, east]
+    }
+
+    Returns None if no result is found.
+    """
+    hit, result = geocode_cache.get(place)
+    if hit:
+        return result
+
+    try:
+        result = _resolve(place)
+    except GeocodeError:
+        return None
+
+    _remember(place, result)
+    return result
+
+
+def _batch_item(place: str, result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if result is None:
+        return {"place": place, "error": "No results found"}
+    return {
+        "place": place,
+        "lat": float(result["lat"]),
+        "lon": float(result["lon"]),
+        "southwest": result["southwest"],
+        "northeast": result["northeast"],
+    }
+
+
+def geocode_many(
+    places: List[str], max_workers: int = GEOCODE_WORKERS, local_only: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Geocode several places at once.
+
+    Duplicate queries are resolved once, cache hits are served immediately and the
+    remaining places are resolved concurrently through the configured `backends`
+    (remote requests share one session and are paced by `nominatim_limiter`).
+    With `local_only` no remote backend is asked, so nothing waits on or spends the
+    Nominatim rate limit; places not known locally get an error and are not cached.
+
+    Returns one dictionary per input place, in input order:
+    {"place": str, "lat": float, "lon": float, "southwest": [...], "northeast": [...]}
+    or {"place": str, "error": str} if that place could not be geocoded.
+    """
+    resolved: Dict[str, Dict[str, Any]] = {}
+    pending: Dict[str, str] = {}
+    for place in places:
+        key = normalize_query(place)
+        if key in resolved or key in pending:
+            continue
+        hit, result = geocode_cache.get(place)
+        if hit:
+            resolved[key] = _batch_item(place, result)
+        else:
+            pending[key] = place
+
+    def fetch(place: str) -> Dict[str, Any]:
+        try:
+            result = _resolve(place, local_only)
+        except GeocodeError as e:
+            return {"place": place, "error": str(e)}
+        if result is None and local_only:
+            return {"place": place, "error": "Not known locally"}
+        _remember(place, result)
+        return _batch_item(place, result)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            for key, item in zip(pending, executor.map(bind(fetch), pending.values())):
+                resolved[key] = item
+
+    return [dict(resolved[normalize_query(place)], place=place) for place in places]
+
+
+def warm_cache(path: str) -> int:
+    """
+    Pre-warm the geocode cache from a file.
+
+    A `.json` file may hold either a mapping of place -> result (as returned by
+    `geocode_place`, or null for known misses) which is loaded without any network
+    traffic, or a list of place names. Any other file is read as one place name per line.
+    Place names are resolved through `geocode_place`.
+
+    Returns the number of places now cached.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+        else:
+            data = [line.strip() for line in f if line.strip()]
+
+    if isinstance(data, dict):
+        for place, result in data.items():
+            _remember(place, result)
+        return len(data)
+
+    for place in data:
+        geocode_place(place)
+    return len(data)
+
+
 if __name__ == "__main__":
-    place = "mall of america"
-    result = geocode_place(place)
-    if result:
-        print(f"Geocoding result for '{place}': {result}")
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Geocode a place or manage the geocode cache.")
+    parser.add_argument("place", nargs="?", default="mall of america")
+    parser.add_argument("--warm", metavar="FILE", help="pre-warm the cache from FILE")
+    args = parser.parse_args()
+
+    if args.warm:
+        print(f"Warmed {warm_cache(args.warm)} places from {args.warm}")
+        print(f"Cache stats: {geocode_cache.stats()}")
+        print(f"Place index stats: {place_index.stats()}")
     else:
-        print(f"No results found for '{place}'")
\ No newline at end of file
+        result = geocode_place(args.place)
+        if result:
+            print(f"Geocoding result for '{args.place}': {result}")
+        else:
+            print(f"No results found for '{args.place}'")
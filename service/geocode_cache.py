@@ -0,0 +1,142 @@
+# geocode_cache.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+DEFAULT_PATH = os.environ.get("GEOCODE_CACHE_PATH", os.path.join(CACHE_DIR, "geocode.sqlite"))
+DEFAULT_TTL = float(os.environ.get("GEOCODE_CACHE_TTL", 30 * 24 * 3600))  # 30 days
+DEFAULT_NEGATIVE_TTL = float(os.environ.get("GEOCODE_NEGATIVE_TTL", 24 * 3600))  # 1 day
+DEFAULT_MAX_ENTRIES = int(os.environ.get("GEOCODE_CACHE_SIZE", 4096))
+
+
+def normalize_query(place: str) -> str:
+    """Normalize a place query so trivially different spellings share a cache key."""
+    return " ".join(place.casefold().split())
+
+
+class GeocodeCache:
+    """
+    Two-tier cache for geocode results: an in-process LRU in front of a SQLite store.
+
+    `None` results are cached too (negative caching) but expire after `negative_ttl`.
+    Pass `path=None` to keep the cache in memory only.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_PATH,
+        ttl: float = DEFAULT_TTL,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[Optional[Dict[str, Any]], float]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT,"
+                " expires REAL NOT NULL)"
+            )
+
+    def get(self, place: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """
+        Look up a place.
+
+        Returns (hit, result). `hit` is False when the place is unknown or expired;
+        a hit may still carry a `None` result for places known not to resolve.
+        """
+        key = normalize_query(place)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[0]
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires FROM geocode WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    result = json.loads(row[0]) if row[0] is not None else None
+                    self._remember(key, result, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return True, result
+
+            self.misses += 1
+            return False, None
+
+    def set(self, place: str, result: Optional[Dict[str, Any]], ttl: Optional[float] = None) -> None:
+        """Store a result (or `None` for a place that did not resolve)."""
+        key = normalize_query(place)
+        if ttl is None:
+            ttl = self.ttl if result is not None else self.negative_ttl
+        expires = time.time() + ttl
+        with self._lock:
+            self._remember(key, result, expires)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO geocode (key, value, expires) VALUES (?, ?, ?)",
+                    (key, json.dumps(result) if result is not None else None, expires),
+                )
+
+    def _remember(self, key: str, result: Optional[Dict[str, Any]], expires: float) -> None:
+        self._memory[key] = (result, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def purge_expired(self) -> int:
+        """Drop expired rows from disk. Returns the number of rows removed."""
+        if self._db is None:
+            return 0
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM geocode WHERE expires <= ?", (time.time(),))
+            return cursor.rowcount
+
+    def clear(self) -> None:
+        """Remove every entry from both tiers and reset the counters."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM geocode")
+            self.hits = self.disk_hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            disk_entries = 0
+            if self._db is not None:
+                disk_entries = self._db.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
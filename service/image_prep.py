@@ -0,0 +1,155 @@
+# image_prep.py
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import BinaryIO, List, Union
+
+from PIL import Image, ImageOps
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+PREPARED_DIR = os.environ.get("PREPARED_IMAGE_DIR", os.path.join(CACHE_DIR, "prepared"))
+TARGET_WIDTH = int(os.environ.get("INSTAGRAM_TARGET_WIDTH", 1080))
+JPEG_QUALITY = int(os.environ.get("INSTAGRAM_JPEG_QUALITY", 90))
+PREP_WORKERS = int(os.environ.get("IMAGE_PREP_WORKERS", 4))
+PREPARED_MAX_BYTES = int(os.environ.get("PREPARED_IMAGE_BYTES", 256 * 1024 * 1024))
+# prepared images younger than this are never evicted: a post uploads them right after preparing
+# (images of posts waiting in the publish queue are kept however old they are)
+PREPARED_MIN_AGE = 600
+
+# Instagram feed posts must be between 4:5 portrait and 1.91:1 landscape
+MIN_ASPECT = 4 / 5
+MAX_ASPECT = 1.91
+
+# bump when the output settings change so stale prepared images are not reused
+PREP_VERSION = 2
+
+_evict_lock = threading.Lock()
+
+
+def _new_digest() -> "hashlib._Hash":
+    return hashlib.sha256(f"{PREP_VERSION}:{TARGET_WIDTH}:{JPEG_QUALITY}".encode("utf-8"))
+
+
+def _source_hash(path: str) -> str:
+    digest = _new_digest()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fit(image: Image.Image) -> Image.Image:
+    """Upright, flatten to RGB, pad onto white to an allowed aspect ratio and downscale to TARGET_WIDTH."""
+    # the output carries no EXIF, so apply the orientation tag to the pixels first
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        background = Image.new("RGB", image.size, "white")
+        rgba = image.convert("RGBA")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        image = background
+
+    width, height = image.size
+    aspect = width / height
+    if aspect < MIN_ASPECT or aspect > MAX_ASPECT:
+        # pad rather than crop so no part of a map is lost
+        if aspect < MIN_ASPECT:
+            canvas = Image.new("RGB", (round(height * MIN_ASPECT), height), "white")
+        else:
+            canvas = Image.new("RGB", (width, round(width / MAX_ASPECT)), "white")
+        canvas.paste(image, ((canvas.width - width) // 2, (canvas.height - height) // 2))
+        image = canvas
+
+    if image.width > TARGET_WIDTH:
+        image = image.resize((TARGET_WIDTH, round(image.height * TARGET_WIDTH / image.width)), Image.LANCZOS)
+    return image
+
+
+def prepare_image(path: str) -> str:
+    """
+    Convert one image to an upload-ready JPEG: Instagram dimensions, optimized encoding, no metadata.
+
+    Results are cached in PREPARED_DIR by a hash of the source bytes; an image that
+    is already in PREPARED_DIR is returned as is.
+    Returns the path of the prepared image.
+    """
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(PREPARED_DIR):
+        return path
+    return _prepare(path, _source_hash(path))
+
+
+def prepare_image_data(data: bytes) -> str:
+    """`prepare_image` for an image held in memory (e.g. an artifact); `data` is read without copying."""
+    digest = _new_digest()
+    digest.update(data)
+    return _prepare(BytesIO(data), digest.hexdigest())
+
+
+def _prepare(source: Union[str, BinaryIO], source_hash: str) -> str:
+    os.makedirs(PREPARED_DIR, exist_ok=True)
+    prepared = os.path.join(PREPARED_DIR, source_hash + ".jpg")
+    if os.path.exists(prepared):
+        try:
+            # mtime doubles as last use, so eviction drops the least recently used first
+            os.utime(prepared)
+        except FileNotFoundError:
+            pass
+        else:
+            return prepared
+
+    with Image.open(source) as opened:
+        image = _fit(opened)
+        # _fit may return the source itself when nothing needs changing; decode before it is closed
+        image.load()
+    # no exif/icc arguments are passed, so the output carries no metadata
+    tmp = f"{prepared}.{os.getpid()}.{threading.get_ident()}.tmp"
+    image.save(tmp, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp, prepared)
+    _evict(keep=prepared)
+    return prepared
+
+
+def _evict(keep: str) -> None:
+    """Remove the least recently used prepared images once PREPARED_DIR is over PREPARED_MAX_BYTES."""
+    with _evict_lock:
+        entries = []
+        with os.scandir(PREPARED_DIR) as it:
+            for entry in it:
+                if not entry.name.endswith(".jpg"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total <= PREPARED_MAX_BYTES:
+            return
+        # queued posts (artifacts in particular) refer to prepared files by path, and a
+        # retry can come long after PREPARED_MIN_AGE
+        from service.instagram import publish_queue
+
+        pinned = {os.path.abspath(p) for p in publish_queue.pending_paths()}
+        excess = total - int(PREPARED_MAX_BYTES * 0.9)
+        cutoff = time.time() - PREPARED_MIN_AGE
+        for mtime, size, path in sorted(entries):
+            if excess <= 0 or mtime > cutoff:
+                break
+            if path == keep or os.path.abspath(path) in pinned:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            excess -= size
+
+
+def prepare_images(paths: List[str]) -> List[str]:
+    """Prepare a carousel's images in parallel. Returns prepared paths in input order."""
+    if len(paths) <= 1:
+        return [prepare_image(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=min(PREP_WORKERS, len(paths))) as executor:
+        return list(executor.map(prepare_image, paths))
@@ -1,36 +1,174 @@
 # post_images_instagram.py
-from instagrapi import Client
-from typing import List
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import logging
 import os
+import threading
+
+from service.artifacts import artifact_store, is_handle
+from service.publish_queue import PermanentPublishError, PublishQueue
+
+# instagrapi (and PIL, via image_prep) are imported on first use: they are slow to
+# import and most server processes never post
+if TYPE_CHECKING:
+    from instagrapi import Client
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+
+INSTAGRAM_USERNAME = os.environ.get("INSTAGRAM_USERNAME", "")
+INSTAGRAM_PASSWORD = os.environ.get("INSTAGRAM_PASSWORD", "")
+SESSION_PATH = os.environ.get("INSTAGRAM_SESSION_PATH", os.path.join(CONFIG_DIR, "instagram_session.json"))
+
+logger = logging.getLogger("uncover.instagram")
+
+# one long-lived client per process; the lock serializes logins and uploads through it
+_client: Optional["Client"] = None
+_client_lock = threading.Lock()
+_stats = {"logins": 0, "relogins": 0, "session_loads": 0, "session_reuses": 0, "posts": 0}
+
+
+def _login(cl: "Client", relogin: bool = False) -> None:
+    cl.login(INSTAGRAM_USERNAME, INSTAGRAM_PASSWORD, relogin=relogin)
+    cl.dump_settings(SESSION_PATH)
+
+
+def _get_client() -> "Client":
+    """
+    Return the shared client, creating it on first use. Must be called with `_client_lock` held.
+
+    A new client restores the persisted session when there is one (no login
+    handshake); it only performs a full login when no session was saved.
+    """
+    global _client
+    if _client is not None:
+        _stats["session_reuses"] += 1
+        return _client
+
+    from instagrapi import Client
+
+    cl = Client()
+    if os.path.isfile(SESSION_PATH):
+        cl.load_settings(SESSION_PATH)
+        # returns immediately when the restored settings hold a logged-in user
+        cl.login(INSTAGRAM_USERNAME, INSTAGRAM_PASSWORD)
+        _stats["session_loads"] += 1
+    else:
+        _login(cl)
+        _stats["logins"] += 1
+    _client = cl
+    return cl
+
+
+def _relogin() -> "Client":
+    """
+    Replace the shared client with a freshly logged-in one. Must be called with `_client_lock` held.
+
+    instagrapi counts relogins per client and refuses a third, so a long-lived
+    process starts over with a new client (keeping the stored device settings).
+    """
+    global _client
+    from instagrapi import Client
+
+    cl = Client()
+    if os.path.isfile(SESSION_PATH):
+        cl.load_settings(SESSION_PATH)
+    _login(cl, relogin=True)
+    _client = cl
+    return cl
+
+
+def _upload(cl: "Client", valid_images: List[str], caption: str) -> None:
+    # Post single image or carousel
+    if len(valid_images) == 1:
+        logger.info("Posting single image: %s", valid_images[0])
+        cl.photo_upload(valid_images[0], caption)
+    else:
+        logger.info("Posting carousel with %d images.", len(valid_images))
+        cl.album_upload(valid_images, caption)
+
 
 def post_images_to_instagram(image_paths: List[str], caption: str):
     """
     Posts a list of images to Instagram with the same caption.
     If multiple images are provided, posts them as a carousel.
 
+    Images are first converted to Instagram-sized JPEGs (see service.image_prep).
+    Uses a shared, lazily created client whose session is persisted to SESSION_PATH;
+    a fresh login only happens when the stored session is rejected.
+
     Args:
         image_paths: List of file paths to images.
         caption: Caption for the post.
+
+    Raises:
+        PermanentPublishError: If none of the images exist.
     """
-    # Initialize client and login
-    cl = Client()
-    cl.login("", "")
+    from instagrapi.exceptions import LoginRequired
+    from service.image_prep import prepare_images
 
     # Filter out invalid paths
     valid_images = [img for img in image_paths if os.path.isfile(img)]
     if not valid_images:
-        print("No valid images found.")
-        return
+        # raised rather than returned, so a queued post whose files are gone fails instead of passing as done
+        raise PermanentPublishError("No valid images found.")
 
-    # Post single image or carousel
-    if len(valid_images) == 1:
-        print(f"Posting single image: {valid_images[0]}")
-        cl.photo_upload(valid_images[0], caption)
-    else:
-        print(f"Posting carousel with {len(valid_images)} images.")
-        cl.album_upload(valid_images, caption)
-    
-    print("Done posting images!")
+    # resize/re-encode before taking the client lock so uploads don't wait on it
+    valid_images = prepare_images(valid_images)
+
+    with _client_lock:
+        cl = _get_client()
+        try:
+            _upload(cl, valid_images, caption)
+        except LoginRequired:
+            # the stored session expired: log in again once and retry
+            logger.info("Instagram session expired, logging in again.")
+            cl = _relogin()
+            _stats["relogins"] += 1
+            _upload(cl, valid_images, caption)
+        _stats["posts"] += 1
+
+    logger.info("Done posting images!")
+
+
+def session_stats() -> Dict[str, Any]:
+    """Login/session reuse counters for the shared client."""
+    # counters are only written under _client_lock; a copy is safe to take without it,
+    # so a metrics scrape never waits for an upload to finish
+    return dict(_stats, client_ready=_client is not None)
+
+
+# durable background queue that publishes through post_images_to_instagram
+publish_queue = PublishQueue(uploader=post_images_to_instagram)
+
+
+def _resolve_images(images: List[str]) -> List[str]:
+    """
+    Replace artifact handles with prepared upload files.
+
+    The artifact's bytes are encoded straight to the upload-ready JPEG, so the
+    (durable) queue only ever holds file paths. Raises ValueError for handles that
+    are unknown or have expired.
+    """
+    resolved = []
+    for image in images:
+        if is_handle(image):
+            from service.image_prep import prepare_image_data
+
+            artifact = artifact_store.get(image)
+            if artifact is None:
+                raise ValueError(f"Unknown or expired artifact {image}; render the map again")
+            image = prepare_image_data(artifact.data)
+        resolved.append(image)
+    return resolved
+
+
+def enqueue_post(images: List[str], caption: str) -> Tuple[str, bool]:
+    """
+    Queue a post for background publishing.
+
+    `images` are file paths or artifact handles (see service.artifacts).
+    Returns (job_id, duplicate); see PublishQueue.enqueue.
+    """
+    return publish_queue.enqueue(_resolve_images(images), caption, account=INSTAGRAM_USERNAME)
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,317 @@
+# place_index.py
+import heapq
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from service.geocode_cache import DEFAULT_PATH, normalize_query
+
+# quadtree leaves holding more places than this are split in four
+PLACE_INDEX_LEAF_SIZE = int(os.environ.get("PLACE_INDEX_LEAF_SIZE", 16))
+# generate_map's auto-labelling names a marker after a known place centered this close to it
+AUTO_LABEL_RADIUS_KM = float(os.environ.get("AUTO_LABEL_RADIUS_KM", 0.25))
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+class Place(NamedTuple):
+    name: str
+    lat: float
+    lon: float
+    south: float
+    west: float
+    north: float
+    east: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The place in the format of the geocode_many tool."""
+        return {
+            "place": self.name,
+            "lat": self.lat,
+            "lon": self.lon,
+            "southwest": [self.south, self.west],
+            "northeast": [self.north, self.east],
+        }
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle (haversine) distance."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class _Node:
+    """A quadtree node over a lat/lon rectangle: a leaf holding place keys, or four children."""
+
+    __slots__ = ("south", "west", "north", "east", "keys", "children")
+
+    def __init__(self, south: float, west: float, north: float, east: float):
+        self.south, self.west, self.north, self.east = south, west, north, east
+        self.keys: Dict[str, Tuple[float, float]] = {}
+        self.children: Optional[List["_Node"]] = None
+
+    def child(self, lat: float, lon: float) -> "_Node":
+        mid_lat, mid_lon = (self.south + self.north) / 2, (self.west + self.east) / 2
+        return self.children[(lat >= mid_lat) * 2 + (lon >= mid_lon)]
+
+    def split(self) -> None:
+        mid_lat, mid_lon = (self.south + self.north) / 2, (self.west + self.east) / 2
+        self.children = [
+            _Node(self.south, self.west, mid_lat, mid_lon),
+            _Node(self.south, mid_lon, mid_lat, self.east),
+            _Node(mid_lat, self.west, self.north, mid_lon),
+            _Node(mid_lat, mid_lon, self.north, self.east),
+        ]
+        for key, (lat, lon) in self.keys.items():
+            self.child(lat, lon).keys[key] = (lat, lon)
+        self.keys = {}
+
+    def min_distance_km(self, lat: float, lon: float) -> float:
+        """A lower bound on the distance from lat/lon to any point in this node."""
+        d_lat = max(self.south - lat, 0.0, lat - self.north)
+        if self.west <= lon <= self.east:
+            d_lon = 0.0
+        else:
+            d_lon = min((self.west - lon) % 360, (lon - self.east) % 360)
+        # haversine with both cos(lat) factors replaced by the smallest one possible
+        widest = max(abs(lat), abs(self.south), abs(self.north))
+        along = 2 * math.asin(min(1.0, math.cos(math.radians(widest)) * math.sin(math.radians(min(d_lon, 180.0)) / 2)))
+        return EARTH_RADIUS_KM * max(math.radians(d_lat), along)
+
+
+class PlaceIndex:
+    """
+    Spatial index over geocoded places, for local bbox and nearest-place queries.
+
+    Places are stored in the geocode cache's SQLite file (`path`, or memory only when
+    None) and loaded into memory on first use; rows cached before the index existed
+    are imported then. Place centers are kept in a quadtree whose leaves split past
+    `leaf_size` places, so a city full of places is as quick to search as a sparse world map.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_PATH, leaf_size: int = PLACE_INDEX_LEAF_SIZE):
+        self.path = path
+        self.leaf_size = leaf_size
+        self._lock = threading.Lock()
+        self._places: Dict[str, Place] = {}
+        self._root = _Node(-90.0, -180.0, 90.0, 180.0)
+        self._db: Optional[sqlite3.Connection] = None
+        self._loaded = False
+        self.queries = 0
+
+    def _load(self) -> None:
+        # must be called with the lock held
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        created = self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'places'"
+        ).fetchone() is None
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS places ("
+            " key TEXT PRIMARY KEY,"
+            " name TEXT NOT NULL,"
+            " lat REAL NOT NULL, lon REAL NOT NULL,"
+            " south REAL NOT NULL, west REAL NOT NULL, north REAL NOT NULL, east REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        if created:
+            self._import_geocode_rows()
+        for row in self._db.execute("SELECT key, name, lat, lon, south, west, north, east FROM places"):
+            self._insert(row[0], Place(*row[1:]))
+
+    def _import_geocode_rows(self) -> None:
+        has_cache = self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'geocode'"
+        ).fetchone()
+        if not has_cache:
+            return
+        rows = []
+        for key, value in self._db.execute("SELECT key, value FROM geocode WHERE value IS NOT NULL"):
+            place = _place(key, json.loads(value))
+            if place is not None:
+                rows.append((key, *place, time.time()))
+        self._db.executemany("INSERT OR IGNORE INTO places VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _leaf(self, lat: float, lon: float) -> _Node:
+        node = self._root
+        while node.children is not None:
+            node = node.child(lat, lon)
+        return node
+
+    def _insert(self, key: str, place: Place) -> None:
+        self._remove(key)
+        self._places[key] = place
+        # clamp so out-of-range coordinates still land in a leaf
+        point = (min(max(place.lat, -90.0), 90.0), min(max(place.lon, -180.0), 180.0))
+        leaf = self._leaf(*point)
+        leaf.keys[key] = point
+        # identical points cannot be separated, so stop splitting at a tiny cell size
+        if len(leaf.keys) > self.leaf_size and leaf.north - leaf.south > 1e-6:
+            leaf.split()
+
+    def _remove(self, key: str) -> None:
+        place = self._places.pop(key, None)
+        if place is not None:
+            self._leaf(min(max(place.lat, -90.0), 90.0), min(max(place.lon, -180.0), 180.0)).keys.pop(key, None)
+
+    def add(self, place: str, result: Optional[Dict[str, Any]]) -> None:
+        """Index a geocode result (in the `geocode_place` format) under the query that produced it."""
+        entry = _place(place.strip(), result) if result else None
+        if entry is None:
+            return
+        key = normalize_query(place)
+        with self._lock:
+            self._load()
+            if self._places.get(key) == entry:
+                return
+            self._insert(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO places VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, *entry, time.time()),
+                )
+
+    def get(self, place: str) -> Optional[Place]:
+        """A known place by name (normalized like geocode cache keys)."""
+        with self._lock:
+            self._load()
+            self.queries += 1
+            return self._places.get(normalize_query(place))
+
+    def within(self, south: float, west: float, north: float, east: float, limit: int = 50) -> List[Place]:
+        """
+        Known places whose center lies inside the bbox, nearest to its center first.
+
+        Queries that resolved to the same point are returned once, under the shortest name.
+        """
+        places = []
+        with self._lock:
+            self._load()
+            self.queries += 1
+            stack = [self._root]
+            while stack:
+                node = stack.pop()
+                if node.south > north or node.north < south or node.west > east or node.east < west:
+                    continue
+                if node.children is not None:
+                    stack.extend(node.children)
+                    continue
+                for key, (lat, lon) in node.keys.items():
+                    if south <= lat <= north and west <= lon <= east:
+                        places.append(self._places[key])
+        center_lat, center_lon = (south + north) / 2, (west + east) / 2
+        places.sort(key=lambda p: (distance_km(center_lat, center_lon, p.lat, p.lon), len(p.name), p.name))
+        return _distinct(places)[:limit]
+
+    def nearest(self, lat: float, lon: float, max_km: Optional[float] = None) -> Optional[Tuple[Place, float]]:
+        """
+        The known place whose center is nearest to lat/lon, with its distance in km.
+
+        Visits quadtree nodes closest-first and stops once no unvisited node can hold
+        anything closer. Returns None if nothing is known within `max_km`.
+        """
+        limit = math.inf if max_km is None else max_km
+        with self._lock:
+            self._load()
+            self.queries += 1
+            # (distance, name length, key): ties go to the shorter name
+            best: Optional[Tuple[float, int, str]] = None
+            heap: List[Tuple[float, int, _Node]] = [(0.0, 0, self._root)]
+            order = 1
+            while heap:
+                bound, _, node = heapq.heappop(heap)
+                if bound > limit or (best is not None and bound > best[0]):
+                    break
+                if node.children is not None:
+                    for child in node.children:
+                        heapq.heappush(heap, (child.min_distance_km(lat, lon), order, child))
+                        order += 1
+                    continue
+                for key, (place_lat, place_lon) in node.keys.items():
+                    candidate = (distance_km(lat, lon, place_lat, place_lon), len(self._places[key].name), key)
+                    if best is None or candidate < best:
+                        best = candidate
+
+            if best is None or best[0] > limit:
+                return None
+            return self._places[best[2]], best[0]
+
+    def covering(self, places: List[str]) -> Tuple[Optional[Tuple[float, float, float, float]], List[str]]:
+        """
+        The bbox (south, west, north, east) that covers the bboxes of the named places.
+
+        Returns (bbox or None if no place is known, names that are not known).
+        """
+        bbox: Optional[List[float]] = None
+        missing = []
+        with self._lock:
+            self._load()
+            self.queries += 1
+            for name in places:
+                place = self._places.get(normalize_query(name))
+                if place is None:
+                    missing.append(name)
+                elif bbox is None:
+                    bbox = list(place[3:])
+                else:
+                    bbox = [
+                        min(bbox[0], place.south), min(bbox[1], place.west),
+                        max(bbox[2], place.north), max(bbox[3], place.east),
+                    ]
+        return (tuple(bbox) if bbox else None), missing
+
+    def label_markers(self, markers: List[List[Any]], radius_km: float = AUTO_LABEL_RADIUS_KM) -> List[List[Any]]:
+        """
+        Name unlabelled markers after the known place centered within `radius_km` of them.
+
+        Markers are [lat, lon, optional color, optional label]; labelled markers and
+        markers with no place nearby are returned unchanged.
+        """
+        labelled = []
+        for marker in markers:
+            marker = list(marker)
+            if not (marker[3] if len(marker) > 3 else None):
+                found = self.nearest(float(marker[0]), float(marker[1]), max_km=radius_km)
+                if found is not None:
+                    marker = (marker + [None, None])[:4]
+                    marker[3] = found[0].name
+            labelled.append(marker)
+        return labelled
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "places": len(self._places),
+                "queries": self.queries,
+                "loaded": self._loaded,
+            }
+
+
+def _place(name: str, result: Dict[str, Any]) -> Optional[Place]:
+    try:
+        (south, west), (north, east) = result["southwest"], result["northeast"]
+        return Place(name, float(result["lat"]), float(result["lon"]), float(south), float(west), float(north), float(east))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _distinct(places: List[Place]) -> List[Place]:
+    seen: Set[Tuple[float, float]] = set()
+    distinct = []
+    for place in places:
+        point = (round(place.lat, 6), round(place.lon, 6))
+        if point not in seen:
+            seen.add(point)
+            distinct.append(place)
+    return distinct
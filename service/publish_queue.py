@@ -0,0 +1,255 @@
+# publish_queue.py
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from service.ratelimit import TokenBucket
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+
+PUBLISH_QUEUE_PATH = os.environ.get("PUBLISH_QUEUE_PATH", os.path.join(CONFIG_DIR, "publish_queue.sqlite"))
+PUBLISH_WORKERS = int(os.environ.get("PUBLISH_WORKERS", 2))
+PUBLISH_MAX_ATTEMPTS = int(os.environ.get("PUBLISH_MAX_ATTEMPTS", 5))
+PUBLISH_RETRY_BASE = float(os.environ.get("PUBLISH_RETRY_BASE", 30))  # seconds
+PUBLISH_RETRY_MAX = float(os.environ.get("PUBLISH_RETRY_MAX", 30 * 60))
+PUBLISH_MIN_INTERVAL = float(os.environ.get("PUBLISH_MIN_INTERVAL", 60))  # seconds between posts per account
+
+# Uploader signature: (image_paths, caption) -> None, raising on failure
+Uploader = Callable[[List[str], str], Any]
+
+
+class PermanentPublishError(Exception):
+    """Raised by an uploader for a post that retrying cannot fix, e.g. its images are gone."""
+
+
+def content_hash(image_paths: List[str], caption: str, account: str) -> str:
+    """Hash of the account, caption and image bytes, used to drop duplicate posts."""
+    digest = hashlib.sha256()
+    digest.update(account.encode("utf-8") + b"\0" + caption.encode("utf-8"))
+    for path in image_paths:
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+class PublishQueue:
+    """
+    Durable SQLite-backed queue of posts, drained by a pool of background threads.
+
+    Failed uploads are retried with exponential backoff and jitter up to
+    `max_attempts`, except that a PermanentPublishError fails the job at once; posts
+    for the same account are spaced at least `min_interval`
+    seconds apart. Jobs left running by a crashed process are re-queued on start.
+    """
+
+    def __init__(
+        self,
+        uploader: Uploader,
+        path: str = PUBLISH_QUEUE_PATH,
+        workers: int = PUBLISH_WORKERS,
+        max_attempts: int = PUBLISH_MAX_ATTEMPTS,
+        retry_base: float = PUBLISH_RETRY_BASE,
+        retry_max: float = PUBLISH_RETRY_MAX,
+        min_interval: float = PUBLISH_MIN_INTERVAL,
+    ):
+        self.uploader = uploader
+        self.path = path
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._limiters: Dict[str, TokenBucket] = {}
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " content_hash TEXT NOT NULL,"
+            " account TEXT NOT NULL,"
+            " image_paths TEXT NOT NULL,"
+            " caption TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt REAL NOT NULL,"
+            " last_error TEXT,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, next_attempt)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_hash ON jobs (content_hash)")
+
+    def start(self) -> None:
+        """Re-queue interrupted jobs and start the worker threads (idempotent)."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping = False
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', updated = ? WHERE status = 'running'", (time.time(),)
+            )
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"publish-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def enqueue(self, image_paths: List[str], caption: str, account: str = "") -> Tuple[str, bool]:
+        """
+        Queue a post.
+
+        Returns (job_id, duplicate). When an identical post (same account, caption and
+        image contents) is already queued, running or done, its job id is returned instead.
+        Raises ValueError if none of the images exist.
+        """
+        valid_images = [img for img in image_paths if os.path.isfile(img)]
+        if not valid_images:
+            raise ValueError("No valid images found.")
+
+        digest = content_hash(valid_images, caption, account)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM jobs WHERE content_hash = ? AND status != 'failed' ORDER BY created DESC LIMIT 1",
+                (digest,),
+            ).fetchone()
+            if row is not None:
+                return row[0], True
+
+            job_id = uuid.uuid4().hex
+            self._db.execute(
+                "INSERT INTO jobs (id, content_hash, account, image_paths, caption, status, next_attempt, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, digest, account, json.dumps(valid_images), caption, now, now, now),
+            )
+            self._wakeup.notify()
+        self.start()
+        return job_id, False
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Current state of a job, or None if it is unknown."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, account, image_paths, status, attempts, next_attempt, last_error, created, updated"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(
+            ("job_id", "account", "image_paths", "status", "attempts", "next_attempt", "last_error", "created", "updated"),
+            row,
+        ))
+        job["image_paths"] = json.loads(job["image_paths"])
+        if job["status"] not in ("queued", "retrying"):
+            job.pop("next_attempt")
+        return job
+
+    def stats(self) -> Dict[str, int]:
+        """Number of jobs in each status."""
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def pending_paths(self) -> Set[str]:
+        """Image paths of the jobs not finished yet (queued, retrying or running)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT image_paths FROM jobs WHERE status IN ('queued', 'retrying', 'running')"
+            ).fetchall()
+        return {path for (paths,) in rows for path in json.loads(paths)}
+
+    def _limiter(self, account: str) -> TokenBucket:
+        if account not in self._limiters:
+            self._limiters[account] = TokenBucket(rate=1.0 / max(self.min_interval, 1e-6), capacity=1)
+        return self._limiters[account]
+
+    def _claim(self) -> Tuple[Optional[Tuple[str, str, List[str], str, int]], float]:
+        """
+        Take the next due job whose account may post now. Must hold `_lock`.
+
+        Returns (job, seconds to wait before anything else becomes due).
+        """
+        now = time.time()
+        wait = 1.0
+        rows = self._db.execute(
+            "SELECT id, account, image_paths, caption, attempts, next_attempt FROM jobs"
+            " WHERE status IN ('queued', 'retrying') ORDER BY next_attempt LIMIT 100"
+        ).fetchall()
+        for job_id, account, image_paths, caption, attempts, next_attempt in rows:
+            if next_attempt > now:
+                wait = min(wait, next_attempt - now)
+                break
+            limiter = self._limiter(account)
+            if not limiter.try_acquire():
+                wait = min(wait, limiter.retry_after())
+                continue
+            claimed = self._db.execute(
+                "UPDATE jobs SET status = 'running', updated = ? WHERE id = ? AND status IN ('queued', 'retrying')",
+                (now, job_id),
+            ).rowcount
+            if not claimed:
+                # taken by another process sharing the queue
+                continue
+            return (job_id, account, json.loads(image_paths), caption, attempts), 0.0
+        return None, max(wait, 0.01)
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                if self._stopping:
+                    return
+                job, wait = self._claim()
+                if job is None:
+                    self._wakeup.wait(wait)
+                    continue
+
+            job_id, account, image_paths, caption, attempts = job
+            try:
+                self.uploader(image_paths, caption)
+            except PermanentPublishError as e:
+                self._failed(job_id, attempts + 1, f"{type(e).__name__}: {e}", permanent=True)
+            except Exception as e:
+                self._failed(job_id, attempts + 1, f"{type(e).__name__}: {e}")
+            else:
+                with self._lock:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'done', attempts = ?, last_error = NULL, updated = ? WHERE id = ?",
+                        (attempts + 1, time.time(), job_id),
+                    )
+
+    def _failed(self, job_id: str, attempts: int, error: str, permanent: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            if permanent or attempts >= self.max_attempts:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'failed', attempts = ?, last_error = ?, updated = ? WHERE id = ?",
+                    (attempts, error, now, job_id),
+                )
+                return
+            # exponential backoff with +/-50% jitter
+            delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+            self._db.execute(
+                "UPDATE jobs SET status = 'retrying', attempts = ?, last_error = ?, next_attempt = ?, updated = ?"
+                " WHERE id = ?",
+                (attempts, error, now + delay, now, job_id),
+            )
+            self._wakeup.notify()
@@ -0,0 +1,65 @@
+# ratelimit.py
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    `rate` tokens are added per second up to `capacity`. Callers that have to wait
+    reserve their slot up front and then sleep outside the lock, so several threads
+    can queue for consecutive slots while earlier requests are still in flight.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take `tokens` if they are available right now, without waiting."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def release(self, tokens: float = 1.0) -> None:
+        """Give back `tokens` taken for work that did not happen (never above `capacity`)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """
+        Block until `tokens` are available.
+
+        Returns False (without consuming anything) if the wait would exceed `timeout`.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (tokens - self._tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                return False
+            # reserve the tokens now; the balance may go negative until refilled
+            self._tokens -= tokens
+        if wait:
+            time.sleep(wait)
+        return True
+
+    def retry_after(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` would be available."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (tokens - self._tokens) / self.rate)
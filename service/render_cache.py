@@ -0,0 +1,188 @@
+# render_cache.py
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", os.path.join(CACHE_DIR, "renders"))
+RENDER_CACHE_BYTES = int(os.environ.get("RENDER_CACHE_BYTES", 1024 * 1024 * 1024))
+
+# bump when rendering changes so stale artifacts are not served
+RENDER_VERSION = 3
+
+
+def render_key(**params: Any) -> str:
+    """Hash a canonical (JSON, sorted keys) form of the render inputs."""
+    canonical = json.dumps({"version": RENDER_VERSION, **params}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _materialize(source: str, destination: str) -> None:
+    # link (or copy) to a private name and move it into place: concurrent materializations
+    # of one destination each replace it whole, and never write through a link into the cache
+    tmp = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if os.path.lexists(tmp):
+        # left over from a crash; copying onto a link to `source` would fail
+        os.remove(tmp)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)
+    try:
+        os.replace(tmp, destination)
+    finally:
+        # rename does nothing when both names are already links to one file, so `tmp`
+        # can survive a successful replace as well as a failed one
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+
+
+class RenderCache:
+    """
+    Content-addressed store of rendered map artifacts.
+
+    Artifacts live in `directory` named by their render key. An SQLite index tracks
+    sizes, last access and hit/miss counters so that every worker process shares one
+    byte budget and one set of statistics.
+    """
+
+    def __init__(self, directory: str = RENDER_CACHE_DIR, max_bytes: int = RENDER_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"), check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS renders ("
+            " key TEXT PRIMARY KEY,"
+            " filename TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _count(self, name: str) -> None:
+        self._db.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1)"
+            " ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def temp_path(self, key: str, ext: str) -> str:
+        """A private path inside the cache directory to render `key` into before `put`."""
+        return os.path.join(self.directory, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp.{ext}")
+
+    def get(self, key: str, output_filename: str) -> bool:
+        """
+        Materialize the artifact for `key` at `output_filename` if it is cached.
+
+        Returns True on a hit.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT filename FROM renders WHERE key = ?", (key,)).fetchone()
+            path = os.path.join(self.directory, row[0]) if row else None
+            if path is None or not os.path.exists(path):
+                if row is not None:
+                    self._db.execute("DELETE FROM renders WHERE key = ?", (key,))
+                self._count("misses")
+                return False
+            self._db.execute("UPDATE renders SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._count("hits")
+        try:
+            _materialize(path, output_filename)
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            return False
+        return True
+
+    def read(self, key: str) -> Optional[bytes]:
+        """The cached artifact for `key` as bytes, or None on a miss."""
+        with self._lock:
+            row = self._db.execute("SELECT filename FROM renders WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE renders SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._count("hits" if row is not None else "misses")
+        if row is None:
+            return None
+        try:
+            with open(os.path.join(self.directory, row[0]), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            return None
+
+    def _add(self, key: str, rendered_path: str) -> str:
+        filename = key + os.path.splitext(rendered_path)[1]
+        path = os.path.join(self.directory, filename)
+        os.replace(rendered_path, path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO renders (key, filename, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, filename, os.path.getsize(path), time.time()),
+            )
+            self._evict(keep=key)
+        return path
+
+    def put(self, key: str, rendered_path: str, output_filename: str) -> None:
+        """Move a freshly rendered file into the cache and link it to `output_filename`."""
+        _materialize(self._add(key, rendered_path), output_filename)
+
+    def put_bytes(self, key: str, data: bytes, ext: str) -> None:
+        """Store an artifact rendered in memory."""
+        rendered = self.temp_path(key, ext)
+        with open(rendered, "wb") as f:
+            f.write(data)
+        self._add(key, rendered)
+
+    def _evict(self, keep: str) -> None:
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM renders").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - int(self.max_bytes * 0.9)
+        victims = []
+        for key, filename, size in self._db.execute(
+            "SELECT key, filename, size FROM renders WHERE key != ? ORDER BY accessed", (keep,)
+        ):
+            victims.append((key, filename))
+            excess -= size
+            if excess <= 0:
+                break
+        for key, filename in victims:
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+            self._db.execute("DELETE FROM renders WHERE key = ?", (key,))
+            self._count("evictions")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters across all processes and the current cache size."""
+        with self._lock:
+            counters = dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+            entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM renders").fetchone()
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
+
+
+render_cache = RenderCache()
+
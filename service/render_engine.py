@@ -0,0 +1,306 @@
+# render_engine.py
+import asyncio
+import itertools
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from service import tracing
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 1))
+RENDER_QUEUE_DEPTH = int(os.environ.get("RENDER_QUEUE_DEPTH", 2 * RENDER_WORKERS))
+RENDER_TIMEOUT = float(os.environ.get("RENDER_TIMEOUT", 120))
+# how long a finished streaming job's last items may take to arrive (seconds)
+STREAM_DRAIN_TIMEOUT = 5.0
+
+
+class RenderError(Exception):
+    """Base class for render engine failures."""
+
+
+class RenderQueueFull(RenderError):
+    """Raised when the engine already holds as many jobs as it is allowed to queue."""
+
+
+class RenderTimeout(RenderError):
+    """Raised when a render job exceeds its time limit."""
+
+
+# in worker processes: where streaming jobs send their items (see RenderEngine.stream)
+_stream_queue: Optional[Any] = None
+
+
+def _init_worker(stream_queue: Any = None) -> None:
+    global _stream_queue
+    _stream_queue = stream_queue
+
+    # import the heavy plotting stack once per worker and pin the non-interactive backend
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import pyproj  # noqa: F401
+    import contextily  # noqa: F401
+    from service.canvas import canvas_pool
+    from service.generate_map import RENDER_PROFILES
+
+    # one figure per size the profiles use, ready for the first render
+    for figsize in {profile["figsize"] for profile in RENDER_PROFILES.values()}:
+        canvas_pool.preallocate(figsize)
+
+
+def _noop() -> None:
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise TimeoutError("render job timed out")
+
+
+def _run_job(func: Callable[..., Any], kwargs: Dict[str, Any], timeout: Optional[float]) -> Tuple[Any, List[tracing.Span]]:
+    # enforce the time limit inside the worker so a stuck job frees its process
+    if timeout:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        # spans recorded in the worker travel back with the result
+        with tracing.collect() as spans:
+            result = func(**kwargs)
+        return result, spans
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _stream_job(generator: Callable[..., Iterator[Any]], job_id: int, kwargs: Dict[str, Any]) -> None:
+    # items go back through the pool's shared queue as they are produced; None ends the stream
+    try:
+        for item in generator(**kwargs):
+            _stream_queue.put((job_id, item))
+    finally:
+        _stream_queue.put((job_id, None))
+
+
+def _generate_map(**kwargs: Any) -> str:
+    from service.generate_map import generate_map
+
+    return generate_map(**kwargs)
+
+
+def _generate_map_bytes(**kwargs: Any) -> Tuple[bytes, str]:
+    from service.generate_map import generate_map_bytes
+
+    return generate_map_bytes(**kwargs)
+
+
+def _generate_maps(**kwargs: Any) -> Iterator[Tuple[int, Any]]:
+    from service.generate_map import generate_maps
+
+    return generate_maps(**kwargs)
+
+
+class RenderEngine:
+    """
+    Runs map renders in a pool of warm worker processes.
+
+    At most `workers` jobs run at once and at most `max_queue` more wait for a worker;
+    beyond that `submit` fails fast with RenderQueueFull. Each job is limited to `timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        workers: int = RENDER_WORKERS,
+        max_queue: int = RENDER_QUEUE_DEPTH,
+        timeout: Optional[float] = RENDER_TIMEOUT,
+    ):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # streaming jobs: job id -> (event loop, asyncio.Queue) their items are delivered to
+        self._streams: Dict[int, Tuple[asyncio.AbstractEventLoop, "asyncio.Queue[Any]"]] = {}
+        self._stream_queue: Optional[Any] = None
+        self._job_ids = itertools.count()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def start(self) -> None:
+        """Start the worker processes (done lazily on the first job otherwise)."""
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: the parent holds an event loop, threads and sqlite handles
+                context = multiprocessing.get_context("spawn")
+                # a queue can only reach the workers as they start, so each pool gets its own
+                self._stream_queue = context.Queue()
+                threading.Thread(
+                    target=self._dispatch, args=(self._stream_queue,), name="render-streams", daemon=True
+                ).start()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self._stream_queue,),
+                )
+                # ProcessPoolExecutor spawns workers on demand; bring them all up now
+                for _ in range(self.workers):
+                    self._pool.submit(_noop)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+            stream_queue, self._stream_queue = self._stream_queue, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if stream_queue is not None:
+            # stops the dispatch thread
+            stream_queue.put(None)
+
+    def _dispatch(self, stream_queue: Any) -> None:
+        """Hand items from streaming jobs to the event loop of whoever is iterating them."""
+        while True:
+            message = stream_queue.get()
+            if message is None:
+                return
+            job_id, item = message
+            with self._lock:
+                target = self._streams.get(job_id)
+            if target is not None:
+                loop, items = target
+                loop.call_soon_threadsafe(items.put_nowait, item)
+
+    async def submit(self, func: Callable[..., Any], timeout: Optional[float] = None, **kwargs: Any) -> Any:
+        """Run `func(**kwargs)` in a worker process and await its result."""
+        timeout = timeout if timeout is not None else self.timeout
+        self.start()
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise RenderQueueFull(
+                    f"Render queue is full ({self.in_flight} jobs in flight), try again shortly"
+                )
+            self.in_flight += 1
+
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._pool, _run_job, func, kwargs, timeout)
+            # the worker enforces the time limit itself; the outer wait also covers time spent queued
+            outer = None if timeout is None else timeout * (1 + self.max_queue / self.workers) + 5
+            result, spans = await asyncio.wait_for(future, outer)
+        except (TimeoutError, asyncio.TimeoutError) as e:
+            with self._lock:
+                self.timed_out += 1
+            raise RenderTimeout(f"Render timed out after {timeout}s") from e
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for memory); start a fresh pool for the next job
+            with self._lock:
+                self.failed += 1
+            self.shutdown()
+            raise
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        with self._lock:
+            self.completed += 1
+        tracing.adopt(spans)
+        return result
+
+    async def stream(
+        self, func: Callable[..., Iterator[Any]], timeout: Optional[float] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        """
+        Run the generator function `func(**kwargs)` in a worker process, yielding its items as they are produced.
+
+        The job is admitted, limited and counted like `submit`; its errors are raised
+        after the items produced before them.
+        """
+        job_id = next(self._job_ids)
+        items: "asyncio.Queue[Any]" = asyncio.Queue()
+        with self._lock:
+            self._streams[job_id] = (asyncio.get_running_loop(), items)
+        job = asyncio.ensure_future(
+            self.submit(_stream_job, timeout=timeout, generator=func, job_id=job_id, kwargs=kwargs)
+        )
+        try:
+            while True:
+                getter = asyncio.ensure_future(items.get())
+                # never wait on the queue alone: a killed worker never sends the end marker
+                await asyncio.wait({getter, job}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    # raises if the job failed (e.g. BrokenProcessPool)
+                    job.result()
+                    async for item in self._drain(items):
+                        yield item
+                    break
+                item = getter.result()
+                if item is None:
+                    break
+                yield item
+            await job
+        finally:
+            with self._lock:
+                self._streams.pop(job_id, None)
+            job.cancel()
+
+    @staticmethod
+    async def _drain(items: "asyncio.Queue[Any]") -> AsyncIterator[Any]:
+        """
+        Items of a job that finished successfully, up to its end marker.
+
+        The worker sent the marker before returning, but the last items may still be
+        between the dispatch thread and this loop; wait at most STREAM_DRAIN_TIMEOUT for them.
+        """
+        while True:
+            try:
+                item = items.get_nowait()
+            except asyncio.QueueEmpty:
+                try:
+                    item = await asyncio.wait_for(items.get(), STREAM_DRAIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    return
+            if item is None:
+                return
+            yield item
+
+    async def render(self, **kwargs: Any) -> str:
+        """Run `generate_map(**kwargs)` in a worker process. Returns the output path."""
+        return await self.submit(_generate_map, **kwargs)
+
+    async def render_bytes(self, **kwargs: Any) -> Tuple[bytes, str]:
+        """Run `generate_map_bytes(**kwargs)` in a worker process. Returns (encoded image, format)."""
+        return await self.submit(_generate_map_bytes, **kwargs)
+
+    def render_many(self, specs: List[Dict[str, Any]], use_cache: bool = True) -> AsyncIterator[Tuple[int, Any]]:
+        """
+        Run `generate_maps(specs)` in one worker process, yielding (spec index, output) as each map finishes.
+
+        The time limit is the per-render timeout times the number of maps.
+        """
+        timeout = self.timeout * max(1, len(specs)) if self.timeout else self.timeout
+        return self.stream(_generate_maps, timeout=timeout, specs=specs, use_cache=use_cache)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+
+render_engine = RenderEngine()
@@ -0,0 +1,314 @@
+# tiles.py
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+import mercantile
+import numpy as np
+import requests
+from matplotlib import patheffects
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from xyzservices import TileProvider
+
+from service.tracing import bind, span
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+TILE_CACHE_PATH = os.environ.get("TILE_CACHE_PATH", os.path.join(CACHE_DIR, "tiles.sqlite"))
+TILE_CACHE_BYTES = int(os.environ.get("TILE_CACHE_BYTES", 512 * 1024 * 1024))
+TILE_WORKERS = int(os.environ.get("TILE_WORKERS", 8))
+MAX_PREFETCH_TILES = int(os.environ.get("MAX_PREFETCH_TILES", 5000))
+
+# (west, south, east, north) in lon/lat
+Bounds = Tuple[float, float, float, float]
+
+
+class TileStore:
+    """
+    Size-bounded on-disk tile store.
+
+    Tiles are kept as blobs in a SQLite database, so several server/worker processes
+    can share one store safely. Once the stored bytes exceed `max_bytes` the least
+    recently used tiles are evicted.
+
+    The stored size is tracked in memory (seeded from the database on open, resynced
+    before each eviction), and access times are written in batches, so reads and
+    writes don't scan the table or write on every hit.
+    """
+
+    # pending access times are flushed once this many have piled up, or after this many seconds
+    TOUCH_BATCH = 256
+    TOUCH_INTERVAL = 5.0
+
+    def __init__(self, path: str = TILE_CACHE_PATH, max_bytes: int = TILE_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tiles ("
+            " key TEXT PRIMARY KEY,"
+            " data BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)")
+        self._bytes = self._total()
+        self._touched: Dict[str, float] = {}
+        self._flushed = time.monotonic()
+
+    def _total(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()[0]
+
+    def _flush_touched(self) -> None:
+        if self._touched:
+            self._db.executemany(
+                "UPDATE tiles SET accessed = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()]
+            )
+            self._touched.clear()
+        self._flushed = time.monotonic()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM tiles WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.TOUCH_BATCH or time.monotonic() - self._flushed > self.TOUCH_INTERVAL:
+                self._flush_touched()
+            return row[0]
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM tiles WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            old = self._db.execute("SELECT size FROM tiles WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO tiles (key, data, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            self._touched.pop(key, None)
+            self._bytes += len(data) - (old[0] if old else 0)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # other processes write to the store too: count it properly before evicting, and
+        # record pending access times so recently read tiles are kept
+        self._flush_touched()
+        self._bytes = self._total()
+        if self._bytes <= self.max_bytes:
+            return
+        # trim to 90% of the budget so we don't evict on every insert
+        excess = self._bytes - int(self.max_bytes * 0.9)
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM tiles ORDER BY accessed"):
+            victims.append((key,))
+            excess -= size
+            self._bytes -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM tiles WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM tiles")
+            self._touched.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters for this process and the size of the shared store."""
+        with self._lock:
+            entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tiles").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+            }
+
+
+tile_store = TileStore()
+
+_session = requests.Session()
+_session.headers["User-Agent"] = "Dan-MCP-Server/1.0"
+_session.mount("https://", HTTPAdapter(pool_maxsize=TILE_WORKERS))
+_session.mount("http://", HTTPAdapter(pool_maxsize=TILE_WORKERS))
+
+
+def _tile_key(source: TileProvider, tile: mercantile.Tile) -> str:
+    return f"{source.name}/{tile.z}/{tile.x}/{tile.y}"
+
+
+def fetch_tile(source: TileProvider, tile: mercantile.Tile) -> bytes:
+    """Return the encoded image of `tile`, from the store if possible, else from the tile server."""
+    key = _tile_key(source, tile)
+    data = tile_store.get(key)
+    if data is not None:
+        return data
+
+    with span("tiles.fetch"):
+        response = _session.get(source.build_url(x=tile.x, y=tile.y, z=tile.z), timeout=30)
+        response.raise_for_status()
+    data = response.content
+    tile_store.put(key, data)
+    return data
+
+
+def calculate_zoom(bounds: Bounds, source: TileProvider) -> int:
+    """Pick a zoom level for lon/lat `bounds` the same way contextily does, clamped to the provider."""
+    west, south, east, north = bounds
+    zoom_lon = np.ceil(np.log2(360 * 2.0 / abs(east - west)))
+    zoom_lat = np.ceil(np.log2(360 * 2.0 / abs(north - south)))
+    zoom = int(min(zoom_lon, zoom_lat))
+    return max(source.get("min_zoom", 0), min(zoom, source.get("max_zoom", 22)))
+
+
+def _fetch_all(source: TileProvider, tiles: List[mercantile.Tile]) -> List[bytes]:
+    with ThreadPoolExecutor(max_workers=max(1, min(TILE_WORKERS, len(tiles)))) as executor:
+        return list(executor.map(bind(lambda t: fetch_tile(source, t)), tiles))
+
+
+def basemap_image(bounds: Bounds, source: TileProvider, zoom: Optional[int] = None) -> Tuple[np.ndarray, Tuple[float, float, float, float]]:
+    """
+    Stitch the tiles covering lon/lat `bounds` into one RGBA array.
+
+    Returns the image and its extent (xmin, xmax, ymin, ymax) in EPSG:3857.
+    """
+    if zoom is None:
+        zoom = calculate_zoom(bounds, source)
+    tiles = list(mercantile.tiles(*bounds, zooms=[zoom]))
+    arrays = [np.asarray(Image.open(BytesIO(data)).convert("RGBA")) for data in _fetch_all(source, tiles)]
+
+    xs = [t.x for t in tiles]
+    ys = [t.y for t in tiles]
+    h, w, d = arrays[0].shape
+    image = np.zeros(((max(ys) - min(ys) + 1) * h, (max(xs) - min(xs) + 1) * w, d), dtype=np.uint8)
+    for t, arr in zip(tiles, arrays):
+        x, y = t.x - min(xs), t.y - min(ys)
+        image[y * h:(y + 1) * h, x * w:(x + 1) * w, :] = arr
+
+    left = mercantile.xy_bounds(mercantile.Tile(min(xs), min(ys), zoom))
+    right = mercantile.xy_bounds(mercantile.Tile(max(xs), max(ys), zoom))
+    return image, (left.left, right.right, right.bottom, left.top)
+
+
+def tile_count(bounds: Bounds, zoom: int) -> int:
+    """Number of tiles covering lon/lat `bounds` at `zoom`."""
+    west, south, east, north = bounds
+    top_left = mercantile.tile(west, north, zoom)
+    bottom_right = mercantile.tile(east, south, zoom)
+    return (abs(bottom_right.x - top_left.x) + 1) * (abs(bottom_right.y - top_left.y) + 1)
+
+
+def add_basemap(ax, source: TileProvider, zoom: Optional[int] = None) -> None:
+    """
+    Drop-in replacement for `contextily.add_basemap` for axes in EPSG:3857, backed by `tile_store`.
+
+    When every tile is already stored no network request is made.
+    """
+    xmin, xmax, ymin, ymax = ax.axis()
+    west, south = mercantile.lnglat(xmin, ymin)
+    east, north = mercantile.lnglat(xmax, ymax)
+    with span("basemap"):
+        image, extent = basemap_image((west, south, east, north), source, zoom)
+    show_basemap(ax, image, extent, source)
+
+
+def show_basemap(ax, image: np.ndarray, extent: Tuple[float, float, float, float], source: TileProvider) -> List[Any]:
+    """
+    Draw a stitched basemap (see `basemap_image`) under the current view of `ax`, keeping its limits.
+
+    The image may cover more than the view, e.g. when it is shared by several maps.
+    Returns the artists added (image and attribution).
+    """
+    xmin, xmax, ymin, ymax = ax.axis()
+    artists = [ax.imshow(image, extent=extent, interpolation="bilinear", aspect=ax.get_aspect())]
+    ax.axis((xmin, xmax, ymin, ymax))
+
+    attribution = source.get("attribution")
+    if attribution:
+        artists.append(_add_attribution(ax, attribution))
+    return artists
+
+
+def _add_attribution(ax, text: str, font_size: int = 8) -> Any:
+    # same as contextily.add_attribution, but sizes the axes with apply_aspect()
+    # instead of a full pyplot draw() of the figure
+    ax.apply_aspect()
+    text_artist = ax.text(
+        0.005,
+        0.005,
+        text,
+        transform=ax.transAxes,
+        size=font_size,
+        path_effects=[patheffects.withStroke(linewidth=2, foreground="w")],
+        wrap=True,
+    )
+    wrap_width = ax.get_window_extent().width * 0.99
+    text_artist._get_wrap_line_width = lambda: wrap_width
+    return text_artist
+
+
+def prefetch_tiles(
+    border: Tuple[Tuple[float, float], Tuple[float, float]],
+    zoom_range: Tuple[int, int],
+    source: TileProvider,
+    workers: int = TILE_WORKERS,
+) -> Dict[str, Any]:
+    """
+    Warm `tile_store` with every tile covering `border` for each zoom in `zoom_range` (inclusive),
+    fetching up to `workers` tiles at once.
+
+    `border`: ((south, west), (north, east)) in lat/lon.
+
+    Returns a summary with the number of tiles requested, already cached and fetched.
+    """
+    (south, west), (north, east) = border
+    zooms = range(zoom_range[0], zoom_range[1] + 1)
+    # count before enumerating: a large area at high zoom has billions of tiles
+    count = sum(tile_count((west, south, east, north), z) for z in zooms)
+    if count > MAX_PREFETCH_TILES:
+        raise ValueError(f"Refusing to prefetch {count} tiles (limit {MAX_PREFETCH_TILES})")
+    tiles = [t for z in zooms for t in mercantile.tiles(west, south, east, north, zooms=[z])]
+
+    missing = [t for t in tiles if not tile_store.contains(_tile_key(source, t))]
+    failed = 0
+    if missing:
+        def fetch(tile: mercantile.Tile) -> bool:
+            try:
+                fetch_tile(source, tile)
+                return True
+            except requests.RequestException:
+                return False
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(missing)))) as executor:
+            failed = sum(not ok for ok in executor.map(bind(fetch), missing))
+
+    return {
+        "tiles": len(tiles),
+        "cached": len(tiles) - len(missing),
+        "fetched": len(missing) - failed,
+        "failed": failed,
+    }
@@ -0,0 +1,96 @@
+# tracing.py
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from service import metrics
+
+logger = logging.getLogger("uncover.trace")
+
+span_seconds = metrics.histogram("uncover_span_seconds", "Duration of traced operations.", ("span",))
+
+# the span currently open in this thread/task, and (in render workers) the list that
+# finished root spans are collected into instead of being logged
+_current: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("span", default=None)
+_collected: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar("collected", default=None)
+
+Span = Dict[str, Any]
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Time a block as a span nested under the currently open one.
+
+    Durations are recorded in the uncover_span_seconds histogram. A finished root span
+    is logged as a tree at DEBUG level on the "uncover.trace" logger; nothing is
+    formatted when that level is disabled.
+    """
+    parent = _current.get()
+    record: Span = {"name": name, "attributes": attributes, "children": []}
+    token = _current.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["duration"] = time.perf_counter() - start
+        _current.reset(token)
+        span_seconds.observe(name, value=record["duration"])
+        if parent is not None:
+            parent["children"].append(record)
+        else:
+            _finish_root(record)
+
+
+def _finish_root(record: Span) -> None:
+    collected = _collected.get()
+    if collected is not None:
+        collected.append(record)
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug("trace:\n%s", format_tree(record))
+
+
+@contextmanager
+def collect() -> Iterator[List[Span]]:
+    """Gather root spans finished inside the block (e.g. in a worker process) to ship to `adopt`."""
+    spans: List[Span] = []
+    token = _collected.set(spans)
+    try:
+        yield spans
+    finally:
+        _collected.reset(token)
+
+
+def adopt(spans: List[Span]) -> None:
+    """Attach spans recorded elsewhere under the current span and record their durations here."""
+    def observe(record: Span) -> None:
+        span_seconds.observe(record["name"], value=record["duration"])
+        for child in record["children"]:
+            observe(child)
+
+    parent = _current.get()
+    for record in spans:
+        observe(record)
+        if parent is not None:
+            parent["children"].append(record)
+        else:
+            _finish_root(record)
+
+
+def bind(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap `func` to run in a copy of the caller's context, so spans opened in a pool thread nest correctly."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(func, *args, **kwargs)
+
+
+def format_tree(record: Span, depth: int = 0) -> str:
+    attributes = "".join(f" {k}={v}" for k, v in record["attributes"].items())
+    error = f" error={record['error']}" if "error" in record else ""
+    lines = [f"{'  ' * depth}{record['name']} {record['duration'] * 1e3:.1f}ms{attributes}{error}"]
+    lines.extend(format_tree(child, depth + 1) for child in record["children"])
+    return "\n".join(lines)